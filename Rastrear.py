@@ -1,7 +1,11 @@
 import os
-from PIL import Image,ImageDraw, ImageFont
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 import numpy as np
 import cv2
+from box_ops import Detections, boxes_to_numpy, empty_detections, iou_matrix, select, xywh_to_xyxy
 
 
 def criar_pasta_para_facas(diretorio="detected_knives"):  
@@ -13,77 +17,183 @@ def criar_pasta_para_facas(diretorio="detected_knives"):
         print(f"Pasta já existente: {caminho_absoluto}")  
     return caminho_absoluto  
 
-# Função para rastrear ou criar ID para facas  
-def rastrear_ou_criar_id(box, trackers, proximo_id):  
-    for existing_id, tracker_info in trackers.items():  
-        tracked_box, _ = tracker_info  
-        iou = calcular_iou(box, tracked_box)  
-        if iou > 0.5:  
-            return existing_id, proximo_id, trackers  
-    object_id = proximo_id  
-    proximo_id += 1  
-    return object_id, proximo_id, trackers  
-
-# Função para calcular IOU (Intersection over Union)  
+# Função para calcular IOU (Intersection over Union) entre duas caixas xywh
 def calcular_iou(box1, box2):  
-    x1, y1, w1, h1 = box1  
-    x2, y2, w2, h2 = box2  
-    xi1 = max(x1, x2)  
-    yi1 = max(y1, y2)   
-    xi2 = min(x1 + w1, x2 + w2)  
-    yi2 = min(y1 + h1, y2 + h2)  
-    inter_area = max(0, xi2 - xi1) * max(0, yi2 - yi1)  
-    box1_area = w1 * h1  
-    box2_area = w2 * h2  
-    iou = inter_area / float(box1_area + box2_area - inter_area)  
-    return iou
+    return float(iou_matrix(xywh_to_xyxy(box1), xywh_to_xyxy(box2))[0, 0])
 
+# Parâmetros do rastreador por sessão
+LIMIAR_IOU_RASTREIO = float(os.getenv('TRACK_IOU_THRESHOLD', 0.3))
+MAX_IDADE_TRILHA = int(os.getenv('TRACK_MAX_AGE', 15))  # quadros sem detecção antes de descartar
+MAX_SESSOES = int(os.getenv('TRACK_MAX_SESSIONS', 1000))
+TTL_SESSAO = int(os.getenv('TRACK_SESSION_TTL', 300))  # segundos sem quadros antes de descartar
 
-import cv2
-import numpy as np
+# scipy é importado só na primeira associação (não pesa no tempo de inicialização)
+_linear_sum_assignment = None
 
-def ProcessarWEBCAM(boxes, confidence_threshold, image_np):
-    trackers = {}  # Dicionário para armazenar os rastreadores
-    detections = []  # Lista para armazenar as detecções
-    has_detections = False  # Variável para verificar se há detecções
+def linear_sum_assignment_disponivel():
+    global _linear_sum_assignment
+    if _linear_sum_assignment is None:
+        try:
+            from scipy.optimize import linear_sum_assignment
+            _linear_sum_assignment = linear_sum_assignment
+        except ImportError:
+            _linear_sum_assignment = False
+    return _linear_sum_assignment
+
+
+# Matriz de IoU entre dois conjuntos de caixas xyxy (N x 4 e M x 4 -> N x M)
+matriz_iou = iou_matrix
+
+
+# Associa linhas (trilhas) e colunas (detecções) pela matriz de IoU
+def associar_deteccoes(iou, limiar):
+    if iou.size == 0:
+        return []
+    linear_sum_assignment = linear_sum_assignment_disponivel()
+    if linear_sum_assignment:
+        # Algoritmo húngaro (ótimo) quando o scipy está disponível
+        linhas, colunas = linear_sum_assignment(-iou)
+        return [(l, c) for l, c in zip(linhas, colunas) if iou[l, c] >= limiar]
+
+    # Guloso: pares com maior IoU primeiro
+    pares = np.argwhere(iou >= limiar)
+    ordem = np.argsort(-iou[pares[:, 0], pares[:, 1]], kind='stable')
+    usadas_l, usadas_c, associacoes = set(), set(), []
+    for l, c in pares[ordem]:
+        if l not in usadas_l and c not in usadas_c:
+            usadas_l.add(l)
+            usadas_c.add(c)
+            associacoes.append((l, c))
+    return associacoes
+
+
+class Rastreador:
+    """Rastreador multi-objeto por IoU com IDs estáveis entre quadros"""
+
+    def __init__(self, limiar_iou=LIMIAR_IOU_RASTREIO, max_idade=MAX_IDADE_TRILHA):
+        self.limiar_iou = limiar_iou
+        self.max_idade = max_idade
+        self.trilhas = {}  # id -> {'box': array xyxy, 'idade': quadros sem detecção, 'hits': detecções}
+        self.proximo_id = 1
+        self.ultimo_uso = time.time()
+        self.lock = threading.Lock()
+
+    def atualizar(self, caixas):
+        """
+        Associa as caixas xyxy do quadro atual às trilhas existentes
+
+        Retorna uma lista (id, novo) na mesma ordem das caixas.
+        """
+        caixas = np.asarray(caixas, dtype=np.float32).reshape(-1, 4)
+        with self.lock:
+            self.ultimo_uso = time.time()
+            ids = list(self.trilhas)
+            caixas_trilhas = np.array([self.trilhas[i]['box'] for i in ids], dtype=np.float32).reshape(-1, 4)
+
+            resultado = [None] * len(caixas)
+            for l, c in associar_deteccoes(matriz_iou(caixas_trilhas, caixas), self.limiar_iou):
+                trilha = self.trilhas[ids[l]]
+                trilha['box'] = caixas[c]
+                trilha['idade'] = 0
+                trilha['hits'] += 1
+                resultado[c] = (ids[l], False)
+
+            # Trilhas sem detecção envelhecem e são descartadas após max_idade quadros
+            associados = {r[0] for r in resultado if r is not None}
+            for object_id in ids:
+                if object_id not in associados:
+                    self.trilhas[object_id]['idade'] += 1
+                    if self.trilhas[object_id]['idade'] > self.max_idade:
+                        del self.trilhas[object_id]
+
+            # Detecções sem trilha recebem um novo ID
+            for c, r in enumerate(resultado):
+                if r is None:
+                    object_id = self.proximo_id
+                    self.proximo_id += 1
+                    self.trilhas[object_id] = {'box': caixas[c], 'idade': 0, 'hits': 1}
+                    resultado[c] = (object_id, True)
+
+            return resultado
+
+
+class GerenciadorSessoes:
+    """
+    Um objeto por sessão de cliente (por padrão um Rastreador), com limite de
+    sessões e expiração por inatividade
+
+    Cada sessão tem a sua trava: `usar` entrega o objeto com a trava tomada,
+    para que dois quadros da mesma sessão (HTTP e WebSocket, ou uma
+    retransmissão do cliente) não alterem o estado ao mesmo tempo.
+    """
 
-    # Iterar sobre as caixas de detecção
-    for box in boxes:
-        # Obter a confiança (aqui assumimos que 'conf' é um tensor)
-        confidence = box.conf.item()  # Pega o valor escalar da confiança
+    def __init__(self, max_sessoes=MAX_SESSOES, ttl=TTL_SESSAO, fabrica=Rastreador):
+        self.max_sessoes = max_sessoes
+        self.ttl = ttl
+        self.fabrica = fabrica
+        self.sessoes = OrderedDict()  # id -> (objeto, último acesso, trava da sessão)
+        self.lock = threading.Lock()
 
-        # Verifique se a confiança está acima do limiar
-        if confidence >= confidence_threshold:
-            has_detections = True
+    def _entrada(self, sessao_id):
+        with self.lock:
+            agora = time.time()
+            while self.sessoes:
+                antiga_id, (_, ultimo_uso, _) = next(iter(self.sessoes.items()))
+                if agora - ultimo_uso <= self.ttl and len(self.sessoes) < self.max_sessoes:
+                    break
+                del self.sessoes[antiga_id]
 
-            # Extrair as coordenadas xyxy (convertendo para inteiros)
-            x1, y1, x2, y2 = map(int, box.xyxy[0].cpu().numpy())  # .cpu().numpy() para converter o tensor em array
+            objeto, _, trava = self.sessoes.pop(sessao_id, None) or (self.fabrica(), agora, threading.Lock())
+            self.sessoes[sessao_id] = (objeto, agora, trava)  # mais recente no fim
+            return objeto, trava
 
-            # Calcular o centro da caixa
-            center = ((x1 + x2) // 2, (y1 + y2) // 2)
+    def obter(self, sessao_id):
+        return self._entrada(sessao_id)[0]
 
-            # Inicializar o rastreador com o centro da caixa
-            object_id = len(trackers) + 1  # Atribuir um ID único ao objeto
-            trackers[object_id] = [center]  # Armazenar o ponto inicial no dicionário
+    @contextmanager
+    def usar(self, sessao_id):
+        # Objeto da sessão com a trava da sessão tomada até o fim do bloco
+        objeto, trava = self._entrada(sessao_id)
+        with trava:
+            yield objeto
 
-            # Adicionar a detecção à lista de detecções
-            detections.append({
-                'confidence': float(confidence),
-                'id': object_id,
-                'box': [x1, y1, x2, y2]
-            })
+    def __len__(self):
+        return len(self.sessoes)
 
-    return has_detections, detections, trackers
+
+def ProcessarWEBCAM(boxes, confidence_threshold, image_np, rastreador=None):
+    if rastreador is None:
+        rastreador = Rastreador()
+    detections = []  # Lista para armazenar as detecções
+
+    # Obter confianças e coordenadas xyxy de todas as caixas com uma única cópia,
+    # mantendo apenas as caixas acima do limiar
+    caixas, confiancas, _ = boxes_to_numpy(boxes, min_conf=confidence_threshold)
+
+    # Associar as caixas às trilhas da sessão (IDs estáveis entre quadros)
+    for confidence, box, (object_id, novo) in zip(confiancas, caixas, rastreador.atualizar(caixas)):
+        x1, y1, x2, y2 = map(int, box)
+        detections.append({
+            'confidence': float(confidence),
+            'id': object_id,
+            'box': [x1, y1, x2, y2],
+            'new': novo
+        })
+
+    has_detections = len(detections) > 0  # Variável para verificar se há detecções
+    return has_detections, detections, rastreador.trilhas
 
 # Função para atualizar os rastreadores usando movimento óptico
-def atualizar_rastreadores(image_np, trackers):
+# (fluxo do quadro anterior para o atual; antes o mesmo quadro era usado duas vezes)
+def atualizar_rastreadores(imagem_anterior, image_np, trackers):
+    gray_anterior = cv2.cvtColor(imagem_anterior, cv2.COLOR_BGR2GRAY)
     gray = cv2.cvtColor(image_np, cv2.COLOR_BGR2GRAY)
     new_trackers = {}
 
     for obj_id, points in trackers.items():
         if points:
             prev_point = np.float32(points[-1]).reshape(-1, 1, 2)
-            new_point, status, _ = cv2.calcOpticalFlowPyrLK(gray, gray, prev_point, None, **lk_params)
+            new_point, status, _ = cv2.calcOpticalFlowPyrLK(gray_anterior, gray, prev_point, None, **lk_params)
 
             if status[0] == 1:
                 new_trackers[obj_id] = points + [tuple(new_point[0][0])]
@@ -94,9 +204,123 @@ def atualizar_rastreadores(image_np, trackers):
 lk_params = dict(winSize=(15, 15),
                  maxLevel=2,
                  criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+
+# Propagação de caixas entre quadros-chave
+INTERVALO_QUADROS_CHAVE = int(os.getenv('FLOW_KEYFRAME_INTERVAL', 0))  # 0/1 = YOLO em todo quadro
+LARGURA_FLUXO = int(os.getenv('FLOW_WIDTH', 480))  # largura do quadro usado no fluxo óptico
+PONTOS_POR_CAIXA = 12
+MIN_PONTOS = 3
+
+
+def _dispersao(pontos):
+    # Distância média dos pontos ao seu centro (para estimar a mudança de escala)
+    return float(np.sqrt(((pontos - pontos.mean(axis=0)) ** 2).sum(axis=1).mean()))
+
+
+class PropagadorCaixas:
+    """
+    Move as caixas do último quadro-chave com fluxo óptico esparso (Lucas-Kanade)
+
+    O YOLO roda a cada `intervalo` quadros (`quadro_chave`); nos quadros entre
+    eles, `propagar` acompanha pontos de interesse de cada caixa do quadro
+    anterior para o atual e desloca/escala a caixa pela mediana do movimento.
+    Caixas que perdem os pontos são descartadas até o próximo quadro-chave.
+    Guarda o quadro anterior reduzido a `largura` px, um estado por stream.
+    """
+
+    def __init__(self, intervalo=INTERVALO_QUADROS_CHAVE, largura=LARGURA_FLUXO):
+        self.intervalo = intervalo
+        self.largura = largura
+        self.cinza_anterior = None
+        self.escala = 1.0
+        self.deteccoes = empty_detections()  # caixas em pixels do quadro original
+        self.pontos = []  # por caixa: (K, 1, 2) em pixels do quadro reduzido
+        self.desde_chave = 0
+        self.lock = threading.Lock()
+
+    def _cinza(self, imagem):
+        gray = imagem if imagem.ndim == 2 else cv2.cvtColor(imagem, cv2.COLOR_BGR2GRAY)
+        altura, largura = gray.shape
+        escala = min(1.0, self.largura / largura)
+        if escala < 1.0:
+            gray = cv2.resize(gray, (int(largura * escala), int(altura * escala)), interpolation=cv2.INTER_AREA)
+        return gray, escala
+
+    def precisa_inferencia(self):
+        with self.lock:
+            return self.cinza_anterior is None or self.desde_chave + 1 >= max(1, self.intervalo)
+
+    def quadro_chave(self, imagem, deteccoes):
+        """Recomeça a partir das detecções do YOLO (`Detections` ou `Boxes`)"""
+        gray, escala = self._cinza(imagem)
+        deteccoes = boxes_to_numpy(deteccoes)
+        with self.lock:
+            self.cinza_anterior, self.escala = gray, escala
+            self.deteccoes = Detections(deteccoes.xyxy.astype(np.float32), deteccoes.conf, deteccoes.cls)
+            self.pontos = [self._pontos_da_caixa(gray, caixa * escala) for caixa in self.deteccoes.xyxy]
+            self.desde_chave = 0
+
+    def _pontos_da_caixa(self, gray, caixa):
+        altura, largura = gray.shape
+        x1, y1 = max(0, int(caixa[0])), max(0, int(caixa[1]))
+        x2, y2 = min(largura, int(np.ceil(caixa[2]))), min(altura, int(np.ceil(caixa[3])))
+        pontos = None
+        if x2 - x1 >= 4 and y2 - y1 >= 4:
+            mascara = np.zeros_like(gray)
+            mascara[y1:y2, x1:x2] = 255
+            pontos = cv2.goodFeaturesToTrack(gray, maxCorners=PONTOS_POR_CAIXA, qualityLevel=0.01,
+                                             minDistance=3, mask=mascara)
+        if pontos is None or len(pontos) < MIN_PONTOS:
+            # Região sem textura: grade 3x3 dentro da caixa
+            xs = np.linspace(caixa[0], caixa[2], 5)[1:4]
+            ys = np.linspace(caixa[1], caixa[3], 5)[1:4]
+            pontos = np.array([[x, y] for y in ys for x in xs], dtype=np.float32).reshape(-1, 1, 2)
+        return pontos.astype(np.float32)
+
+    def propagar(self, imagem):
+        """Caixas estimadas para o quadro atual (`Detections`)"""
+        gray, escala = self._cinza(imagem)
+        with self.lock:
+            if self.cinza_anterior is None or gray.shape != self.cinza_anterior.shape:
+                # Sem quadro-chave compatível (ex.: mudou a resolução): espera o próximo
+                self.cinza_anterior = None
+                return empty_detections()
+
+            manter = []
+            if self.pontos:
+                todos = np.concatenate(self.pontos)
+                novos, status, _ = cv2.calcOpticalFlowPyrLK(self.cinza_anterior, gray, todos, None, **lk_params)
+                status = status.ravel() == 1
+                caixas = self.deteccoes.xyxy
+                inicio = 0
+                for i, pontos in enumerate(self.pontos):
+                    fim = inicio + len(pontos)
+                    ok = status[inicio:fim]
+                    if ok.sum() >= MIN_PONTOS:
+                        antes = pontos.reshape(-1, 2)[ok]
+                        depois = novos[inicio:fim].reshape(-1, 2)[ok]
+                        dx, dy = np.median(depois - antes, axis=0) / escala
+                        fator = 1.0
+                        if _dispersao(antes) > 1.0:
+                            fator = float(np.clip(_dispersao(depois) / _dispersao(antes), 0.8, 1.25))
+                        cx = (caixas[i, 0] + caixas[i, 2]) / 2 + dx
+                        cy = (caixas[i, 1] + caixas[i, 3]) / 2 + dy
+                        meia_l = (caixas[i, 2] - caixas[i, 0]) / 2 * fator
+                        meia_a = (caixas[i, 3] - caixas[i, 1]) / 2 * fator
+                        caixas[i] = (cx - meia_l, cy - meia_a, cx + meia_l, cy + meia_a)
+                        self.pontos[i] = depois.reshape(-1, 1, 2)
+                        manter.append(i)
+                    inicio = fim
+
+            self.deteccoes = select(self.deteccoes, np.array(manter, dtype=np.int64))
+            self.pontos = [self.pontos[i] for i in manter]
+            self.cinza_anterior = gray
+            self.desde_chave += 1
+            return Detections(self.deteccoes.xyxy.copy(), self.deteccoes.conf.copy(), self.deteccoes.cls.copy())
  
 
 def Guardar_facas_detectadas(detections, knife_dir, image_np):  
+    from PIL import Image
     for detection in detections:  
         box = detection['box']  
         x1, y1, x2, y2 = map(int, box)  
@@ -105,11 +329,9 @@ def Guardar_facas_detectadas(detections, knife_dir, image_np):
         knife_pil.save(os.path.join(knife_dir, f"knife_{detection['id']}.jpg"))
         
 def Desenhar(image, box, label):
+    from PIL import ImageDraw
     draw = ImageDraw.Draw(image)
 
-    # Carregue a fonte padrão
-    font = ImageFont.load_default()
-
     # Desenhe o retângulo
     draw.rectangle([box[0], box[1], box[2], box[3]], outline="red", width=3)
 
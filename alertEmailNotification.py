@@ -1,6 +1,8 @@
 from email.header import Header
 import smtplib
 import os
+import threading
+import time
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
@@ -16,37 +18,120 @@ SMTP_SERVER = os.getenv("SMTP_SERVER")
 SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
 SMTP_USERNAME = os.getenv("SMTP_USERNAME")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "1") == "1"
 REMETENTE = os.getenv("REMETENTE")
 
+# Máximo de imagens anexadas em um e-mail com vários alertas
+MAX_ANEXOS = 5
+
+def montar_mensagem(email_address, alertas):
+    """
+    Monta o e-mail para uma lista de alertas [(detection_mode, image_base64), ...]
+    """
+    # Criar a mensagem
+    mensagem = MIMEMultipart()
+    mensagem["From"] = f"Alerta <{REMETENTE}>"
+    mensagem["To"] = email_address
+    mensagem["Subject"] = "Alerta Hackathon - Grupo19"
+
+    modos = ", ".join(sorted({modo for modo, _ in alertas if modo})) or "-"
+    quantidade = "" if len(alertas) == 1 else f"<p>Alertas agrupados: <b>{len(alertas)}</b></p>"
+
+    # Corpo do e-mail em HTML
+    corpo_html = f"""
+    <html>
+        <body>
+            <h1>Atenção!</h1>
+            <p>Foram detectados objetos cortantes!</p>
+            <p>Modo de detecção: <b>{modos}</b></p>
+            {quantidade}
+        </body>
+    </html>
+    """
+    
+    mensagem.attach(MIMEText(corpo_html, "html", "utf-8"))
+
+    # Adicionar imagens como anexo
+    imagens = [imagem for _, imagem in alertas if imagem][:MAX_ANEXOS]
+    for indice, image_base64 in enumerate(imagens):
+        image_data = base64.b64decode(image_base64)
+        image_attachment = MIMEBase('application', 'octet-stream')
+        image_attachment.set_payload(image_data)
+        encoders.encode_base64(image_attachment)
+        nome = 'detection.jpg' if len(imagens) == 1 else f'detection_{indice + 1}.jpg'
+        image_attachment.add_header('Content-Disposition', 'attachment', filename=nome)
+        mensagem.attach(image_attachment)
+
+    return mensagem
+
+
+class ConexaoSMTP:
+    """
+    Conexão SMTP autenticada reaproveitada entre envios
+
+    A conexão é aberta no primeiro envio, verificada com NOOP quando fica
+    ociosa e reaberta automaticamente se o servidor a derrubar.
+    """
+
+    def __init__(self, servidor=None, porta=None, usuario=None, senha=None, usar_tls=None, ocioso_max=60):
+        self.servidor = servidor or SMTP_SERVER
+        self.porta = porta or SMTP_PORT
+        self.usuario = usuario if usuario is not None else SMTP_USERNAME
+        self.senha = senha if senha is not None else SMTP_PASSWORD
+        self.usar_tls = SMTP_USE_TLS if usar_tls is None else usar_tls
+        self.ocioso_max = ocioso_max
+        self._smtp = None
+        self._ultimo_uso = 0
+        self._lock = threading.Lock()
+
+    def _conectar(self):
+        smtp = smtplib.SMTP(self.servidor, self.porta, timeout=30)
+        if self.usar_tls:
+            smtp.starttls()  # Inicia conexão segura
+        if self.usuario:
+            smtp.login(self.usuario, self.senha)  # Faz login
+        self._smtp = smtp
+
+    def _conexao_viva(self):
+        if self._smtp is None:
+            return False
+        if time.time() - self._ultimo_uso < self.ocioso_max:
+            return True
+        try:
+            return self._smtp.noop()[0] == 250
+        except smtplib.SMTPException:
+            return False
+
+    def enviar(self, mensagem):
+        with self._lock:
+            if not self._conexao_viva():
+                self._fechar()
+                self._conectar()
+            try:
+                self._smtp.send_message(mensagem)
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                # Conexão derrubada pelo servidor: reconecta uma vez
+                self._fechar()
+                self._conectar()
+                self._smtp.send_message(mensagem)
+            self._ultimo_uso = time.time()
+
+    def _fechar(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+
+    def fechar(self):
+        with self._lock:
+            self._fechar()
+
+
 def send_email_notification(email_address, detection_mode, image_base64):
     try:
-        # Criar a mensagem
-        mensagem = MIMEMultipart()
-        mensagem["From"] = f"Alerta <{REMETENTE}>"
-        mensagem["To"] = email_address
-        mensagem["Subject"] = "Alerta Hackathon - Grupo19"
-
-        # Corpo do e-mail em HTML
-        corpo_html = f"""
-        <html>
-            <body>
-                <h1>Atenção!</h1>
-                <p>Foram detectados objetos cortantes!</p>
-                <p>Modo de detecção: <b>{detection_mode}</b></p>
-            </body>
-        </html>
-        """
-        
-        mensagem.attach(MIMEText(corpo_html, "html", "utf-8"))
-
-        # Adicionar imagem como anexo
-        if image_base64:
-            image_data = base64.b64decode(image_base64)
-            image_attachment = MIMEBase('application', 'octet-stream')
-            image_attachment.set_payload(image_data)
-            encoders.encode_base64(image_attachment)
-            image_attachment.add_header('Content-Disposition', 'attachment', filename='detection.jpg')
-            mensagem.attach(image_attachment)
+        mensagem = montar_mensagem(email_address, [(detection_mode, image_base64)])
 
         # Conectar ao servidor SMTP e enviar o e-mail
         with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as servidor:
@@ -57,4 +142,4 @@ def send_email_notification(email_address, detection_mode, image_base64):
         print("E-mail enviado com sucesso!")
 
     except Exception as e:
-        print(f"Erro ao enviar o e-mail: {e}")
\ No newline at end of file
+        print(f"Erro ao enviar o e-mail: {e}")
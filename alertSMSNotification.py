@@ -1,6 +1,7 @@
 from twilio.rest import Client
 from dotenv import load_dotenv
 import os
+import threading
 
 load_dotenv()
 
@@ -9,13 +10,27 @@ ACCOUNT_SID = os.environ.get('ACCOUNT_SID')
 AUTH_TOKEN = os.environ.get('AUTH_TOKEN')
 TWILIO_PHONE_NUMBER = os.environ.get('TWILIO_PHONE_NUMBER')
 
-def send_twilio_sms_notification(numero_destino, detection_mode):
-    client = Client(ACCOUNT_SID, AUTH_TOKEN)
-    
-    message = client.messages.create(
-        body="Alerta: Objeto cortante detectado! Origem: " + detection_mode,
+# Um único cliente Twilio por processo (reaproveita a sessão HTTP)
+_cliente = None
+_cliente_lock = threading.Lock()
+
+def obter_cliente():
+    global _cliente
+    if _cliente is None:
+        with _cliente_lock:
+            if _cliente is None:
+                _cliente = Client(ACCOUNT_SID, AUTH_TOKEN)
+    return _cliente
+
+def enviar_sms(numero_destino, corpo, cliente=None):
+    cliente = cliente or obter_cliente()
+    message = cliente.messages.create(
+        body=corpo,
         from_=TWILIO_PHONE_NUMBER,
         to=numero_destino
     )
+    print(f"SMS enviado para {numero_destino}. SID: {message.sid}")
+    return message.sid
 
-    print(f"SMS enviado para {numero_destino}. SID: {message.sid}")
\ No newline at end of file
+def send_twilio_sms_notification(numero_destino, detection_mode):
+    enviar_sms(numero_destino, "Alerta: Objeto cortante detectado! Origem: " + detection_mode)
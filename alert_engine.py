@@ -0,0 +1,188 @@
+import base64
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Alert rules
+ALERT_MIN_CONFIDENCE = float(os.getenv('ALERT_MIN_CONFIDENCE', 0.5))
+ALERT_PERSISTENCE_K = int(os.getenv('ALERT_PERSISTENCE_K', 3))  # seen in K ...
+ALERT_PERSISTENCE_N = int(os.getenv('ALERT_PERSISTENCE_N', 5))  # ... of the last N frames
+ALERT_RATE_LIMIT = int(os.getenv('ALERT_RATE_LIMIT', 5))  # alerts per recipient ...
+ALERT_RATE_WINDOW = float(os.getenv('ALERT_RATE_WINDOW', 300))  # ... per sliding window (seconds)
+ALERT_MAX_SESSIONS = int(os.getenv('ALERT_MAX_SESSIONS', 1000))
+ALERT_SESSION_TTL = int(os.getenv('ALERT_SESSION_TTL', 3600))
+# Frames an alerted track is remembered after it was last seen: the tracker
+# keeps a hidden track's ID for TRACK_MAX_AGE frames (Rastrear)
+ALERT_TRACK_MAX_AGE = int(os.getenv('TRACK_MAX_AGE', 15))
+ALERT_MAX_TRACKS = 1024  # alerted track IDs kept per session
+EVICT_INTERVAL = 10  # seconds between sweeps of stale sessions from process_tracks
+
+logger = logging.getLogger(__name__)
+
+
+class _SessionState:
+    def __init__(self, channel, recipient, persistence_n):
+        self.channel = channel
+        self.recipient = recipient
+        self.frames = deque(maxlen=persistence_n)  # track IDs above the threshold per frame
+        self.alerted_tracks = OrderedDict()  # track ID -> frame it was last seen, oldest first
+        self.frame_index = 0
+        self.alerted_keys = deque(maxlen=256)  # dedup keys of single images/videos
+        self.last_seen = time.time()
+
+
+class AlertEngine:
+    """
+    Server-side alerting fed by detection results
+
+    Clients subscribe a session to a channel/recipient once; afterwards every
+    detection for that session goes through the rules below and only the
+    alerts that pass are handed to the notification dispatcher, with the
+    annotated frame the server already has.
+
+    - tracked streams (webcam): a track alerts once, after it was seen above
+      min_confidence in K of the last N frames
+    - single uploads (image/video): alert once per dedup key (content hash)
+    - every alert counts against a sliding-window rate limit per recipient
+    """
+
+    def __init__(self, dispatcher, min_confidence=ALERT_MIN_CONFIDENCE,
+                 persistence_k=ALERT_PERSISTENCE_K, persistence_n=ALERT_PERSISTENCE_N,
+                 rate_limit=ALERT_RATE_LIMIT, rate_window=ALERT_RATE_WINDOW,
+                 max_sessions=ALERT_MAX_SESSIONS, session_ttl=ALERT_SESSION_TTL,
+                 track_max_age=ALERT_TRACK_MAX_AGE):
+        self.dispatcher = dispatcher
+        self.min_confidence = min_confidence
+        self.persistence_k = persistence_k
+        self.persistence_n = max(persistence_n, persistence_k)
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.track_max_age = track_max_age
+        self._sessions = OrderedDict()
+        self._sent = {}  # (channel, recipient) -> deque of alert timestamps
+        self._lock = threading.Lock()
+        self._last_evict = 0.0
+        self._counters = {'fired': 0, 'deduplicated': 0, 'not_persistent': 0, 'rate_limited': 0}
+
+    def subscribe(self, session_id, channel, recipient):
+        with self._lock:
+            self._evict(time.time())
+            self._sessions[session_id] = _SessionState(channel, recipient, self.persistence_n)
+
+    def unsubscribe(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def process_tracks(self, session_id, detections, detection_mode, image_jpeg):
+        """
+        Feed one frame of tracked detections (dicts with 'id' and 'confidence')
+
+        image_jpeg is a callable returning the annotated JPEG bytes; it is only
+        called when an alert actually fires. Returns the delivery ids queued.
+        """
+        with self._lock:
+            now = time.time()
+            if now - self._last_evict > EVICT_INTERVAL:
+                self._evict(now)
+            state = self._state(session_id)
+            if state is None:
+                return []
+
+            present = {d['id'] for d in detections if d['confidence'] >= self.min_confidence}
+            state.frames.append(present)
+            state.frame_index += 1
+            self._refresh_alerted(state, {d['id'] for d in detections})
+
+            ready = []
+            for track_id in present - state.alerted_tracks.keys():
+                seen = sum(1 for frame in state.frames if track_id in frame)
+                if seen >= self.persistence_k:
+                    ready.append(track_id)
+                else:
+                    self._counters['not_persistent'] += 1
+            if not ready:
+                return []
+
+            for track_id in ready:
+                state.alerted_tracks[track_id] = state.frame_index
+            if not self._allow(state):
+                return []
+
+        return self._fire(state, detection_mode, image_jpeg)
+
+    def process_upload(self, session_id, detections, detection_mode, image_jpeg, dedup_key=None):
+        """Feed the detections of a single image or video upload"""
+        with self._lock:
+            state = self._state(session_id)
+            if state is None:
+                return []
+            if not any(d['confidence'] >= self.min_confidence for d in detections):
+                return []
+            if dedup_key is not None:
+                if dedup_key in state.alerted_keys:
+                    self._counters['deduplicated'] += 1
+                    return []
+                state.alerted_keys.append(dedup_key)
+            if not self._allow(state):
+                return []
+
+        return self._fire(state, detection_mode, image_jpeg)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, sessions=len(self._sessions))
+
+    def _state(self, session_id):
+        state = self._sessions.get(session_id)
+        if state is not None:
+            state.last_seen = time.time()
+            self._sessions.move_to_end(session_id)
+        return state
+
+    def _refresh_alerted(self, state, seen):
+        # Alerted IDs live as long as the tracker could still hand the same ID
+        # back (IDs only increase, so an expired one never returns)
+        for track_id in seen & state.alerted_tracks.keys():
+            state.alerted_tracks[track_id] = state.frame_index
+            state.alerted_tracks.move_to_end(track_id)
+        while state.alerted_tracks:
+            track_id, last_seen = next(iter(state.alerted_tracks.items()))
+            if state.frame_index - last_seen <= self.track_max_age and len(state.alerted_tracks) <= ALERT_MAX_TRACKS:
+                break
+            del state.alerted_tracks[track_id]
+
+    def _allow(self, state):
+        # Sliding-window rate limit per recipient
+        now = time.time()
+        sent = self._sent.setdefault((state.channel, state.recipient), deque())
+        while sent and now - sent[0] > self.rate_window:
+            sent.popleft()
+        if len(sent) >= self.rate_limit:
+            self._counters['rate_limited'] += 1
+            return False
+        sent.append(now)
+        self._counters['fired'] += 1
+        return True
+
+    def _fire(self, state, detection_mode, image_jpeg):
+        jpeg = image_jpeg() if image_jpeg is not None else None
+        image_base64 = base64.b64encode(jpeg).decode('utf-8') if jpeg else None
+        try:
+            return [self.dispatcher.submit(state.channel, state.recipient, detection_mode, image_base64)]
+        except Exception:
+            logger.exception("Failed to queue alert")
+            return []
+
+    def _evict(self, now):
+        self._last_evict = now
+        while self._sessions:
+            oldest_id, oldest = next(iter(self._sessions.items()))
+            if now - oldest.last_seen <= self.session_ttl and len(self._sessions) < self.max_sessions:
+                break
+            del self._sessions[oldest_id]
+        for key in [k for k, sent in self._sent.items() if not sent or now - sent[-1] > self.rate_window]:
+            del self._sent[key]
@@ -0,0 +1,90 @@
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+# Micro-batching configuration
+BATCH_SCHEDULER = os.getenv('BATCH_SCHEDULER', '1') == '1'
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', 8))
+BATCH_MAX_WAIT_MS = float(os.getenv('BATCH_MAX_WAIT_MS', 10))
+
+
+class InferenceScheduler:
+    """
+    Collect single-image requests from many threads and run them as one YOLO call
+
+    The first request of a batch waits at most max_wait_ms for others to join;
+    the batch runs as soon as it reaches max_batch_size. Requests with different
+    confidence thresholds share the call: the model runs with the lowest one and
+    each result is filtered back to its own threshold.
+    """
+
+    def __init__(self, get_model, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS):
+        self.get_model = get_model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._requests = 0
+        self._wait_total = 0.0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, image, conf):
+        future = Future()
+        self._queue.put((image, conf, future, time.perf_counter()))
+        return future
+
+    def predict(self, image, conf):
+        return self.submit(image, conf).result()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            started = time.perf_counter()
+            try:
+                min_conf = min(conf for _, conf, _, _ in batch)
+                results = self.get_model()([image for image, _, _, _ in batch], conf=min_conf, verbose=False)
+                for (_, conf, future, _), result in zip(batch, results):
+                    if conf > min_conf:
+                        result = result[result.boxes.conf >= conf]
+                    future.set_result(result)
+            except Exception as e:
+                for _, _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+            with self._lock:
+                self._batch_sizes[len(batch)] += 1
+                self._requests += len(batch)
+                self._wait_total += sum(started - queued for _, _, _, queued in batch)
+
+    def stats(self):
+        with self._lock:
+            batches = sum(self._batch_sizes.values())
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000,
+                'batches': batches,
+                'requests': self._requests,
+                'avg_batch_size': round(self._requests / batches, 2) if batches else 0.0,
+                'avg_queue_wait_ms': round(self._wait_total / self._requests * 1000, 2) if self._requests else 0.0,
+                'batch_sizes': {str(size): count for size, count in sorted(self._batch_sizes.items())}
+            }
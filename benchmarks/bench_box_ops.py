@@ -0,0 +1,107 @@
+"""
+Micro-benchmark: scalar IoU / per-box tensor access vs. box_ops
+
+Run from the repository root:
+
+    python benchmarks/bench_box_ops.py [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from box_ops import iou_matrix, nms, xyxy_to_xywh  # noqa: E402
+
+
+def scalar_iou(box1, box2):
+    # Original per-pair implementation from Rastrear.calcular_iou (xywh)
+    x1, y1, w1, h1 = box1
+    x2, y2, w2, h2 = box2
+    xi1 = max(x1, x2)
+    yi1 = max(y1, y2)
+    xi2 = min(x1 + w1, x2 + w2)
+    yi2 = min(y1 + h1, y2 + h2)
+    inter_area = max(0, xi2 - xi1) * max(0, yi2 - yi1)
+    return inter_area / float(w1 * h1 + w2 * h2 - inter_area)
+
+
+def scalar_iou_matrix(boxes_a, boxes_b):
+    return [[scalar_iou(a, b) for b in boxes_b] for a in boxes_a]
+
+
+def random_boxes(n, rng, size=1920):
+    top_left = rng.uniform(0, size - 200, (n, 2))
+    wh = rng.uniform(10, 200, (n, 2))
+    return np.hstack([top_left, top_left + wh]).astype(np.float32)
+
+
+def best_of(stmt, repeat, number):
+    return min(timeit.repeat(stmt, repeat=repeat, number=number)) / number
+
+
+def bench_iou(n, repeat):
+    rng = np.random.default_rng(0)
+    boxes = random_boxes(n, rng)
+    xywh = [tuple(b) for b in xyxy_to_xywh(boxes).tolist()]
+    number = max(1, 1000 // n)
+
+    scalar = best_of(lambda: scalar_iou_matrix(xywh, xywh), repeat, number)
+    vectorized = best_of(lambda: iou_matrix(boxes, boxes), repeat, number)
+    return scalar, vectorized
+
+
+def bench_transfer(n, repeat):
+    # Per-box .item() / .cpu().numpy() calls vs. one copy of boxes.data
+    try:
+        import torch
+    except ImportError:
+        return None
+
+    rng = np.random.default_rng(0)
+    data = torch.from_numpy(np.hstack([random_boxes(n, rng),
+                                       rng.uniform(0, 1, (n, 1)).astype(np.float32),
+                                       np.zeros((n, 1), dtype=np.float32)]))
+    number = max(1, 1000 // n)
+
+    def per_box():
+        return [(row[4].item(), row[:4].cpu().numpy()) for row in data]
+
+    def batched():
+        host = data.cpu().numpy()
+        return host[:, 4], host[:, :4]
+
+    return best_of(per_box, repeat, number), best_of(batched, repeat, number)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark box_ops against the scalar loops')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000],
+                        help='Number of boxes (default: 10 100 1000)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Timing repetitions, best one is kept (default: 5)')
+    args = parser.parse_args()
+
+    print(f"{'boxes':>6} | {'operation':<22} | {'before (ms)':>12} | {'after (ms)':>12} | {'speedup':>8}")
+    for n in args.sizes:
+        rows = [('pairwise IoU', bench_iou(n, args.repeat)),
+                ('box -> host transfer', bench_transfer(n, args.repeat))]
+
+        rng = np.random.default_rng(1)
+        boxes, scores = random_boxes(n, rng), rng.uniform(0, 1, n)
+        nms_time = best_of(lambda: nms(boxes, scores, 0.5), args.repeat, max(1, 1000 // n))
+
+        for name, timing in rows:
+            if timing is None:
+                print(f"{n:>6} | {name:<22} | {'(torch not installed)':>36}")
+                continue
+            before, after = timing
+            print(f"{n:>6} | {name:<22} | {before * 1000:>12.3f} | {after * 1000:>12.3f} | {before / after:>7.1f}x")
+        print(f"{n:>6} | {'nms (box_ops)':<22} | {'':>12} | {nms_time * 1000:>12.3f} |")
+
+
+if __name__ == "__main__":
+    main()
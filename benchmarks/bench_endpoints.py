@@ -0,0 +1,333 @@
+"""
+Benchmark of the detection paths: Flask endpoints and their stages
+
+Endpoint scenarios post to `/api/detect` (image and video) and
+`/api/detect_webcam` through the Flask test client; stage scenarios time the
+in-process steps the endpoints are made of (decode, inference, plot, encode,
+...). Every scenario runs at the given concurrency and reports p50/p95/p99
+latency, throughput and the peak RSS while it ran.
+
+Results are written as JSON (default `benchmarks/results/<commit>.json`) so
+two commits can be compared. Run from the repository root:
+
+    python benchmarks/bench_endpoints.py --concurrency 1 4 --iterations 50
+    python benchmarks/bench_endpoints.py --compare benchmarks/results/abc1234.json benchmarks/results/def5678.json
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Repeated uploads of the same image would otherwise be served from the result cache
+os.environ.setdefault('RESULT_CACHE', '0')
+os.environ.setdefault('PRELOAD_MODEL', '0')
+
+
+class PeakRSS:
+    """Samples the process RSS in the background and keeps the peak since the last reset"""
+
+    def __init__(self, interval=0.005):
+        try:
+            import psutil
+            self._process = psutil.Process()
+        except ImportError:
+            self._process = None
+        self.interval = interval
+        self._peak = 0
+        self._stopped = threading.Event()
+        if self._process is not None:
+            threading.Thread(target=self._sample, daemon=True).start()
+
+    def _rss(self):
+        return self._process.memory_info().rss
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            self._peak = max(self._peak, self._rss())
+
+    def reset(self):
+        if self._process is not None:
+            self._peak = self._rss()
+
+    def peak_mb(self):
+        if self._process is None:
+            return None
+        return round(max(self._peak, self._rss()) / 1024 / 1024, 1)
+
+    def stop(self):
+        self._stopped.set()
+
+
+def summarize(latencies, elapsed, peak_rss_mb):
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'n': len(latencies),
+        'mean_ms': round(float(latencies_ms.mean()), 3),
+        'p50_ms': round(float(np.percentile(latencies_ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(latencies_ms, 95)), 3),
+        'p99_ms': round(float(np.percentile(latencies_ms, 99)), 3),
+        'throughput_per_s': round(len(latencies) / elapsed, 3),
+        'peak_rss_mb': peak_rss_mb,
+    }
+
+
+def measure(fn, iterations, concurrency, rss, warmup=2):
+    for _ in range(warmup):
+        fn()
+
+    def timed(_):
+        start = time.perf_counter()
+        fn()
+        return time.perf_counter() - start
+
+    rss.reset()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(timed, range(iterations)))
+    return summarize(latencies, time.perf_counter() - start, rss.peak_mb())
+
+
+def load_inputs(video_path, video_frames):
+    """A JPEG frame (image/webcam uploads) and a short mp4 clip from the sample video"""
+    import cv2
+
+    cap = cv2.VideoCapture(video_path)
+    frames = []
+    while len(frames) < video_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    cap.release()
+    if not frames:
+        raise ValueError(f"Could not read frames from {video_path}")
+
+    image_jpeg = cv2.imencode('.jpg', frames[len(frames) // 2])[1].tobytes()
+
+    clip = tempfile.NamedTemporaryFile(suffix='.mp4', delete=False)
+    clip.close()
+    height, width = frames[0].shape[:2]
+    writer = cv2.VideoWriter(clip.name, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    for frame in frames:
+        writer.write(frame)
+    writer.release()
+    with open(clip.name, 'rb') as f:
+        video_bytes = f.read()
+    os.unlink(clip.name)
+    return image_jpeg, video_bytes, frames
+
+
+def endpoint_scenarios(flask_app, image_jpeg, video_bytes, conf):
+    clients = threading.local()
+
+    def client():
+        # One test client (and one tracking session) per thread
+        if not hasattr(clients, 'client'):
+            clients.client = flask_app.app.test_client()
+            clients.session_id = f'bench-{threading.get_ident()}'
+        return clients.client
+
+    def post(url, payload, filename, **fields):
+        def call():
+            test_client = client()
+            data = dict(fields, confidence=str(conf), session_id=clients.session_id,
+                        file=(io.BytesIO(payload), filename))
+            response = test_client.post(url, data=data, content_type='multipart/form-data')
+            response.get_data()
+            response.close()
+            if response.status_code != 200:
+                raise RuntimeError(f"{url} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        return call
+
+    return {
+        'endpoint.image': post('/api/detect', image_jpeg, 'frame.jpg'),
+        'endpoint.image_json': post('/api/detect', image_jpeg, 'frame.jpg', output='json'),
+        'endpoint.image_fast': post('/api/detect', image_jpeg, 'frame.jpg', render='fast'),
+        'endpoint.video': post('/api/detect', video_bytes, 'clip.mp4'),
+        'endpoint.video_json': post('/api/detect', video_bytes, 'clip.mp4', output='json'),
+        'endpoint.webcam': post('/api/detect_webcam', image_jpeg, 'frame.jpg'),
+        'endpoint.webcam_json': post('/api/detect_webcam', image_jpeg, 'frame.jpg', output='json'),
+    }
+
+
+def stage_scenarios(flask_app, image_jpeg, frames, conf):
+    """The steps of the image/webcam and video paths, timed one at a time"""
+    import cv2
+
+    from frame_io import decode_image
+    from render import draw_detections, encode_jpeg
+    from box_ops import boxes_to_numpy, to_dicts
+
+    model = flask_app.get_model()
+    image_np = decode_image(image_jpeg)
+    results = model(image_np, conf=conf, verbose=False)
+    plot = results[0].plot()
+    detections = to_dicts(boxes_to_numpy(results[0].boxes))
+
+    frame_index = itertools.count()
+    height, width = frames[0].shape[:2]
+    writer_path = os.path.join(tempfile.gettempdir(), f'bench_writer_{os.getpid()}.mp4')
+    writer = cv2.VideoWriter(writer_path, cv2.VideoWriter_fourcc(*'mp4v'), 30, (width, height))
+    writer_lock = threading.Lock()
+
+    def write_frame():
+        with writer_lock:
+            writer.write(frames[next(frame_index) % len(frames)])
+
+    clip_frame = frames[len(frames) // 2]
+    clip_result = model(clip_frame, conf=conf, verbose=False)[0]
+
+    return {
+        'stage.image.decode': lambda: decode_image(image_jpeg),
+        'stage.image.infer': lambda: model(image_np, conf=conf, verbose=False),
+        'stage.image.plot': lambda: results[0].plot(),
+        'stage.image.encode': lambda: encode_jpeg(plot),
+        'stage.image.fast_render': lambda: encode_jpeg(draw_detections(image_np.copy(), detections)),
+        'stage.video.infer_batch': lambda: model(frames[:8], conf=conf, verbose=False),
+        'stage.video.annotate': lambda: clip_result.plot(img=clip_frame.copy()),
+        'stage.video.write': write_frame,
+    }, (writer, writer_path)
+
+
+def git_commit():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+        dirty = bool(subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                             cwd=ROOT, text=True).strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+
+
+def run(args):
+    import flask_app
+
+    image_jpeg, video_bytes, frames = load_inputs(args.video, args.video_frames)
+    flask_app.warm_up_model()
+
+    scenarios = endpoint_scenarios(flask_app, image_jpeg, video_bytes, args.conf)
+    stages, (writer, writer_path) = stage_scenarios(flask_app, image_jpeg, frames, args.conf)
+    scenarios.update(stages)
+    selected = {name: fn for name, fn in scenarios.items()
+                if not args.scenarios or any(name.startswith(prefix) for prefix in args.scenarios)}
+
+    rss = PeakRSS()
+    results = {}
+    try:
+        for concurrency in args.concurrency:
+            for name, fn in selected.items():
+                # Videos are much slower per call; scale their iteration count down
+                iterations = max(concurrency, args.iterations // 10 if name.startswith('endpoint.video') else args.iterations)
+                stats = measure(fn, iterations, concurrency, rss, warmup=args.warmup)
+                results[f'{name}@c{concurrency}'] = dict(stats, scenario=name, concurrency=concurrency)
+                print(f"{name:<28} c={concurrency:<3} p50 {stats['p50_ms']:>9.1f} ms | p95 {stats['p95_ms']:>9.1f} ms | "
+                      f"p99 {stats['p99_ms']:>9.1f} ms | {stats['throughput_per_s']:>8.2f}/s | "
+                      f"peak RSS {stats['peak_rss_mb']} MB")
+    finally:
+        rss.stop()
+        writer.release()
+        if os.path.exists(writer_path):
+            os.unlink(writer_path)
+
+    commit, dirty = git_commit()
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'config': {
+            'video': args.video,
+            'video_frames': len(frames),
+            'iterations': args.iterations,
+            'concurrency': args.concurrency,
+            'confidence': args.conf,
+            'model_backend': os.getenv('MODEL_BACKEND', 'torch'),
+            'batch_scheduler': os.getenv('BATCH_SCHEDULER', '1'),
+        },
+        'machine': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'results': results,
+    }
+
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results', f"{commit}{'-dirty' if dirty else ''}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to: {output}")
+
+
+def compare(base_path, new_path, metric, threshold):
+    """Print the change of each scenario between two result files; returns the regressions"""
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    print(f"{base['commit']} -> {new['commit']} ({metric})\n")
+    print(f"{'scenario':<34} | {'before':>10} | {'after':>10} | {'change':>8}")
+    regressions = []
+    for key, after in new['results'].items():
+        before = base['results'].get(key)
+        if before is None:
+            print(f"{key:<34} | {'-':>10} | {after[metric]:>10.2f} |")
+            continue
+        change = (after[metric] - before[metric]) / before[metric] * 100 if before[metric] else 0.0
+        # Throughput regresses when it goes down, everything else when it goes up
+        worse = -change if metric == 'throughput_per_s' else change
+        flag = '  <- regression' if worse > threshold else ''
+        if flag:
+            regressions.append(key)
+        print(f"{key:<34} | {before[metric]:>10.2f} | {after[metric]:>10.2f} | {change:>+7.1f}%{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the detection endpoints and their stages')
+    parser.add_argument('--video', default=os.path.join(ROOT, 'output2_finetunned.mp4'),
+                        help='Source of the image/webcam frame and of the video clip (default: output2_finetunned.mp4)')
+    parser.add_argument('--video-frames', type=int, default=60,
+                        help='Frames in the video clip posted to /api/detect (default: 60)')
+    parser.add_argument('--iterations', type=int, default=30,
+                        help='Calls per scenario; the video endpoint runs a tenth of them (default: 30)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4],
+                        help='Concurrent callers (default: 1 4)')
+    parser.add_argument('--warmup', type=int, default=2,
+                        help='Untimed calls before each scenario (default: 2)')
+    parser.add_argument('--scenarios', nargs='+', default=None,
+                        help='Only run scenarios starting with these prefixes (e.g. endpoint. stage.image)')
+    parser.add_argument('--conf', type=float, default=0.25,
+                        help='Confidence threshold (default: 0.25)')
+    parser.add_argument('--output', default=None,
+                        help='Results file (default: benchmarks/results/<commit>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'),
+                        help='Compare two result files instead of running')
+    parser.add_argument('--metric', default='p95_ms',
+                        help='Metric used by --compare (default: p95_ms)')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='Percent change --compare reports as a regression (default: 10)')
+    args = parser.parse_args()
+
+    if args.compare:
+        regressions = compare(*args.compare, args.metric, args.threshold)
+        sys.exit(1 if regressions else 0)
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Upload decode/encode: PIL round trip vs frame_io (cv2.imdecode/imencode)
+
+Times the image path of /api/detect and /api/detect_webcam without the
+model: decode the upload into the array the rest of the code uses (BGR),
+then encode an annotated frame back to JPEG.
+
+- pil: Image.open -> np.array (RGB/RGBA) -> to_bgr -> Image.fromarray -> PIL JPEG
+- cv2: frame_io.read_upload -> frame_io.decode_image (BGR) -> render.encode_jpeg
+
+Allocations are measured with tracemalloc over one call with every
+intermediate kept alive: number of new blocks, number of frame-sized blocks
+(>= 64 KiB) and bytes. tracemalloc sees Python and NumPy allocations (OpenCV
+returns NumPy arrays); the pixel buffer PIL keeps inside its C image object
+is not traced, so the PIL numbers are a lower bound. Run from the
+repository root:
+
+    python benchmarks/bench_frame_io.py --video output2_finetunned.mp4 --iterations 200
+"""
+import argparse
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from frame_io import decode_image, read_upload  # noqa: E402
+from render import encode_jpeg, to_bgr  # noqa: E402
+
+LARGE_BLOCK = 64 * 1024
+
+
+def sample_uploads(args):
+    """{name: encoded bytes}: a JPEG frame and the same frame as a PNG with alpha"""
+    if args.image:
+        with open(args.image, 'rb') as f:
+            data = f.read()
+        return {os.path.basename(args.image): data}
+
+    cap = cv2.VideoCapture(args.video)
+    ret, frame = cap.read()
+    cap.release()
+    if not ret:
+        raise SystemExit(f"Could not read a frame from {args.video}")
+    jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+    rgba = cv2.cvtColor(frame, cv2.COLOR_BGR2BGRA)
+    png = cv2.imencode('.png', rgba)[1].tobytes()
+    return {f'jpeg {frame.shape[1]}x{frame.shape[0]}': jpeg, f'png+alpha {frame.shape[1]}x{frame.shape[0]}': png}
+
+
+def pil_round_trip(data):
+    stream = io.BytesIO(data)
+    image = Image.open(stream)
+    image_np = np.array(image)
+    bgr = to_bgr(image_np)
+    # The annotated plot went back through PIL, which expects RGB
+    plot_image = Image.fromarray(image_np if image_np.ndim == 2 or image_np.shape[2] == 3 else image_np[..., :3])
+    output = io.BytesIO()
+    plot_image.save(output, format='JPEG')
+    return [stream, image, image_np, bgr, plot_image, output, output.getvalue()]
+
+
+def cv2_round_trip(data):
+    stream = io.BytesIO(data)
+    buffer = read_upload(stream)
+    image = decode_image(buffer)
+    jpeg = encode_jpeg(image)
+    return [stream, buffer, image, jpeg]
+
+
+def allocations(function, data):
+    """(blocks, frame-sized blocks, bytes) allocated by one call, intermediates kept alive"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = function(data)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    blocks = large = size = 0
+    for stat in after.compare_to(before, 'traceback'):
+        if stat.count_diff <= 0:
+            continue
+        blocks += stat.count_diff
+        size += stat.size_diff
+        if stat.size_diff / stat.count_diff >= LARGE_BLOCK:
+            large += stat.count_diff
+    del kept
+    return blocks, large, size
+
+
+def latency(function, data, iterations, warmup):
+    for _ in range(warmup):
+        function(data)
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function(data)
+        times.append(time.perf_counter() - start)
+    return np.array(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the PIL and OpenCV upload decode/encode paths')
+    parser.add_argument('--video', default='output2_finetunned.mp4',
+                        help='Video whose first frame is used as the upload (default: output2_finetunned.mp4)')
+    parser.add_argument('--image',
+                        help='Use this image file as the upload instead')
+    parser.add_argument('--iterations', type=int, default=100,
+                        help='Timed iterations per path (default: 100)')
+    parser.add_argument('--warmup', type=int, default=5,
+                        help='Untimed warm-up iterations (default: 5)')
+    args = parser.parse_args()
+
+    paths = {'pil': pil_round_trip, 'cv2': cv2_round_trip}
+    print(f"{'upload':<22} | {'path':<4} | {'p50 (ms)':>9} | {'p95 (ms)':>9} | "
+          f"{'blocks':>7} | {'>=64KiB':>7} | {'MiB':>7}")
+    for name, data in sample_uploads(args).items():
+        for path, function in paths.items():
+            times = latency(function, data, args.iterations, args.warmup)
+            blocks, large, size = allocations(function, data)
+            print(f"{name:<22} | {path:<4} | {np.percentile(times, 50):>9.2f} | {np.percentile(times, 95):>9.2f} | "
+                  f"{blocks:>7} | {large:>7} | {size / 1024 / 1024:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
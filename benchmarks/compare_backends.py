@@ -0,0 +1,112 @@
+"""
+Accuracy/latency comparison of the inference backends on a video
+
+Runs every requested backend (see model_backend.py) over the same frames and
+compares the detections against the PyTorch reference: boxes are matched by
+IoU, and agreement is reported as precision/recall plus the mean confidence
+difference of the matched boxes. Export the models first with
+`python export_model.py`. Run from the repository root:
+
+    python benchmarks/compare_backends.py --video output2_finetunned.mp4 \
+        --backends torch onnx onnx-int8 openvino
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from box_ops import boxes_to_numpy, iou_matrix  # noqa: E402
+from model_backend import MODEL_IMGSZ, MODEL_PATH, load_model  # noqa: E402
+from Rastrear import associar_deteccoes  # noqa: E402
+
+
+def read_frames(video_path, max_frames):
+    cap = cv2.VideoCapture(video_path)
+    frames = []
+    while len(frames) < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def run_backend(spec, frames, args):
+    backend, _, suffix = spec.partition('-')
+    model = load_model(backend=backend, model_path=args.model, imgsz=args.imgsz,
+                       threads=args.threads, int8=suffix == 'int8')
+    for frame in frames[:args.warmup]:
+        model(frame, conf=args.conf, verbose=False)
+
+    latencies, detections = [], []
+    for frame in frames:
+        start = time.perf_counter()
+        result = model(frame, conf=args.conf, verbose=False)[0]
+        latencies.append(time.perf_counter() - start)
+        detections.append(boxes_to_numpy(result.boxes))
+    return np.array(latencies) * 1000, detections
+
+
+def agreement(reference, candidate, iou_threshold):
+    matched = ref_total = cand_total = 0
+    conf_diffs = []
+    for ref, cand in zip(reference, candidate):
+        ref_total += len(ref.conf)
+        cand_total += len(cand.conf)
+        pairs = associar_deteccoes(iou_matrix(ref.xyxy, cand.xyxy), iou_threshold)
+        matched += len(pairs)
+        conf_diffs += [abs(float(ref.conf[r]) - float(cand.conf[c])) for r, c in pairs]
+    precision = matched / cand_total if cand_total else 1.0
+    recall = matched / ref_total if ref_total else 1.0
+    return precision, recall, float(np.mean(conf_diffs)) if conf_diffs else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare inference backends against the PyTorch model')
+    parser.add_argument('--video', default='output2_finetunned.mp4',
+                        help='Video used for the comparison (default: output2_finetunned.mp4)')
+    parser.add_argument('--model', default=MODEL_PATH,
+                        help=f'PyTorch checkpoint the exports come from (default: {MODEL_PATH})')
+    parser.add_argument('--backends', nargs='+', default=['torch', 'onnx', 'openvino'],
+                        help='Backends to run; append -int8 for the quantized export (default: torch onnx openvino)')
+    parser.add_argument('--frames', type=int, default=200,
+                        help='Number of frames (default: 200)')
+    parser.add_argument('--warmup', type=int, default=5,
+                        help='Untimed warm-up frames (default: 5)')
+    parser.add_argument('--imgsz', type=int, default=MODEL_IMGSZ,
+                        help=f'Input size (default: {MODEL_IMGSZ})')
+    parser.add_argument('--threads', type=int, default=0,
+                        help='Inference threads, 0 = library default (default: 0)')
+    parser.add_argument('--conf', type=float, default=0.25,
+                        help='Confidence threshold (default: 0.25)')
+    parser.add_argument('--iou', type=float, default=0.5,
+                        help='IoU for a box to count as the same detection (default: 0.5)')
+    args = parser.parse_args()
+
+    frames = read_frames(args.video, args.frames)
+    print(f"{len(frames)} frames from {args.video}, imgsz {args.imgsz}, threads {args.threads or 'default'}\n")
+
+    reference = None
+    print(f"{'backend':<14} | {'p50 (ms)':>9} | {'p95 (ms)':>9} | {'fps':>7} | "
+          f"{'precision':>9} | {'recall':>7} | {'conf diff':>9}")
+    for spec in ['torch'] + [b for b in args.backends if b != 'torch']:
+        try:
+            latencies, detections = run_backend(spec, frames, args)
+        except (ImportError, FileNotFoundError) as e:
+            print(f"{spec:<14} | skipped: {e}")
+            continue
+        if reference is None:
+            reference = detections
+        precision, recall, conf_diff = agreement(reference, detections, args.iou)
+        print(f"{spec:<14} | {np.percentile(latencies, 50):>9.1f} | {np.percentile(latencies, 95):>9.1f} | "
+              f"{1000 / latencies.mean():>7.1f} | {precision:>9.3f} | {recall:>7.3f} | {conf_diff:>9.4f}")
+
+
+if __name__ == "__main__":
+    main()
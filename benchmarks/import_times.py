@@ -0,0 +1,110 @@
+"""
+Cold-start report: per-module import time and time to the first /healthz
+
+Imports the module in a fresh interpreter with `python -X importtime` and
+lists the slowest imports (cumulative, including their own imports) plus
+the total per top-level package. It then starts another interpreter that
+imports the app and answers GET /healthz through the test client, which is
+what a Cloud Run / Kubernetes startup probe waits for. PRELOAD_MODEL is 0
+by default so the model load isn't counted; pass --preload 1 to include it.
+Run from the repository root:
+
+    python benchmarks/import_times.py --top 25 --target-ms 1500
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s*(\S+)')
+
+HEALTHZ_SCRIPT = """
+import time
+start = time.perf_counter()
+import flask_app
+imported = time.perf_counter()
+response = flask_app.app.test_client().get('/healthz')
+done = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(f'{(imported - start) * 1000:.1f} {(done - start) * 1000:.1f}')
+"""
+
+
+def child_env(preload):
+    env = dict(os.environ)
+    env['PRELOAD_MODEL'] = preload
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    return env
+
+
+def import_times(module, preload):
+    """[(module, self us, cumulative us)] from `python -X importtime`"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=ROOT, env=child_env(preload), capture_output=True, text=True)
+    if result.returncode != 0:
+        raise SystemExit(f"import {module} failed:\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, name = match.groups()
+            rows.append((name, int(self_us), int(cumulative_us)))
+    return rows
+
+
+def healthz_time(preload):
+    """(import ms, first /healthz ms, wall ms including interpreter start) in a fresh interpreter"""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', HEALTHZ_SCRIPT],
+                            cwd=ROOT, env=child_env(preload), capture_output=True, text=True)
+    wall = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        raise SystemExit(f"/healthz check failed:\n{result.stderr[-2000:]}")
+    imported, answered = (float(v) for v in result.stdout.split()[-2:])
+    return imported, answered, wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report import times and time to the first /healthz')
+    parser.add_argument('--module', default='flask_app',
+                        help='Module to import (default: flask_app)')
+    parser.add_argument('--top', type=int, default=20,
+                        help='Number of slowest imports to list (default: 20)')
+    parser.add_argument('--preload', default='0', choices=['0', '1', 'background'],
+                        help='PRELOAD_MODEL for the child processes (default: 0)')
+    parser.add_argument('--target-ms', type=float, default=0,
+                        help='Exit with status 1 when /healthz takes longer than this (default: no target)')
+    args = parser.parse_args()
+
+    rows = import_times(args.module, args.preload)
+    total = sum(self_us for _, self_us, _ in rows)
+    print(f"{len(rows)} modules imported in {total / 1000:.1f} ms\n")
+
+    print(f"{'module':<48} | {'self (ms)':>9} | {'cumul. (ms)':>11}")
+    for name, self_us, cumulative_us in sorted(rows, key=lambda row: -row[2])[:args.top]:
+        print(f"{name:<48} | {self_us / 1000:>9.1f} | {cumulative_us / 1000:>11.1f}")
+
+    packages = defaultdict(int)
+    for name, self_us, _ in rows:
+        packages[name.split('.')[0]] += self_us
+    print(f"\n{'package':<48} | {'total (ms)':>10} | {'share':>6}")
+    for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{package:<48} | {self_us / 1000:>10.1f} | {self_us / max(total, 1):>6.1%}")
+
+    if args.module != 'flask_app':
+        return
+    imported, answered, wall = healthz_time(args.preload)
+    print(f"\nimport flask_app: {imported:.0f} ms | first /healthz: {answered:.0f} ms | "
+          f"with interpreter start: {wall:.0f} ms")
+    if args.target_ms and wall > args.target_ms:
+        print(f"Over the {args.target_ms:.0f} ms target")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Vectorized box utilities working on whole arrays of boxes
+
+Everything here takes NumPy arrays of shape (N, 4) in xyxy format (pixels)
+unless stated otherwise. Use `boxes_to_numpy` to move a YOLO `Boxes` object to
+the host with a single transfer instead of calling `.item()` per box.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+Detections = namedtuple('Detections', ['xyxy', 'conf', 'cls'])
+
+
+def empty_detections():
+    return Detections(np.zeros((0, 4), dtype=np.float32),
+                      np.zeros(0, dtype=np.float32),
+                      np.zeros(0, dtype=np.int64))
+
+
+def boxes_to_numpy(boxes, min_conf=None):
+    """
+    Convert an ultralytics `Boxes` object to a `Detections` tuple (a
+    `Detections` tuple is passed through, filtered by min_conf)
+
+    `boxes.data` holds [x1, y1, x2, y2, (track_id,) conf, cls] per row, so the
+    whole set is copied to the host once.
+    """
+    if isinstance(boxes, Detections):
+        # Already on the host (e.g. boxes propagated by optical flow)
+        detections = boxes
+    elif boxes is None or len(boxes) == 0:
+        return empty_detections()
+    else:
+        data = boxes.data.cpu().numpy()
+        detections = Detections(data[:, :4].astype(np.float32, copy=False),
+                                data[:, -2].astype(np.float32, copy=False),
+                                data[:, -1].astype(np.int64))
+    if min_conf is not None:
+        detections = select(detections, detections.conf >= min_conf)
+    return detections
+
+
+def select(detections, index):
+    """Index all fields of a `Detections` tuple at once (mask or indices)"""
+    return Detections(detections.xyxy[index], detections.conf[index], detections.cls[index])
+
+
+def concat(parts):
+    """Concatenate several `Detections` tuples"""
+    parts = list(parts)
+    if not parts:
+        return empty_detections()
+    return Detections(np.concatenate([p.xyxy for p in parts]),
+                      np.concatenate([p.conf for p in parts]),
+                      np.concatenate([p.cls for p in parts]))
+
+
+def to_dicts(detections, with_box=True):
+    """Detections as the JSON-friendly dicts returned by the API"""
+    if not with_box:
+        return [{'confidence': c} for c in detections.conf.tolist()]
+    return [
+        {'confidence': c, 'box': [round(v, 1) for v in box]}
+        for c, box in zip(detections.conf.tolist(), detections.xyxy.tolist())
+    ]
+
+
+def xyxy_to_xywh(boxes):
+    """[x1, y1, x2, y2] -> [x, y, w, h] with (x, y) the top-left corner"""
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    out = boxes.copy()
+    out[:, 2:] = boxes[:, 2:] - boxes[:, :2]
+    return out
+
+
+def xywh_to_xyxy(boxes):
+    """[x, y, w, h] with (x, y) the top-left corner -> [x1, y1, x2, y2]"""
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    out = boxes.copy()
+    out[:, 2:] = boxes[:, :2] + boxes[:, 2:]
+    return out
+
+
+def area(boxes):
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    return np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 3] - boxes[:, 1], 0, None)
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """Pairwise IoU between (N, 4) and (M, 4) xyxy boxes -> (N, M)"""
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    wh = np.clip(bottom_right - top_left, 0, None)
+    inter = wh[..., 0] * wh[..., 1]
+    union = area(boxes_a)[:, None] + area(boxes_b)[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0).astype(np.float32)
+
+
+def nms(boxes, scores, iou_threshold=0.5, classes=None):
+    """
+    Greedy non-maximum suppression
+
+    Returns the indices of the kept boxes, highest score first. With `classes`,
+    boxes of different classes never suppress each other.
+    """
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    if classes is not None:
+        # Offset each class to its own region so they never overlap
+        offset = np.asarray(classes, dtype=np.float32).reshape(-1, 1) * (boxes.max() + 1)
+        boxes = boxes + offset
+
+    order = np.argsort(-scores, kind='stable')
+    iou = iou_matrix(boxes, boxes)
+    suppressed = np.zeros(len(boxes), dtype=bool)
+    keep = []
+    for i in order:
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        suppressed |= iou[i] > iou_threshold
+    return np.asarray(keep, dtype=np.int64)
+
+
+def merge_boxes(boxes, scores, iou_threshold=0.5):
+    """
+    Weighted box merge: each NMS survivor is replaced by the score-weighted
+    average of the boxes it suppressed (including itself)
+
+    Returns (merged_boxes, merged_scores) where the score is the maximum of
+    the cluster.
+    """
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+    if len(boxes) == 0:
+        return boxes, scores
+
+    order = np.argsort(-scores, kind='stable')
+    iou = iou_matrix(boxes, boxes)
+    assigned = np.zeros(len(boxes), dtype=bool)
+    merged_boxes, merged_scores = [], []
+    for i in order:
+        if assigned[i]:
+            continue
+        cluster = (iou[i] > iou_threshold) & ~assigned
+        cluster[i] = True
+        assigned |= cluster
+        weights = scores[cluster]
+        merged_boxes.append((boxes[cluster] * weights[:, None]).sum(axis=0) / weights.sum())
+        merged_scores.append(weights.max())
+    return np.asarray(merged_boxes, dtype=np.float32), np.asarray(merged_scores, dtype=np.float32)
@@ -1,108 +1,533 @@
-from ultralytics import YOLO
 import cv2
 import os
 import argparse
+import csv
+import glob
+import json
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 
-def process_video(model_path, video_path, output_path=None, conf_threshold=0.25):
+from model_backend import load_model
+from video_pipeline import FrameReader
+
+
+class StageStats:
+    """Busy time and frame count of one pipeline stage (summed over its threads)"""
+
+    def __init__(self, threads=1):
+        self.threads = threads
+        self.seconds = 0.0
+        self.frames = 0
+        self._lock = threading.Lock()
+
+    def add(self, seconds, frames):
+        with self._lock:
+            self.seconds += seconds
+            self.frames += frames
+
+
+def analyze_video(models, video_path, output_path=None, conf_threshold=0.25,
+                  batch_size=4, frame_stride=1, queue_size=32, verbose=True):
     """
-    Process a video file with YOLOv8 model and save the results
-    
+    Run the detection pipeline over one video and return its summary
+
+    The video goes through a staged pipeline: a decoder thread, a pool of
+    inference workers (each with its own model, running batches of frames)
+    and a writer that puts the annotated frames back in order. Queues are
+    bounded, so memory stays flat however long the recording is.
+
     Args:
-        model_path: Path to the trained model
+        models: Loaded models, one per inference thread
         video_path: Path to input video
         output_path: Path to save the output video (optional)
         conf_threshold: Confidence threshold for detections
+        batch_size: Frames sent to the model per call
+        frame_stride: Run detection only on every Nth frame; the others
+            reuse the boxes of the last inferred frame
+        queue_size: Decoded frames buffered ahead of inference
+        verbose: Print progress every 100 frames
     """
-    # Load the model
-    model = YOLO(model_path)
-    
+    workers = len(models)
+    batch_size = max(1, int(batch_size))
+    frame_stride = max(1, int(frame_stride))
+
     # Open video file
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         raise ValueError("Error opening video file")
-    
+
     # Get video properties
     frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     fps = int(cap.get(cv2.CAP_PROP_FPS))
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    
+
     # Setup video writer if output path is provided
+    out = None
     if output_path:
         fourcc = cv2.VideoWriter_fourcc(*'mp4v')
         out = cv2.VideoWriter(output_path, fourcc, fps, (frame_width, frame_height))
-    
+
     # Initialize counters
-    frames_with_detections = 0
-    total_detections = 0
-    frame_count = 0
-    
-    print(f"Processing video with {total_frames} frames...")
+    counters = {'frames': 0, 'inferred': 0, 'with_detections': 0, 'detections': 0,
+                'max_confidence': 0.0, 'first_detection_frame': None, 'last_detection_frame': None}
+    infer_stats = StageStats(workers)
+    plot_stats = StageStats(workers + 1)
+    write_stats = StageStats()
+
+    # Chunks of frames waiting for a worker / waiting to be written. The
+    # semaphore caps the chunks in flight, including the ones the writer holds
+    # back to restore the order
+    work = queue.Queue(maxsize=workers * 2)
+    done = queue.Queue()
+    in_flight = threading.Semaphore(workers * 4)
+    failed = threading.Event()
+    errors = []
+
+    def infer_worker(model):
+        while True:
+            item = work.get()
+            if item is None:
+                return
+            seq, chunk = item
+            if failed.is_set():
+                done.put((seq, []))
+                continue
+            try:
+                batch = [frame for _, frame, inferred in chunk if inferred]
+                start = time.perf_counter()
+                results = model(batch, conf=conf_threshold, verbose=False) if batch else []
+                infer_stats.add(time.perf_counter() - start, len(batch))
+
+                processed = []
+                position = 0
+                start = time.perf_counter()
+                for index, frame, inferred in chunk:
+                    result = None
+                    annotated = None
+                    if inferred:
+                        result = results[position]
+                        position += 1
+                        # Draw results on frame (only needed when writing a video)
+                        if out is not None:
+                            annotated = result.plot()
+                    processed.append((index, frame, annotated, result, inferred))
+                plot_stats.add(time.perf_counter() - start, len(batch) if out is not None else 0)
+                done.put((seq, processed))
+            except Exception as e:
+                errors.append(e)
+                failed.set()
+                done.put((seq, []))
+
+    def writer():
+        next_seq = 0
+        pending = {}
+        last_result = None
+        while True:
+            item = done.get()
+            if item is None:
+                return
+            seq, processed = item
+            pending[seq] = processed
+            while next_seq in pending:
+                for index, frame, annotated, result, inferred in pending.pop(next_seq):
+                    if failed.is_set():
+                        continue
+                    try:
+                        if inferred:
+                            last_result = result
+                            counters['inferred'] += 1
+                            # Count detections
+                            if len(result.boxes) > 0:
+                                counters['with_detections'] += 1
+                                counters['detections'] += len(result.boxes)
+                                counters['max_confidence'] = max(counters['max_confidence'],
+                                                                 float(result.boxes.conf.max()))
+                                if counters['first_detection_frame'] is None:
+                                    counters['first_detection_frame'] = index
+                                counters['last_detection_frame'] = index
+
+                        counters['frames'] += 1
+                        if verbose and counters['frames'] % 100 == 0:
+                            print(f"Processed {counters['frames']}/{total_frames} frames")
+
+                        # Write frame if output path is provided
+                        if out is not None:
+                            if annotated is None:
+                                # Skipped frame: reuse the boxes of the last inferred frame
+                                start = time.perf_counter()
+                                annotated = frame
+                                if last_result is not None and len(last_result.boxes) > 0:
+                                    annotated = last_result.plot(img=frame)
+                                plot_stats.add(time.perf_counter() - start, 1)
+                            start = time.perf_counter()
+                            out.write(annotated)
+                            write_stats.add(time.perf_counter() - start, 1)
+                    except Exception as e:
+                        errors.append(e)
+                        failed.set()
+                in_flight.release()
+                next_seq += 1
+
+    if verbose:
+        print(f"Processing video with {total_frames} frames "
+              f"({workers} workers, batch {batch_size}, stride {frame_stride})...")
     start_time = datetime.now()
-    
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-            
-        frame_count += 1
-        if frame_count % 100 == 0:
-            print(f"Processed {frame_count}/{total_frames} frames")
-        
-        # Run detection
-        results = model(frame, conf=conf_threshold)[0]
-        
-        # Count detections
-        if len(results.boxes) > 0:
-            frames_with_detections += 1
-            total_detections += len(results.boxes)
-        
-        # Draw results on frame
-        annotated_frame = results.plot()
-        
-        # Write frame if output path is provided
-        if output_path:
-            out.write(annotated_frame)
-    
-    # Release resources
-    cap.release()
-    if output_path:
-        out.release()
-    
+
+    reader = FrameReader(cap, max_queue=queue_size)
+    reader.start()
+    worker_threads = [threading.Thread(target=infer_worker, args=(model,), daemon=True) for model in models]
+    writer_thread = threading.Thread(target=writer, daemon=True)
+    for thread in worker_threads + [writer_thread]:
+        thread.start()
+
+    def submit(seq, chunk):
+        # Wait for room in the pipeline unless it already failed
+        while not in_flight.acquire(timeout=0.1):
+            if failed.is_set():
+                return False
+        work.put((seq, chunk))
+        return True
+
+    try:
+        # Group the decoded frames into chunks with batch_size frames to infer
+        seq = 0
+        chunk = []
+        for index, frame in reader:
+            inferred = index % frame_stride == 0
+            chunk.append((index, frame, inferred))
+            if sum(1 for _, _, flag in chunk if flag) >= batch_size:
+                if not submit(seq, chunk):
+                    break
+                seq += 1
+                chunk = []
+        if chunk and not failed.is_set():
+            submit(seq, chunk)
+    finally:
+        reader.stop()
+        reader.join()
+        for _ in worker_threads:
+            work.put(None)
+        for thread in worker_threads:
+            thread.join()
+        done.put(None)
+        writer_thread.join()
+
+        # Release resources
+        cap.release()
+        if out is not None:
+            out.release()
+
+    if errors:
+        raise errors[0]
+
     # Calculate statistics
     processing_time = (datetime.now() - start_time).total_seconds()
-    
+    if counters['frames'] == 0:
+        raise ValueError("No frames could be read from the video")
+
+    def timestamp(index):
+        return round(index / fps, 3) if index is not None and fps else None
+
+    stages = {'decode': StageStats(), 'infer': infer_stats, 'plot': plot_stats, 'write': write_stats}
+    stages['decode'].add(reader.decode_seconds, counters['frames'])
+    return {
+        'video': video_path,
+        'frames': counters['frames'],
+        'inferred_frames': counters['inferred'],
+        'frame_stride': frame_stride,
+        'frames_with_detections': counters['with_detections'],
+        'total_detections': counters['detections'],
+        'max_confidence': round(counters['max_confidence'], 4),
+        'first_detection_time': timestamp(counters['first_detection_frame']),
+        'last_detection_time': timestamp(counters['last_detection_frame']),
+        'duration': timestamp(counters['frames']),
+        'processing_time': round(processing_time, 3),
+        'fps': round(counters['frames'] / processing_time, 2) if processing_time else 0.0,
+        'output': output_path,
+        'stages': {
+            name: {
+                'frames': stats.frames,
+                'busy_seconds': round(stats.seconds, 3),
+                # Frames per busy second, and how busy the stage's threads were
+                # over the whole run (the slowest stage bounds the pipeline)
+                'fps_per_thread': round(stats.frames / stats.seconds, 2) if stats.seconds else 0.0,
+                'utilization': round(stats.seconds / (processing_time * stats.threads), 4) if processing_time else 0.0,
+            }
+            for name, stats in stages.items() if stats.frames
+        },
+    }
+
+
+def load_models(model_path, workers, processes=1):
+    """One model per inference thread (predictors are not shared between threads), splitting the cores"""
+    workers = max(1, int(workers))
+    threads_per_worker = max(1, (os.cpu_count() or 1) // (workers * max(1, processes)))
+    return [load_model(model_path=model_path, threads=threads_per_worker) for _ in range(workers)]
+
+
+def process_video(model_path, video_path, output_path=None, conf_threshold=0.25,
+                  workers=2, batch_size=4, frame_stride=1, queue_size=32):
+    """
+    Process a video file with YOLOv8 model and save the results
+
+    See analyze_video for the pipeline and the arguments; workers is the
+    number of inference threads.
+    """
+    summary = analyze_video(load_models(model_path, workers), video_path, output_path, conf_threshold,
+                            batch_size=batch_size, frame_stride=frame_stride, queue_size=queue_size)
+    frame_count = summary['frames']
+    inferred_count = summary['inferred_frames']
+
     # Print results
     print("\nVideo Analysis Results:")
     print(f"Total frames processed: {frame_count}")
-    print(f"Frames with detections: {frames_with_detections}")
-    print(f"Detection rate: {frames_with_detections/frame_count*100:.2f}%")
-    print(f"Total detections: {total_detections}")
-    print(f"Average detections per frame: {total_detections/frame_count:.2f}")
-    print(f"Processing time: {processing_time:.2f} seconds")
-    print(f"Processing speed: {frame_count/processing_time:.2f} FPS")
-    
+    if frame_stride > 1:
+        print(f"Frames inferred: {inferred_count} (every {frame_stride} frames)")
+    print(f"Frames with detections: {summary['frames_with_detections']}")
+    print(f"Detection rate: {summary['frames_with_detections']/inferred_count*100:.2f}%")
+    print(f"Total detections: {summary['total_detections']}")
+    print(f"Average detections per frame: {summary['total_detections']/inferred_count:.2f}")
+    print(f"Processing time: {summary['processing_time']:.2f} seconds")
+    print(f"Processing speed: {summary['fps']:.2f} FPS")
+
+    print("\nStage throughput:")
+    for name, stats in summary['stages'].items():
+        print(f"  {name:<7} {stats['fps_per_thread']:>9.2f} FPS per thread"
+              f" | busy {stats['busy_seconds']:>7.2f} s | utilization {stats['utilization'] * 100:>5.1f}%")
+
     if output_path:
         print(f"\nProcessed video saved to: {output_path}")
 
+
+# Batch mode: many files spread across processes, each loading its models once
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.m4v')
+
+# Columns of the CSV/Parquet summaries (the JSON lines also carry the per-stage stats)
+SUMMARY_FIELDS = ['video', 'frames', 'inferred_frames', 'frame_stride', 'frames_with_detections',
+                  'total_detections', 'max_confidence', 'first_detection_time', 'last_detection_time',
+                  'duration', 'processing_time', 'fps', 'output']
+
+_batch_models = None
+
+
+def find_videos(inputs):
+    """Video files from directories (recursive) and glob patterns, sorted and without duplicates"""
+    found = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            for root, _, files in os.walk(pattern):
+                found.extend(os.path.join(root, name) for name in files)
+        else:
+            found.extend(glob.glob(pattern, recursive=True))
+    videos = {os.path.abspath(path) for path in found
+              if os.path.isfile(path) and path.lower().endswith(VIDEO_EXTENSIONS)}
+    return sorted(videos)
+
+
+def _init_batch_worker(model_path, workers, processes):
+    global _batch_models
+    _batch_models = load_models(model_path, workers, processes)
+
+
+def _analyze_batch_file(video_path, output_path, conf_threshold, batch_size, frame_stride, queue_size):
+    return analyze_video(_batch_models, video_path, output_path, conf_threshold, batch_size=batch_size,
+                         frame_stride=frame_stride, queue_size=queue_size, verbose=False)
+
+
+def _file_state(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+
+def load_manifest(manifest_path):
+    """Last manifest entry per video (the manifest is append-only JSON lines)"""
+    entries = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # line cut short by an interrupted run
+                entries[entry['video']] = entry
+    return entries
+
+
+class SummaryWriter:
+    """Appends one summary per finished file to <base>.jsonl / <base>.csv; Parquet is rebuilt on close"""
+
+    def __init__(self, base_path, formats):
+        self.base_path = base_path
+        self.formats = set(formats)
+        self._json = open(base_path + '.jsonl', 'a')
+        self._csv = None
+        if 'csv' in self.formats:
+            csv_path = base_path + '.csv'
+            new_file = not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0
+            self._csv_file = open(csv_path, 'a', newline='')
+            self._csv = csv.DictWriter(self._csv_file, fieldnames=SUMMARY_FIELDS, extrasaction='ignore')
+            if new_file:
+                self._csv.writeheader()
+
+    def write(self, summary):
+        # The JSON lines are always kept: they are the source for the Parquet file
+        self._json.write(json.dumps(summary) + '\n')
+        self._json.flush()
+        if self._csv is not None:
+            self._csv.writerow(summary)
+            self._csv_file.flush()
+
+    def close(self):
+        self._json.close()
+        if self._csv is not None:
+            self._csv_file.close()
+        if 'parquet' in self.formats:
+            import pandas as pd
+            with open(self.base_path + '.jsonl') as f:
+                rows = [json.loads(line) for line in f if line.strip()]
+            if rows:
+                frame = pd.DataFrame(rows).drop_duplicates('video', keep='last')
+                frame[[c for c in SUMMARY_FIELDS if c in frame]].to_parquet(self.base_path + '.parquet', index=False)
+
+
+def process_batch(model_path, inputs, summary_path='evaluation_summary', formats=('json', 'csv'),
+                  conf_threshold=0.25, processes=2, workers=1, batch_size=4, frame_stride=1,
+                  queue_size=32, output_dir=None, retry_failed=True):
+    """
+    Evaluate every video matched by inputs (directories or glob patterns)
+
+    Files are spread across `processes` worker processes, each loading its
+    `workers` models once. A summary per file is appended to
+    <summary_path>.jsonl (and .csv/.parquet) as soon as it finishes, and
+    <summary_path>.manifest.jsonl records every finished or failed file, so
+    running the same command again skips the files already done (unless
+    they changed on disk since).
+    """
+    videos = find_videos(inputs)
+    manifest_path = summary_path + '.manifest.jsonl'
+    manifest = load_manifest(manifest_path)
+
+    todo = []
+    for video in videos:
+        entry = manifest.get(video)
+        state = _file_state(video)
+        if entry is not None and entry['size'] == state['size'] and entry['mtime'] == state['mtime']:
+            if entry['status'] == 'done' or not retry_failed:
+                continue
+        todo.append(video)
+
+    print(f"Found {len(videos)} videos, {len(videos) - len(todo)} already done, {len(todo)} to process "
+          f"({processes} processes x {workers} workers)")
+    if not todo:
+        return
+
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        root = os.path.commonpath(todo) if len(todo) > 1 else os.path.dirname(todo[0])
+
+    def output_for(video):
+        if not output_dir:
+            return None
+        relative = os.path.splitext(os.path.relpath(video, root))[0].replace(os.sep, '__')
+        return os.path.join(output_dir, relative + '_detected.mp4')
+
+    summaries = SummaryWriter(summary_path, formats)
+    context = multiprocessing.get_context('spawn')
+    pool = ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=_init_batch_worker,
+                               initargs=(model_path, workers, processes))
+    start_time = datetime.now()
+    finished = failed = 0
+    interrupted = False
+    try:
+        with open(manifest_path, 'a') as manifest_file:
+            futures = {pool.submit(_analyze_batch_file, video, output_for(video), conf_threshold,
+                                   batch_size, frame_stride, queue_size): video for video in todo}
+            for future in as_completed(futures):
+                video = futures[future]
+                entry = dict(video=video, **_file_state(video))
+                try:
+                    summary = future.result()
+                except Exception as e:
+                    failed += 1
+                    entry.update(status='failed', error=str(e))
+                    print(f"[{finished + failed}/{len(todo)}] {video}: error: {e}")
+                else:
+                    finished += 1
+                    summaries.write(summary)
+                    entry.update(status='done', error=None)
+                    print(f"[{finished + failed}/{len(todo)}] {video}: {summary['frames']} frames, "
+                          f"{summary['total_detections']} detections, {summary['fps']:.1f} FPS")
+                # Recorded after the summary so a file is never marked done without one
+                manifest_file.write(json.dumps(entry) + '\n')
+                manifest_file.flush()
+    except KeyboardInterrupt:
+        print("\nInterrupted; run the same command again to resume")
+        interrupted = True
+        raise
+    finally:
+        # Files still running when interrupted are not in the manifest and run again next time
+        pool.shutdown(wait=not interrupted, cancel_futures=True)
+        summaries.close()
+
+    processing_time = (datetime.now() - start_time).total_seconds()
+    print(f"\nBatch finished: {finished} done, {failed} failed in {processing_time:.2f} seconds")
+    print(f"Summaries saved to: {summary_path}.* (manifest: {manifest_path})")
+
 def main():
     parser = argparse.ArgumentParser(description='Process video with YOLOv8 model')
     parser.add_argument('--model', default='best.pt',
                       help='Path to the trained model')
-    parser.add_argument('--video', required=True,
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--video',
                       help='Path to input video file')
+    source.add_argument('--input', nargs='+',
+                      help='Batch mode: directories and/or glob patterns of videos')
     parser.add_argument('--output', default=None,
                       help='Path to save output video (optional)')
     parser.add_argument('--conf', type=float, default=0.25,
                       help='Confidence threshold (default: 0.25)')
-    
+    parser.add_argument('--workers', type=int, default=None,
+                      help='Inference threads (per process in batch mode), each with its own model '
+                           '(default: 2, 1 in batch mode)')
+    parser.add_argument('--batch-size', type=int, default=4,
+                      help='Frames per model call (default: 4)')
+    parser.add_argument('--stride', type=int, default=1,
+                      help='Run detection on every Nth frame (default: 1)')
+    parser.add_argument('--queue-size', type=int, default=32,
+                      help='Decoded frames buffered ahead of inference (default: 32)')
+    parser.add_argument('--processes', type=int, default=2,
+                      help='Batch mode: worker processes (default: 2)')
+    parser.add_argument('--summary', default='evaluation_summary',
+                      help='Batch mode: base path of the summaries and manifest (default: evaluation_summary)')
+    parser.add_argument('--formats', nargs='+', choices=['json', 'csv', 'parquet'], default=['json', 'csv'],
+                      help='Batch mode: summary formats; JSON lines are always written (default: json csv)')
+    parser.add_argument('--output-dir', default=None,
+                      help='Batch mode: directory for the annotated videos (optional)')
+    parser.add_argument('--skip-failed', action='store_true',
+                      help='Batch mode: do not retry files that failed in a previous run')
+
     args = parser.parse_args()
-    
+
+    if args.input:
+        process_batch(args.model, args.input, args.summary, args.formats, args.conf,
+                      processes=args.processes, workers=args.workers or 1,
+                      batch_size=args.batch_size, frame_stride=args.stride,
+                      queue_size=args.queue_size, output_dir=args.output_dir,
+                      retry_failed=not args.skip_failed)
+        return
+
     try:
-        process_video(args.model, args.video, args.output, args.conf)
+        process_video(args.model, args.video, args.output, args.conf,
+                      workers=args.workers or 2, batch_size=args.batch_size,
+                      frame_stride=args.stride, queue_size=args.queue_size)
     except Exception as e:
         print(f"Error processing video: {str(e)}")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -2,8 +2,11 @@ from ultralytics import YOLO
 import cv2
 import time
 import argparse
+from box_ops import boxes_to_numpy
+from motion import MotionGate, MOTION_METHOD
 
-def process_webcam(model_path, conf_threshold=0.25, show_fps=True):
+def process_webcam(model_path, conf_threshold=0.25, show_fps=True, motion_threshold=0.0,
+                   motion_method=MOTION_METHOD):
     """
     Process webcam feed with YOLOv8 model in real-time
     
@@ -11,6 +14,9 @@ def process_webcam(model_path, conf_threshold=0.25, show_fps=True):
         model_path: Path to the trained model
         conf_threshold: Confidence threshold for detections
         show_fps: Whether to show FPS counter
+        motion_threshold: Minimum fraction of changed pixels (0-1) for a frame
+            to be inferred; static frames reuse the last detections (0 disables)
+        motion_method: 'diff' (frame differencing) or 'mog2' (background subtraction)
     """
     # Load the model
     print("Loading model...")
@@ -31,6 +37,9 @@ def process_webcam(model_path, conf_threshold=0.25, show_fps=True):
     frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     
     print("Press 'q' to quit")
+
+    gate = MotionGate(motion_threshold, motion_method, stream='evaluate_webcam')
+    results = None
     
     # Initialize FPS counter
     fps = 0
@@ -42,11 +51,12 @@ def process_webcam(model_path, conf_threshold=0.25, show_fps=True):
         if not ret:
             break
         
-        # Run detection
-        results = model(frame, conf=conf_threshold)[0]
-        
-        # Draw results on frame
-        annotated_frame = results.plot()
+        # Run detection only when the scene changed; otherwise reuse the last boxes
+        if gate.should_infer(frame) or results is None:
+            results = model(frame, conf=conf_threshold)[0]
+            annotated_frame = results.plot()
+        else:
+            annotated_frame = results.plot(img=frame)
         
         # Calculate and display FPS
         frame_count += 1
@@ -68,9 +78,8 @@ def process_webcam(model_path, conf_threshold=0.25, show_fps=True):
         cv2.putText(annotated_frame, f"Detections: {num_detections}", (20, 80),
                    cv2.FONT_HERSHEY_SIMPLEX, 1, text_color, 2)
         
-        # Display confidence for each detection
-        for i, box in enumerate(results.boxes):
-            conf = box.conf.item()
+        # Display confidence for each detection (one host copy for all boxes)
+        for i, conf in enumerate(boxes_to_numpy(results.boxes).conf.tolist()):
             y_pos = 120 + (i * 40)
             cv2.putText(annotated_frame, f"Confidence {i+1}: {conf:.2%}", 
                        (20, y_pos), cv2.FONT_HERSHEY_SIMPLEX, 1, text_color, 2)
@@ -90,6 +99,10 @@ def process_webcam(model_path, conf_threshold=0.25, show_fps=True):
     print("\nSession Statistics:")
     print(f"Total frames processed: {frame_count}")
     print(f"Average FPS: {frame_count/(time.time() - start_time):.1f}")
+    if motion_threshold > 0:
+        motion = gate.stats()
+        print(f"Frames inferred: {motion['inferred']}")
+        print(f"Frames skipped (no motion): {motion['skipped']} ({motion['skip_rate']:.1%})")
 
 def main():
     parser = argparse.ArgumentParser(description='Process webcam feed with YOLOv8 model')
@@ -99,11 +112,15 @@ def main():
                       help='Confidence threshold (default: 0.25)')
     parser.add_argument('--no-fps', action='store_false', dest='show_fps',
                       help='Hide FPS counter')
+    parser.add_argument('--motion-threshold', type=float, default=0.0,
+                      help='Skip inference on frames with less changed pixels than this fraction (default: 0, off)')
+    parser.add_argument('--motion-method', choices=['diff', 'mog2'], default=MOTION_METHOD,
+                      help=f'Motion detection method (default: {MOTION_METHOD})')
     
     args = parser.parse_args()
     
     try:
-        process_webcam(args.model, args.conf, args.show_fps)
+        process_webcam(args.model, args.conf, args.show_fps, args.motion_threshold, args.motion_method)
     except Exception as e:
         print(f"Error processing webcam feed: {str(e)}")
         if 'cap' in locals():
@@ -0,0 +1,30 @@
+import argparse
+
+from model_backend import BACKENDS, MODEL_IMGSZ, MODEL_PATH, export_model
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the YOLOv8 model for a CPU inference backend')
+    parser.add_argument('--model', default=MODEL_PATH,
+                      help=f'Path to the PyTorch checkpoint (default: {MODEL_PATH})')
+    parser.add_argument('--format', choices=[b for b in BACKENDS if b != 'torch'], default='onnx',
+                      help='Target backend (default: onnx)')
+    parser.add_argument('--imgsz', type=int, default=MODEL_IMGSZ,
+                      help=f'Input size (default: {MODEL_IMGSZ})')
+    parser.add_argument('--int8', action='store_true',
+                      help='Quantize the exported model to INT8')
+    parser.add_argument('--calibration', default=None,
+                      help='Video used to calibrate ONNX INT8 (default: dynamic quantization)')
+    parser.add_argument('--data', default=None,
+                      help='Dataset yaml used to calibrate OpenVINO INT8')
+
+    args = parser.parse_args()
+
+    path = export_model(args.model, args.format, args.imgsz, args.int8,
+                        data=args.data, calibration=args.calibration)
+    print(f"Exported model saved to: {path}")
+    print(f"Serve it with MODEL_BACKEND={args.format}{' MODEL_INT8=1' if args.int8 else ''}"
+          f" MODEL_IMGSZ={args.imgsz}")
+
+if __name__ == "__main__":
+    main()
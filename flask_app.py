@@ -1,48 +1,189 @@
-from flask import Flask, request, jsonify, send_file, render_template, make_response
+from flask import Flask, request, jsonify, send_file, render_template, make_response, Response, stream_with_context, g
 from flask_cors import CORS
+from flask_sock import Sock
+from simple_websocket import ConnectionClosed
 import os
 from dotenv import load_dotenv
-import torch
-from ultralytics import YOLO
 import numpy as np
-from PIL import Image
 import cv2
-from tempfile import NamedTemporaryFile
 import io
 import json
-from alertSMSNotification import send_twilio_sms_notification
-from alertEmailNotification import send_email_notification
+from notification_dispatcher import NotificationDispatcher
+from alert_engine import AlertEngine
 import tempfile
-from Rastrear import *
+# Explicit names: the model stack (torch/ultralytics) is only imported when the model is loaded
+from Rastrear import GerenciadorSessoes, ProcessarWEBCAM, PropagadorCaixas
+from video_pipeline import (iter_annotated_frames, render_video, video_timeline, VIDEO_BATCH_SIZE,
+                            VIDEO_FRAME_STRIDE, VIDEO_MOTION_THRESHOLD, VIDEO_KEYFRAME_INTERVAL)
+from jobs import JobManager, DONE, FAILED
+from model_backend import load_model, model_version, MODEL_IMGSZ
+from batching import InferenceScheduler, BATCH_SCHEDULER
+from box_ops import boxes_to_numpy, to_dicts
+from render import draw_boxes, draw_detections, encode_jpeg
+from frame_io import decode_image, decode_upload, read_upload
+from uploads import (LimitedStream, SpooledRequest, StreamCapture, UploadRejected, check_video, is_raw_video,
+                     remove, save_upload, temp_path, MAX_UPLOAD_BYTES, MAX_UPLOAD_MB, UPLOAD_DIR)
+from result_cache import ResultCache, cache_key, RESULT_CACHE_ENABLED
+import metrics
+from metrics import StageTimer
+from motion import METHODS as MOTION_METHODS, MotionGate, MOTION_METHOD, WEBCAM_MOTION_THRESHOLD
+from tiling import predict_tiled, tile_config, tiling_key
 import base64
+import hashlib
+import queue
+import threading
+import time
+import uuid
 
 # Load environment variables
 load_dotenv()
 
 # Initialize Flask app
 app = Flask(__name__)
+# Uploads: body size limit, and file parts spooled to UPLOAD_DIR above UPLOAD_SPOOL_MB
+app.request_class = SpooledRequest
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES or None
 CORS(app)  # Enable CORS for all routes
+sock = Sock(app)  # WebSocket routes
 
-# Load model only once when the container starts
+# Load model only once when the container starts (backend from MODEL_BACKEND)
 model = None
+model_ready = False
+model_lock = threading.Lock()
 
 def get_model():
     global model
     if model is None:
-        model = YOLO('best_finetunned.pt')
-        device = 'cpu'  # Force CPU for Cloud Run
-        model.to(device)
+        with model_lock:
+            if model is None:
+                start = time.perf_counter()
+                model = load_model()
+                metrics.MODEL_LOAD_SECONDS.set(time.perf_counter() - start)
     return model
 
+def warm_up_model(image_size=MODEL_IMGSZ):
+    # Load the weights and run one dummy inference so the first request doesn't pay for it
+    global model_ready
+    loaded = get_model()
+    start = time.perf_counter()
+    loaded(np.zeros((image_size, image_size, 3), dtype=np.uint8), verbose=False)
+    metrics.MODEL_WARMUP_SECONDS.set(time.perf_counter() - start)
+    model_ready = True
+
+def start_background_warm_up(threads=0):
+    # Cold-start mode (PRELOAD_MODEL=background): the process answers /healthz
+    # right away while the model stack is imported and loaded on a thread
+    def run():
+        try:
+            loaded = get_model()
+            if threads:
+                loaded.set_threads(threads)
+            warm_up_model()
+        except Exception:
+            app.logger.exception("Background model warm-up failed")
+
+    thread = threading.Thread(target=run, name='model-warm-up', daemon=True)
+    thread.start()
+    return thread
+
+# Concurrent image/webcam requests are grouped into batched model calls
+scheduler = None
+scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    global scheduler
+    if scheduler is None:
+        with scheduler_lock:
+            if scheduler is None:
+                scheduler = InferenceScheduler(get_model)
+    return scheduler
+
+def detect_image(image_np, confidence_threshold, tiling=None):
+    # Same return shape as get_model()(...): a list with one result
+    if tiling is not None and tiling.mode != 'off':
+        # Tiles are already batched together; they skip the scheduler
+        return predict_tiled(get_model(), [image_np], confidence_threshold, tiling)
+    if BATCH_SCHEDULER:
+        return [get_scheduler().predict(image_np, confidence_threshold)]
+    return get_model()(image_np, conf=confidence_threshold)
+
+# Cache of image detections keyed by upload hash, threshold and model version
+result_cache = None
+result_cache_lock = threading.Lock()
+
+def get_result_cache():
+    global result_cache
+    if result_cache is None:
+        with result_cache_lock:
+            if result_cache is None:
+                result_cache = ResultCache()
+    return result_cache
+
+def response_mode():
+    # 'json' returns structured detections only; anything else returns an annotated image
+    return request.values.get('output', 'image')
+
+def render_mode():
+    # 'fast' draws with the single-pass OpenCV renderer instead of plot() + PIL
+    return request.values.get('render', 'default')
+
+def request_tiling():
+    # Tiled/ROI inference options of this request (tiles, tile_size, tile_overlap, rois...)
+    return tile_config(request.values)
+
+def process_rss_mb():
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().rss / 1024 / 1024, 1)
+    except ImportError:
+        import resource
+        # ru_maxrss is the peak RSS in KiB on Linux
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+# Per-request stage timings: histograms in /metrics, and the breakdown in a
+# Server-Timing header when the client sends X-Profile: 1 (or ?profile=1)
+@app.before_request
+def start_stage_timer():
+    g.stage_timer = StageTimer(request.endpoint)
+
+@app.after_request
+def finish_stage_timer(response):
+    timer = g.get('stage_timer')
+    if timer is not None:
+        timer.finish()
+        if request.headers.get('X-Profile') == '1' or request.args.get('profile') == '1':
+            response.headers['Server-Timing'] = timer.server_timing()
+    return response
+
+def stage(name):
+    # Time a block of the current request: `with stage('infer'): ...`
+    return g.stage_timer.stage(name)
+
 # Error handling
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({'error': 'Not found'}), 404
 
+@app.errorhandler(413)
+def too_large(error):
+    return jsonify({'error': f'Upload is larger than {MAX_UPLOAD_MB:g} MB'}), 413
+
 @app.errorhandler(500)
 def internal_error(error):
+    app.logger.error("Unhandled exception on %s %s", request.method, request.path,
+                     exc_info=getattr(error, 'original_exception', None) or error)
     return jsonify({'error': 'Internal server error'}), 500
 
+# Health checks
+@app.route('/healthz')
+def healthz():
+    return jsonify({'status': 'ok', 'pid': os.getpid(), 'rss_mb': process_rss_mb()})
+
+@app.route('/readyz')
+def readyz():
+    status = 200 if model_ready else 503
+    return jsonify({'ready': model_ready, 'pid': os.getpid()}), status
+
 # Routes
 @app.route('/')
 def home():
@@ -52,141 +193,478 @@ def home():
 def projeto():
     return render_template('projeto.html')
 
-def process_video(file, confidence_threshold):
-    # Save uploaded video to temp file
-    with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_input:
-        file.save(temp_input.name)
-        temp_input_path = temp_input.name
+def process_video(file, confidence_threshold, batch_size=VIDEO_BATCH_SIZE,
+                  frame_stride=VIDEO_FRAME_STRIDE, motion_threshold=VIDEO_MOTION_THRESHOLD,
+                  motion_method=MOTION_METHOD, keyframe_interval=VIDEO_KEYFRAME_INTERVAL, tiling=None):
+    # Output temp file: removed by the caller once the response is sent, or here on error
+    with tempfile.NamedTemporaryFile(suffix='.mp4', dir=UPLOAD_DIR, delete=False) as temp_output:
+        temp_output_path = temp_output.name
 
-    with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_output:
+    try:
+        # Uploaded video in a temp file, removed when the block exits
+        with temp_path() as temp_input_path:
+            with stage('save_upload'):
+                upload_hash = save_upload(file, temp_input_path)
+                check_video(temp_input_path)
+
+            frames_done = 0
+
+            def on_progress(done, total):
+                nonlocal frames_done
+                frames_done = done
+
+            start = time.perf_counter()
+            has_detections, detections, first_detection_frame = render_video(
+                temp_input_path, temp_output_path, get_model(), confidence_threshold,
+                on_progress=on_progress, timer=g.stage_timer,
+                batch_size=batch_size, frame_stride=frame_stride, motion_threshold=motion_threshold,
+                motion_method=motion_method, keyframe_interval=keyframe_interval, tiling=tiling)
+            elapsed = time.perf_counter() - start
+
+        metrics.FRAMES.inc(frames_done, 'process_video')
+        if elapsed > 0:
+            metrics.FRAMES_PER_SECOND.set(round(frames_done / elapsed, 2), 'process_video')
+
+        return temp_output_path, has_detections, detections, first_detection_frame, upload_hash
+
+    except Exception:
+        remove(temp_output_path)
+        raise
+
+def video_detections_only(file, confidence_threshold, options, session_id=None):
+    # Timeline of detections + keyframe thumbnails: no plotting, no output video
+    with temp_path() as temp_input_path:
+        with stage('save_upload'):
+            upload_hash = save_upload(file, temp_input_path)
+            check_video(temp_input_path)
+
+        start = time.perf_counter()
+        timeline = video_timeline(temp_input_path, get_model(), confidence_threshold,
+                                  timer=g.stage_timer, **options)
+        elapsed = time.perf_counter() - start
+
+    metrics.FRAMES.inc(timeline['frames'], 'video_timeline')
+    if elapsed > 0:
+        metrics.FRAMES_PER_SECOND.set(round(timeline['frames'] / elapsed, 2), 'video_timeline')
+
+    alerts = []
+    if timeline['thumbnails']:
+        best = max(timeline['thumbnails'], key=lambda thumbnail: thumbnail['confidence'])
+        with stage('alerts'):
+            alerts = get_alert_engine().process_upload(
+                session_id, [{'confidence': timeline['max_confidence']}], 'Vídeo', lambda: best['image'],
+                dedup_key=upload_hash)
+
+    for thumbnail in timeline['thumbnails']:
+        thumbnail['image'] = base64.b64encode(thumbnail['image']).decode('utf-8')
+    return dict(timeline, alerts=alerts)
+
+# Annotated videos produced by the streaming mode, fetched separately by token
+VIDEO_OUTPUT_TTL = int(os.getenv('VIDEO_OUTPUT_TTL', 600))
+video_outputs = {}
+video_outputs_lock = threading.Lock()
+
+def register_video_output(path):
+    token = uuid.uuid4().hex
+    now = time.time()
+    with video_outputs_lock:
+        # Drop finished outputs nobody came back for; unfinished ones belong to
+        # their stream, which removes them itself if it fails
+        for stale in [t for t, entry in video_outputs.items()
+                      if entry['ready'] and now - entry['ready_at'] > VIDEO_OUTPUT_TTL]:
+            entry = video_outputs.pop(stale)
+            remove(entry['path'])
+        video_outputs[token] = {'path': path, 'ready': False, 'created': now}
+    return token
+
+def video_options(form):
+    # Raises ValueError (answered with 400) for invalid values
+    motion_method = form.get('motion_method', MOTION_METHOD)
+    if motion_method not in MOTION_METHODS:
+        raise ValueError(f"Unknown motion method: {motion_method}")
+    return {
+        'batch_size': int(form.get('batch_size', VIDEO_BATCH_SIZE)),
+        'frame_stride': int(form.get('frame_stride', VIDEO_FRAME_STRIDE)),
+        'motion_threshold': float(form.get('motion_threshold', VIDEO_MOTION_THRESHOLD)),
+        'motion_method': motion_method,
+        'keyframe_interval': int(form.get('keyframe_interval', VIDEO_KEYFRAME_INTERVAL)),
+        'tiling': tile_config(form),
+    }
+
+def stream_video(file, confidence_threshold, options, session_id=None):
+    # file=None: the request body is the video itself and is decoded with PyAV
+    # while it arrives; a form upload is saved first (cv2 needs a seekable file)
+    temp_input_path = None
+    upload_hash = None
+    if file is not None:
+        with tempfile.NamedTemporaryFile(suffix='.mp4', dir=UPLOAD_DIR, delete=False) as temp_input:
+            temp_input_path = temp_input.name
+        try:
+            upload_hash = save_upload(file, temp_input_path)
+            check_video(temp_input_path)
+        except Exception:
+            remove(temp_input_path)
+            raise
+
+    with tempfile.NamedTemporaryFile(suffix='.mp4', dir=UPLOAD_DIR, delete=False) as temp_output:
         temp_output_path = temp_output.name
 
+    token = register_video_output(temp_output_path)
+    timer = g.stage_timer
+    body = request.stream
+
+    def cleanup():
+        # Runs when the stream ends and again when the response is closed, in
+        # case the client went away before the generator ever started
+        if temp_input_path is not None:
+            remove(temp_input_path)
+        with video_outputs_lock:
+            entry = video_outputs.get(token)
+            if entry is not None and not entry['ready']:
+                video_outputs.pop(token)
+                remove(temp_output_path)
+
+    def generate():
+        cap = None
+        out = None
+        body_stream = None
+        try:
+            if temp_input_path is not None:
+                cap = cv2.VideoCapture(temp_input_path)
+            else:
+                body_stream = LimitedStream(body)
+                cap = StreamCapture(body_stream)
+            if not cap.isOpened():
+                yield json.dumps({'error': 'Could not open video file'}) + '\n'
+                return
+
+            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            fps = cap.get(cv2.CAP_PROP_FPS) or 30
+            out = cv2.VideoWriter(temp_output_path, cv2.VideoWriter_fourcc(*'mp4v'), int(fps), (width, height))
+
+            yield json.dumps({'width': width, 'height': height, 'fps': fps, 'result_id': token}) + '\n'
+
+            has_detections = False
+            first_detection_frame = None
+            best_confidence = 0.0
+            frames = 0
+            start = time.perf_counter()
+            for index, annotated_frame, frame_detections, inferred in iter_annotated_frames(
+                    cap, get_model(), confidence_threshold, timer=timer, **options):
+                detections = to_dicts(frame_detections)
+                if detections:
+                    best_confidence = max(best_confidence, max(d['confidence'] for d in detections))
+                    if first_detection_frame is None:
+                        first_detection_frame = annotated_frame.copy()
+                has_detections = has_detections or bool(detections)
+                with timer.stage('write'):
+                    out.write(annotated_frame)
+                frames += 1
+                yield json.dumps({
+                    'frame': index,
+                    'timestamp': round(index / fps, 3),
+                    'inferred': inferred,
+                    'detections': detections
+                }) + '\n'
+
+            out.release()
+            out = None
+            metrics.FRAMES.inc(frames, 'stream_video')
+            elapsed = time.perf_counter() - start
+            if elapsed > 0:
+                metrics.FRAMES_PER_SECOND.set(round(frames / elapsed, 2), 'stream_video')
+            with video_outputs_lock:
+                if token in video_outputs:
+                    video_outputs[token].update(ready=True, ready_at=time.time())
+
+            alerts = []
+            if first_detection_frame is not None:
+                # Raw bodies are hashed as they are read (the decoded part of the upload)
+                dedup_key = upload_hash if body_stream is None else body_stream.sha256.hexdigest()
+                alerts = get_alert_engine().process_upload(
+                    session_id, [{'confidence': best_confidence}], 'Vídeo',
+                    lambda: encode_jpeg(first_detection_frame), dedup_key=dedup_key)
+
+            yield json.dumps({
+                'done': True,
+                'frames': frames,
+                'truncated': getattr(cap, 'truncated', False),
+                'has_detections': has_detections,
+                'alerts': alerts,
+                'result_url': f'/api/detect/result/{token}'
+            }) + '\n'
+        except Exception as e:
+            app.logger.exception("Video stream failed")
+            yield json.dumps({'error': str(e)}) + '\n'
+        finally:
+            if cap is not None:
+                cap.release()
+            if out is not None:
+                out.release()
+            cleanup()
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.call_on_close(cleanup)
+    return response
+
+@app.route('/api/detect/result/<token>', methods=['GET'])
+def detect_result(token):
+    with video_outputs_lock:
+        entry = video_outputs.get(token)
+        if entry is None:
+            return jsonify({'error': 'Not found'}), 404
+        if not entry['ready']:
+            return jsonify({'error': 'Video still processing'}), 409
+        video_outputs.pop(token)
+
+    response = send_file(
+        entry['path'],
+        mimetype='video/mp4',
+        as_attachment=True,
+        download_name='detected_video.mp4'
+    )
+    response.call_on_close(lambda: remove(entry['path']))
+    return response
+
+# Background job queue for long videos (started on first use)
+job_manager = None
+job_manager_lock = threading.Lock()
+
+def get_job_manager():
+    global job_manager
+    if job_manager is None:
+        with job_manager_lock:
+            if job_manager is None:
+                job_manager = JobManager(on_done=alert_finished_job)
+    return job_manager
+
+def alert_finished_job(job):
+    result = job['result']
+    if not result['has_detections']:
+        return
+    jpeg = base64.b64decode(result['detection_image']) if result['detection_image'] else None
+    get_alert_engine().process_upload(job['session_id'], result['detections'], 'Vídeo', lambda: jpeg,
+                                      dedup_key=job.get('upload_hash'))
+
+def job_status(job):
+    return {
+        'job_id': job['id'],
+        'status': job['status'],
+        'progress': round(job['progress'], 4),
+        'error': job['error'],
+        'progress_url': f"/api/jobs/{job['id']}/progress",
+        'result_url': f"/api/jobs/{job['id']}/result"
+    }
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file provided'}), 400
+
+    file = request.files['file']
+    if not file.filename.lower().endswith(('.mp4', '.avi', '.mov')):
+        return jsonify({'error': 'Only video files can be submitted as jobs'}), 400
+
+    confidence_threshold = float(request.form.get('confidence', 0.25))
     try:
-        # Open video capture
-        cap = cv2.VideoCapture(temp_input_path)
-        if not cap.isOpened():
-            raise ValueError("Could not open video file")
-
-        # Get video properties
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fps = int(cap.get(cv2.CAP_PROP_FPS))
-        
-        # Create video writer
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(temp_output_path, fourcc, fps, (width, height))
+        options = video_options(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        job_id = get_job_manager().submit(file, confidence_threshold, options, session_key())
+    except UploadRejected as e:
+        return jsonify({'error': str(e)}), 413
+    return jsonify(job_status(get_job_manager().get(job_id))), 202
 
-        has_detections = False
-        detections = []
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify(job_status(job))
 
-        first_detection_frame = None
-        
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-                
-            # Run detection on frame
-            results = get_model()(frame, conf=confidence_threshold)
-            annotated_frame = results[0].plot()
-            
-            # Check for detections
-            if len(results[0].boxes) > 0:
-                has_detections = True
-                for box in results[0].boxes:
-                    detections.append({
-                        'confidence': float(box.conf.item())
-                    })
-
-                # Save first frame with detections
-                if first_detection_frame is None:
-                    first_detection_frame = annotated_frame.copy()
-            
-            # Write frame
-            out.write(annotated_frame)
+@app.route('/api/jobs/<job_id>/progress', methods=['GET'])
+def get_job_progress(job_id):
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify({
+        'status': job['status'],
+        'progress': round(job['progress'], 4),
+        'frames_done': job['frames_done'],
+        'total_frames': job['total_frames']
+    })
 
-        # Release resources
-        cap.release()
-        out.release()
-        
-        return temp_output_path, has_detections, detections, first_detection_frame
-        
-    except Exception as e:
-        # Clean up temp files in case of error
-        os.unlink(temp_input_path)
-        os.unlink(temp_output_path)
-        raise e
-    finally:
-        # Clean up input file
-        os.unlink(temp_input_path)
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Not found'}), 404
+    if job['status'] == FAILED:
+        return jsonify({'error': job['error']}), 500
+    if job['status'] != DONE:
+        return jsonify(job_status(job)), 409
+
+    result = job['result']
+    response = make_response(send_file(
+        job['output_path'],
+        mimetype='video/mp4',
+        as_attachment=True,
+        download_name='detected_video.mp4'
+    ))
+    response.headers['X-Detections'] = json.dumps({
+        'has_detections': result['has_detections'],
+        'detections': result['detections']
+    })
+    if result['detection_image'] is not None:
+        response.headers['X-Detection-Image'] = json.dumps({
+            'image': result['detection_image']
+        })
+    return response
 
 @app.route('/api/detect', methods=['POST'])
 def detect_objects():
+    if is_raw_video(request):
+        # Raw video body (Content-Type: video/*): decoded while it is uploaded
+        if request.args.get('stream') != 'ndjson':
+            return jsonify({'error': 'Raw video bodies need stream=ndjson; send other videos as a form file'}), 415
+        try:
+            return stream_video(None, float(request.args.get('confidence', 0.25)),
+                                video_options(request.args), session_key())
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
     if 'file' not in request.files:
         return jsonify({'error': 'No file provided'}), 400
     
     file = request.files['file']
     confidence_threshold = float(request.form.get('confidence', 0.25))
+    is_video = file.filename.lower().endswith(('.mp4', '.avi', '.mov'))
+    try:
+        options = video_options(request.form) if is_video else None
+        tiling = None if is_video else request_tiling()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     try:
         
-        if file.filename.lower().endswith(('.mp4', '.avi', '.mov')):
-            
-            output_video_path, has_detections, detections, first_detection_frame = process_video(file, confidence_threshold)
-            
-            # Return video file
-            response = make_response(send_file(
-                output_video_path,
-                mimetype='video/mp4',
-                as_attachment=True,
-                download_name='detected_video.mp4'
-            ))
+        if is_video:
             
-            response.headers['X-Detections'] = json.dumps({
-                'has_detections': has_detections,
-                'detections': detections
-            })
-            
-            if first_detection_frame is not None:
-                # Convert frame to PIL Image
-                frame_image = Image.fromarray(cv2.cvtColor(first_detection_frame, cv2.COLOR_BGR2RGB))
-                
-                # Save to bytes
-                img_byte_arr = io.BytesIO()
-                frame_image.save(img_byte_arr, format='JPEG')
-                img_byte_arr.seek(0)
-                
+            # Streaming mode: per-frame NDJSON, annotated video fetched afterwards
+            if request.form.get('stream', request.args.get('stream')) == 'ndjson':
+                return stream_video(file, confidence_threshold, options, session_key())
+
+            # Detections only: timeline and thumbnails, no annotated video
+            if response_mode() == 'json':
+                return jsonify(video_detections_only(
+                    file, confidence_threshold, options, session_key()))
+
+            output_video_path, has_detections, detections, first_detection_frame, upload_hash = process_video(
+                file, confidence_threshold, **options)
+
+            try:
+                alerts = []
+                first_detection_jpeg = None
+                if first_detection_frame is not None:
+                    # Encode the first frame with detections once (response header and alert)
+                    with stage('encode'):
+                        first_detection_jpeg = encode_jpeg(first_detection_frame)
+                    with stage('alerts'):
+                        alerts = get_alert_engine().process_upload(
+                            session_key(), detections, 'Vídeo', lambda: first_detection_jpeg,
+                            dedup_key=upload_hash)
+
+                # Return video file
+                response = make_response(send_file(
+                    output_video_path,
+                    mimetype='video/mp4',
+                    as_attachment=True,
+                    download_name='detected_video.mp4'
+                ))
+            except Exception:
+                remove(output_video_path)
+                raise
+            # The output is removed once it has been sent
+            response.call_on_close(lambda: remove(output_video_path))
+
+            if first_detection_jpeg is not None:
                 # Add image to response
-                img_base64 = base64.b64encode(img_byte_arr.getvalue()).decode('utf-8')
+                img_base64 = base64.b64encode(first_detection_jpeg).decode('utf-8')
                 response.headers['X-Detection-Image'] = json.dumps({
                     'image': img_base64
                 })
+
+            response.headers['X-Detections'] = json.dumps({
+                'has_detections': has_detections,
+                'detections': detections,
+                'alerts': alerts
+            })
             
             return response
         else:
-            image = Image.open(file)
-            image_np = np.array(image)
-            
-            results = get_model()(image_np, conf=confidence_threshold)
-            plot = results[0].plot()
-            
-            # Convert numpy array to PIL Image
-            plot_image = Image.fromarray(plot)
-            
-            # Save to bytes
-            img_byte_arr = io.BytesIO()
-            plot_image.save(img_byte_arr, format='JPEG')
-            img_byte_arr.seek(0)
+            with stage('read'):
+                # Upload bytes, straight from the in-memory buffer for small uploads
+                data = read_upload(file)
+            json_only = response_mode() == 'json'
+            variant = 'json' if json_only else render_mode()
+
+            # Repeated uploads are answered from the cache without touching the model
+            with stage('cache_lookup'):
+                key = cache_key(data, confidence_threshold, model_version(), variant + tiling_key(tiling)) if RESULT_CACHE_ENABLED else None
+                cached = get_result_cache().get(key) if key is not None else None
+            if cached is not None:
+                full_detections, jpeg = cached
+            else:
+                with stage('decode'):
+                    image_np = decode_image(data)
+
+                with stage('infer'):
+                    results = detect_image(image_np, confidence_threshold, tiling)
+                    boxes_np = boxes_to_numpy(results[0].boxes)
+                full_detections = dict(detections=to_dicts(boxes_np),
+                                       width=image_np.shape[1], height=image_np.shape[0])
+
+                # Detections only: skip plotting and JPEG encoding entirely
+                if json_only:
+                    jpeg = None
+                elif variant == 'fast':
+                    # Single OpenCV pass: draw boxes and encode
+                    with stage('render'):
+                        jpeg = encode_jpeg(draw_detections(image_np, full_detections['detections']))
+                else:
+                    with stage('plot'):
+                        plot = results[0].plot()
+                    
+                    with stage('encode'):
+                        # The plot is BGR like the decoded upload: encoded by OpenCV, no PIL round trip
+                        jpeg = encode_jpeg(plot)
+
+                if key is not None:
+                    get_result_cache().put(key, full_detections, jpeg)
+
+            def alert_jpeg():
+                # output=json skipped rendering: draw the alert image only when an alert fires
+                if jpeg is not None:
+                    return jpeg
+                return encode_jpeg(draw_detections(decode_image(data), full_detections['detections']))
+
+            # Alerts are raised here, from the detections the server already has; the
+            # same image alerts once whatever the output mode or tiling options
+            with stage('alerts'):
+                alerts = get_alert_engine().process_upload(
+                    session_key(), full_detections['detections'], 'Imagem', alert_jpeg,
+                    dedup_key=hashlib.sha256(data).hexdigest())
+
+            if json_only:
+                return jsonify(dict(full_detections, has_detections=len(full_detections['detections']) > 0,
+                                    alerts=alerts))
+
+            img_byte_arr = io.BytesIO(jpeg)
             
             # Get detections
-            has_detections = len(results[0].boxes) > 0
-            detections = []
-            if has_detections:
-                for box in results[0].boxes:
-                    confidence = box.conf.item()
-                    detections.append({
-                        'confidence': float(confidence)
-                    })
+            detections = [{'confidence': d['confidence']} for d in full_detections['detections']]
+            has_detections = len(detections) > 0
             
             # Return both the image and detection data
             response = make_response(send_file(
@@ -197,67 +675,127 @@ def detect_objects():
             ))
             response.headers['X-Detections'] = json.dumps({
                 'has_detections': has_detections,
-                'detections': detections
+                'detections': detections,
+                'alerts': alerts
             })
 
             
             return response
            
+    except UploadRejected as e:
+        return jsonify({'error': str(e)}), 413
     except Exception as e:
+        app.logger.exception("Detection failed")
         return jsonify({'error': str(e)}), 500
     
-tracked_ids = set()
+# Um rastreador por sessão de cliente (IDs estáveis entre quadros, memória limitada)
+sessoes_rastreamento = GerenciadorSessoes()
 
-@app.route('/api/detect_webcam', methods=['POST'])
-# Conjunto global para armazenar os IDs dos objetos rastreados
+# Um filtro de movimento por sessão: quadros sem movimento reaproveitam as últimas detecções
+sessoes_movimento = GerenciadorSessoes(fabrica=lambda: MotionGate(WEBCAM_MOTION_THRESHOLD, stream='webcam'))
+
+# Com FLOW_KEYFRAME_INTERVAL > 1, o YOLO roda a cada N quadros e as caixas seguem o fluxo óptico entre eles
+sessoes_fluxo = GerenciadorSessoes(fabrica=PropagadorCaixas)
+
+def detect_webcam_frame(session_id, image_np, confidence_threshold, motion_threshold=None, keyframe_interval=None,
+                        tiling=None):
+    # Returns (boxes, results, inferred). Skipped frames carry the results of the
+    # last inferred one; with a keyframe interval, frames between keyframes get
+    # the boxes moved by optical flow and no results (None). Frames of one
+    # session are handled one at a time (session locks), so concurrent frames
+    # can't interleave the flow or motion state
+    with sessoes_fluxo.usar(session_id) as propagador:
+        if keyframe_interval is not None:
+            propagador.intervalo = keyframe_interval
+        if propagador.intervalo > 1:
+            if propagador.precisa_inferencia():
+                results = detect_image(image_np, confidence_threshold, tiling)
+                propagador.quadro_chave(image_np, results[0].boxes)
+                return results[0].boxes, results, True
+            return propagador.propagar(image_np), None, False
+
+    with sessoes_movimento.usar(session_id) as gate:
+        if motion_threshold is not None:
+            gate.threshold = motion_threshold
+        if gate.should_infer(image_np) or gate.last is None:
+            gate.last = detect_image(image_np, confidence_threshold, tiling)
+            return gate.last[0].boxes, gate.last, True
+        return gate.last[0].boxes, gate.last, False
+
+def request_motion_threshold():
+    value = request.values.get('motion_threshold')
+    return float(value) if value is not None else None
 
+def request_keyframe_interval():
+    value = request.values.get('keyframe_interval')
+    return int(value) if value is not None else None
 
+def session_key():
+    return (request.form.get('session_id')
+            or request.headers.get('X-Session-ID')
+            or request.remote_addr)
+
+@app.route('/api/detect_webcam', methods=['POST'])
 def detect_webcam():  
     if 'file' not in request.files:  
         return jsonify({'error': 'No file provided'}), 400  
 
     file = request.files['file']  
     confidence_threshold = float(request.form.get('confidence', 0.25))  
+    try:
+        tiling = request_tiling()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     try:  
         # Read image from request  
-        image = Image.open(file)  
-        image_np = np.array(image)  
+        with stage('decode'):
+            image_np = decode_upload(file)
 
-        # Run inference  
-        results = get_model()(image_np, conf=confidence_threshold)  
-        plot = results[0].plot()  
+        # Run inference (unless the scene hasn't changed since the last inferred frame)
+        with stage('infer'):
+            boxes, results, inferred = detect_webcam_frame(
+                session_key(), image_np, confidence_threshold, request_motion_threshold(),
+                request_keyframe_interval(), tiling)
 
         # Get detections and track knives  
-        has_detections, detections, trackers = ProcessarWEBCAM(results[0].boxes, confidence_threshold, image_np)  
-
-        # Convert numpy array to PIL Image  
-        plot_image = Image.fromarray(plot)  
-
-        # Drawing bounding boxes with IDs on the plot
-        for idx, detection in enumerate(detections):
-            box = detection['box']  # Assuming box is in [x_min, y_min, x_max, y_max]
-            detection_id = detection['id']  # Assuming each detection has a unique 'id'
+        with stage('track'):
+            rastreador = sessoes_rastreamento.obter(session_key())
+            has_detections, detections, trackers = ProcessarWEBCAM(boxes, confidence_threshold, image_np, rastreador)  
+        metrics.FRAMES.inc(1, 'detect_webcam')
 
-            # Check if the ID is new
-            if detection_id not in tracked_ids:
-                # New ID found, send notification and add to tracked set
-                tracked_ids.add(detection_id)
-                # Aqui você pode chamar a função para enviar a notificação (ex: enviar_notificacao(detection_id))
+        # Alertas gerados no servidor: deduplicados por ID de trilha, persistência e limite por destinatário
+        with stage('alerts'):
+            alerts = get_alert_engine().process_tracks(
+                session_key(), detections, 'Webcam',
+                lambda: encode_jpeg(draw_detections(image_np.copy(), detections)))
 
-                # Exemplo de envio de notificação
-                print(f"Novo objeto detectado com ID: {detection_id}")
+        # Detections only: the client draws its own overlay
+        if response_mode() == 'json':
+            return jsonify({
+                'has_detections': has_detections,
+                'detections': detections,
+                'ObjectID': [detection['id'] for detection in detections],
+                'inferred': inferred,
+                'alerts': alerts
+            })
 
-            # Label to display on the bounding box
-            label = f"ID: {detection_id}"
+        if render_mode() == 'fast' or results is None:
+            # Single OpenCV pass with the IDs instead of plot() + tracked boxes
+            # (also for propagated frames, which have no YOLO results to plot)
+            with stage('render'):
+                img_byte_arr = io.BytesIO(encode_jpeg(draw_detections(image_np, detections)))
+        else:
+            with stage('plot'):
+                # Reused results are drawn on the current frame
+                plot = results[0].plot() if inferred else results[0].plot(img=image_np)
 
-            # Draw the box and the ID
-            plot_image = Desenhar(plot_image, box, label)
+            # Tracked boxes drawn over the plot (same red frame Desenhar drew with PIL)
+            with stage('draw'):
+                draw_boxes(plot, detections)
 
-        # Save to bytes  
-        img_byte_arr = io.BytesIO()  
-        plot_image.save(img_byte_arr, format='JPEG')  
-        img_byte_arr.seek(0)  
+            with stage('encode'):
+                img_byte_arr = io.BytesIO(encode_jpeg(plot))
 
         # Create directory for detected knives  
         #knife_dir = criar_pasta_para_facas()  
@@ -277,15 +815,247 @@ def detect_webcam():
         response.headers['X-Detections'] = json.dumps({  
             'has_detections': has_detections,  
             'detections': detections,
-            'ObjectID': [detection['id'] for detection in detections]
+            'ObjectID': [detection['id'] for detection in detections],
+            'inferred': inferred,
+            'alerts': alerts
         })  
 
         return response  
 
     except Exception as e:  
+        app.logger.exception("Webcam detection failed")
         return jsonify({'error': str(e)}), 500
 
 
+class LatestFrame:
+    # Single-slot mailbox: a new frame replaces the one not yet processed
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.frame = None
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, frame):
+        with self.condition:
+            if self.frame is not None:
+                self.dropped += 1
+            self.frame = frame
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def take(self):
+        with self.condition:
+            while self.frame is None and not self.closed:
+                self.condition.wait()
+            frame, self.frame = self.frame, None
+            return frame
+
+# Each open socket holds one gthread thread for the whole connection; past the
+# cap new sockets are closed with 1013 (try again later) and the browser falls
+# back to POST /api/detect_webcam, leaving threads for HTTP and the probes
+WEBCAM_MAX_SOCKETS = int(os.getenv('WEBCAM_MAX_SOCKETS', max(1, int(os.getenv('WEB_THREADS', 4)) // 2)))
+webcam_socket_slots = threading.BoundedSemaphore(WEBCAM_MAX_SOCKETS)
+
+def socket_settings(message, current):
+    # Apply one JSON settings message over the current ones (ValueError when invalid)
+    values = json.loads(message)
+    if not isinstance(values, dict):
+        raise ValueError("Settings must be a JSON object")
+    settings = dict(current)
+    try:
+        if 'confidence' in values:
+            settings['confidence'] = float(values['confidence'])
+        if 'session_id' in values:
+            settings['session_id'] = str(values['session_id'])
+        if values.get('motion_threshold') is not None:
+            settings['motion_threshold'] = float(values['motion_threshold'])
+        if values.get('keyframe_interval') is not None:
+            settings['keyframe_interval'] = int(values['keyframe_interval'])
+        settings['tiling'] = tile_config(values, base=current['tiling'])
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid settings: {e}")
+    return settings
+
+@sock.route('/ws/webcam')
+def webcam_socket(ws):
+    # Binary messages: 4-byte big-endian frame id + JPEG bytes
+    # Text messages: JSON settings ({"confidence": 0.25, "session_id": "..."})
+    if not webcam_socket_slots.acquire(blocking=False):
+        metrics.WEBCAM_SOCKETS_REJECTED.inc()
+        ws.close(reason=1013, message='Too many open sockets, use HTTP')
+        return
+    try:
+        serve_webcam_socket(ws)
+    finally:
+        webcam_socket_slots.release()
+
+def serve_webcam_socket(ws):
+    settings = {'confidence': 0.25, 'session_id': request.remote_addr, 'motion_threshold': None,
+                'keyframe_interval': None, 'tiling': tile_config()}
+    latest = LatestFrame()
+    send_lock = threading.Lock()
+
+    def send(data):
+        with send_lock:
+            ws.send(json.dumps(data))
+
+    def receive():
+        nonlocal settings
+        try:
+            while True:
+                message = ws.receive()
+                if message is None:
+                    break
+                if isinstance(message, str):
+                    try:
+                        settings = socket_settings(message, settings)
+                    except ValueError as e:
+                        # Keep the previous settings and tell the client
+                        send({'error': str(e)})
+                elif len(message) > 4:
+                    latest.put((int.from_bytes(message[:4], 'big'), message[4:], time.perf_counter()))
+        except ConnectionClosed:
+            pass
+        finally:
+            latest.close()
+
+    threading.Thread(target=receive, daemon=True).start()
+
+    while True:
+        item = latest.take()
+        if item is None:
+            break
+        frame_id, payload, received = item
+        timer = StageTimer('webcam_socket_frame')
+
+        try:
+            with timer.stage('decode'):
+                image_np = decode_image(payload)
+        except ValueError:
+            try:
+                send({'frame_id': frame_id, 'error': 'Could not decode frame'})
+            except ConnectionClosed:
+                break
+            continue
+
+        current = settings
+        confidence_threshold = current['confidence']
+        session_id = current['session_id']
+        with timer.stage('infer'):
+            boxes, _, inferred = detect_webcam_frame(
+                session_id, image_np, confidence_threshold, current['motion_threshold'],
+                current['keyframe_interval'], current['tiling'])
+        with timer.stage('track'):
+            rastreador = sessoes_rastreamento.obter(session_id)
+            has_detections, detections, _ = ProcessarWEBCAM(boxes, confidence_threshold, image_np, rastreador)
+        with timer.stage('alerts'):
+            alerts = get_alert_engine().process_tracks(
+                session_id, detections, 'Webcam',
+                lambda: encode_jpeg(draw_detections(image_np.copy(), detections)))
+        timer.finish()
+        metrics.FRAMES.inc(1, 'webcam_socket')
+
+        try:
+            send({
+                'frame_id': frame_id,
+                'width': image_np.shape[1],
+                'height': image_np.shape[0],
+                'has_detections': has_detections,
+                'detections': detections,
+                'inferred': inferred,
+                'alerts': alerts,
+                'dropped': latest.dropped,
+                'latency_ms': round((time.perf_counter() - received) * 1000, 1)
+            })
+        except ConnectionClosed:
+            break
+
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    if not RESULT_CACHE_ENABLED:
+        return jsonify({'enabled': False})
+    return jsonify(dict(get_result_cache().stats(), enabled=True))
+
+
+@app.route('/api/scheduler/stats', methods=['GET'])
+def scheduler_stats():
+    if not BATCH_SCHEDULER:
+        return jsonify({'enabled': False})
+    return jsonify(dict(get_scheduler().stats(), enabled=True))
+
+
+# Queue depths are read when /metrics is scraped (0 until the component is used)
+metrics.REGISTRY.register(metrics.Gauge(
+    'visionguard_scheduler_queue_depth', 'Images waiting for a batched model call',
+    function=lambda: scheduler.stats()['queue_depth'] if scheduler is not None else 0))
+metrics.REGISTRY.register(metrics.Gauge(
+    'visionguard_notification_queue_depth', 'Alerts waiting to be delivered',
+    function=lambda: notification_dispatcher.queue_depth() if notification_dispatcher is not None else 0))
+metrics.REGISTRY.register(metrics.Gauge(
+    'visionguard_jobs_pending', 'Video jobs queued or running',
+    function=lambda: job_manager.pending() if job_manager is not None else 0))
+metrics.REGISTRY.register(metrics.Gauge(
+    'visionguard_model_ready', 'Whether the model is loaded and warmed up',
+    function=lambda: int(model_ready)))
+metrics.REGISTRY.register(metrics.Gauge(
+    'visionguard_process_rss_mb', 'Resident memory of this worker', function=process_rss_mb))
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+# Envio de notificações em segundo plano (conexão SMTP e cliente Twilio reaproveitados)
+notification_dispatcher = None
+notification_dispatcher_lock = threading.Lock()
+
+def get_notification_dispatcher():
+    global notification_dispatcher
+    if notification_dispatcher is None:
+        with notification_dispatcher_lock:
+            if notification_dispatcher is None:
+                notification_dispatcher = NotificationDispatcher()
+    return notification_dispatcher
+
+# Alertas disparados pelo servidor a partir das detecções
+alert_engine = None
+alert_engine_lock = threading.Lock()
+
+def get_alert_engine():
+    global alert_engine
+    if alert_engine is None:
+        dispatcher = get_notification_dispatcher()
+        with alert_engine_lock:
+            if alert_engine is None:
+                alert_engine = AlertEngine(dispatcher)
+    return alert_engine
+
+@app.route('/api/alerts/subscribe', methods=['POST'])
+def subscribe_alerts():
+    data = request.json or {}
+    session_id = data.get('session_id')
+    notification_type = data.get('notification_type')
+    if not session_id:
+        return jsonify({"status": "error", "message": "session_id obrigatório."}), 400
+
+    if notification_type == 'sms' and data.get('sms_number'):
+        get_alert_engine().subscribe(session_id, 'sms', data['sms_number'])
+    elif notification_type == 'email' and data.get('email_address'):
+        get_alert_engine().subscribe(session_id, 'email', data['email_address'])
+    else:
+        get_alert_engine().unsubscribe(session_id)
+        return jsonify({"status": "unsubscribed"})
+    return jsonify({"status": "subscribed"})
+
+@app.route('/api/alerts/stats', methods=['GET'])
+def alert_stats():
+    return jsonify(get_alert_engine().stats())
+
 @app.route('/api/send_notification', methods=['POST'])
 def send_notification():
     data = request.json
@@ -296,25 +1066,39 @@ def send_notification():
     image_base64 = data.get('image_base64')  # Imagem em base64 para notificação por e-mail
     
     if notification_type == 'sms' and sms_number:
-        try:
-            send_twilio_sms_notification(sms_number, detection_mode)
-            return jsonify({"status": "success", "message": "SMS enviado com sucesso."}), 200
-        except Exception as e:
-            return jsonify({"status": "error", "message": f"Falha ao enviar o SMS: {str(e)}"}), 500
-    
+        channel, recipient = 'sms', sms_number
     elif notification_type == 'email' and email_address:
-        try:
-            send_email_notification(email_address, detection_mode, image_base64)
-            return jsonify({"status": "success", "message": "E-mail enviado com sucesso."}), 200
-        except Exception as e:
-            return jsonify({"status": "error", "message": f"Falha ao enviar a notificação: {str(e)}"}), 500
-        
+        channel, recipient = 'email', email_address
     else:
         return jsonify({"status": "error", "message": "Dados inválidos ou faltando."}), 400
 
+    # O envio acontece em segundo plano; o cliente pode consultar o status pelo delivery_id
+    try:
+        with stage('enqueue'):
+            delivery_id = get_notification_dispatcher().submit(channel, recipient, detection_mode, image_base64)
+    except queue.Full:
+        return jsonify({"status": "error", "message": "Fila de notificações cheia, tente novamente."}), 503
+
+    return jsonify({
+        "status": "queued",
+        "message": "Notificação enfileirada para envio.",
+        "delivery_id": delivery_id,
+        "status_url": f"/api/notifications/{delivery_id}"
+    }), 202
+
+@app.route('/api/notifications/<delivery_id>', methods=['GET'])
+def notification_status(delivery_id):
+    delivery = get_notification_dispatcher().status(delivery_id)
+    if delivery is None:
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify(delivery)
 
 
 if __name__ == '__main__':
     # Use the PORT environment variable provided by Cloud Run
     port = int(os.getenv('PORT', 8080))
-    app.run(host='0.0.0.0', port=port)
\ No newline at end of file
+    if os.getenv('PRELOAD_MODEL', '1') == '1':
+        warm_up_model()
+    elif os.getenv('PRELOAD_MODEL') == 'background':
+        start_background_warm_up()
+    app.run(host='0.0.0.0', port=port, threaded=True)
\ No newline at end of file
@@ -0,0 +1,58 @@
+"""
+Frame I/O for uploaded images
+
+Uploads are decoded with cv2.imdecode straight from the request buffer into
+a BGR array. That is the layout the video path, the model and the OpenCV
+renderer already use. Alpha and grayscale are resolved by the decoder in the
+same pass (IMREAD_COLOR), and annotated frames are encoded with
+cv2.imencode (render.encode_jpeg). The old path was PIL.Image.open ->
+np.array (RGB/RGBA copy) -> to_bgr -> Image.fromarray -> PIL JPEG, and it
+copied the pixels at every step. cv2.imdecode can't decode into a
+caller-provided array, so every decode allocates a new one.
+"""
+import cv2
+import numpy as np
+
+# EXIF orientation is ignored, as it was with PIL (np.array(Image.open(...)))
+DECODE_FLAGS = cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION
+
+
+def read_upload(file):
+    """
+    Bytes of an uploaded file without an extra copy when possible
+
+    Uploads up to UPLOAD_SPOOL_MB are kept in a BytesIO (uploads.SpooledRequest):
+    getvalue() hands out its buffer as bytes, without a copy when the BytesIO
+    isn't over-allocated. A memoryview (getbuffer) would pin the BytesIO and
+    make werkzeug's close() fail if it outlived the view function. Larger
+    uploads are spooled to disk and read once.
+    Accepts a FileStorage, a file-like object or bytes.
+    """
+    if isinstance(file, (bytes, bytearray, memoryview)):
+        return file
+    stream = getattr(file, 'stream', file)
+    stream.seek(0)
+    if hasattr(stream, 'getvalue'):
+        return stream.getvalue()
+    return stream.read()
+
+
+def decode_image(data):
+    """
+    Decode encoded image bytes (JPEG, PNG, WebP...) into a BGR uint8 array
+
+    Grayscale images come out as 3 channels, alpha is dropped and 16-bit
+    images are reduced to 8 bits, all inside the decoder.
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if buffer.size == 0:
+        raise ValueError("Empty image")
+    image = cv2.imdecode(buffer, DECODE_FLAGS)
+    if image is None:
+        raise ValueError("Could not decode image")
+    return image
+
+
+def decode_upload(file):
+    """read_upload + decode_image"""
+    return decode_image(read_upload(file))
@@ -0,0 +1,41 @@
+import os
+
+# Bind to the port provided by Cloud Run
+bind = f"0.0.0.0:{os.getenv('PORT', 8080)}"
+
+# Load the app (and the model) in the master before forking the workers
+preload_app = True
+
+# Jobs (memory store), result download tokens, alert subscriptions and the
+# webcam tracking sessions live in each worker's memory, so a follow-up
+# request landing on another worker wouldn't find them. One worker by default;
+# more only with the SQLite job store and a load balancer that pins each
+# client to one worker (WEB_STICKY_SESSIONS=1)
+workers = int(os.getenv('WEB_WORKERS', 1))
+if workers > 1 and (os.getenv('JOB_BACKEND', 'memory') != 'sqlite' or os.getenv('WEB_STICKY_SESSIONS') != '1'):
+    raise RuntimeError(f"WEB_WORKERS={workers} needs JOB_BACKEND=sqlite and WEB_STICKY_SESSIONS=1: "
+                       "jobs, result downloads, alert subscriptions and webcam sessions are kept per worker")
+threads = int(os.getenv('WEB_THREADS', 4))
+worker_class = 'gthread'
+timeout = int(os.getenv('WEB_TIMEOUT', 300))
+
+# Inference threads per worker (defaults to an even share of the cores)
+INFER_THREADS = int(os.getenv('INFER_THREADS', max(1, (os.cpu_count() or 1) // workers)))
+
+
+def post_fork(server, worker):
+    import sys
+    if 'torch' in sys.modules:
+        # Only when the master already imported it: in cold-start mode the
+        # worker must not pay for the torch import before serving /healthz
+        import torch
+        torch.set_num_threads(INFER_THREADS)
+
+    # ONNX Runtime / OpenVINO sessions built in the master don't carry their
+    # thread pools across fork; rebuild them in the worker
+    import flask_app
+    if flask_app.model is not None:
+        flask_app.model.set_threads(INFER_THREADS)
+    elif os.getenv('PRELOAD_MODEL', '1') == 'background':
+        flask_app.start_background_warm_up(INFER_THREADS)
+    server.log.info(f"Worker {worker.pid} using {INFER_THREADS} inference threads")
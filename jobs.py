@@ -0,0 +1,278 @@
+import base64
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+from uploads import UploadRejected, check_video, remove, save_upload
+
+# Job queue configuration
+JOB_BACKEND = os.getenv('JOB_BACKEND', 'memory')  # memory | sqlite
+JOB_DB_PATH = os.getenv('JOB_DB_PATH', os.path.join(tempfile.gettempdir(), 'visionguard_jobs.db'))
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+JOB_DIR = os.getenv('JOB_DIR', os.path.join(tempfile.gettempdir(), 'visionguard_jobs'))
+JOB_RESULT_TTL = int(os.getenv('JOB_RESULT_TTL', 3600))
+MODEL_PATH = os.getenv('MODEL_PATH', 'best_finetunned.pt')
+JOB_PURGE_INTERVAL = 60  # seconds between sweeps of expired jobs by the listener thread
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryJobStore:
+    """Job records kept in a dict; enough for a single web process and for tests"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id] = dict(fields, id=job_id)
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def list_ids(self):
+        with self._lock:
+            return list(self._jobs)
+
+    def delete(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+
+class SQLiteJobStore:
+    """Job records persisted as JSON rows in a SQLite file"""
+
+    def __init__(self, path=JOB_DB_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, data TEXT NOT NULL)')
+
+    def create(self, job_id, **fields):
+        with self._lock, self._conn:
+            self._conn.execute('INSERT INTO jobs (id, data) VALUES (?, ?)',
+                               (job_id, json.dumps(dict(fields, id=job_id))))
+
+    def update(self, job_id, **fields):
+        with self._lock, self._conn:
+            row = self._conn.execute('SELECT data FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                return
+            job = json.loads(row[0])
+            job.update(fields)
+            self._conn.execute('UPDATE jobs SET data = ? WHERE id = ?', (json.dumps(job), job_id))
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute('SELECT data FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def list_ids(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute('SELECT id FROM jobs')]
+
+    def delete(self, job_id):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+
+def create_store(backend=JOB_BACKEND):
+    if backend == 'memory':
+        return MemoryJobStore()
+    if backend == 'sqlite':
+        return SQLiteJobStore()
+    raise ValueError(f"Unknown job backend: {backend}")
+
+
+# State of each worker process
+_worker_model = None
+_worker_progress = None
+
+
+def _init_worker(model_path, progress_queue):
+    # model_path=None: job functions that don't need the model (tests)
+    global _worker_model, _worker_progress
+    if model_path is not None:
+        from model_backend import load_model
+        _worker_model = load_model(model_path=model_path)
+    _worker_progress = progress_queue
+
+
+def _run_job(function, job_id, input_path, output_path, conf, options):
+    def on_progress(frames_done, total_frames):
+        _worker_progress.put((job_id, frames_done, total_frames))
+
+    try:
+        return function(on_progress, input_path, output_path, conf, options)
+    finally:
+        remove(input_path)
+
+
+def _run_video_job(on_progress, input_path, output_path, conf, options):
+    from video_pipeline import render_video
+
+    has_detections, detections, first_detection_frame = render_video(
+        input_path, output_path, _worker_model, conf, on_progress=on_progress, **options)
+
+    detection_image = None
+    if first_detection_frame is not None:
+        ok, buffer = cv2.imencode('.jpg', first_detection_frame)
+        if ok:
+            detection_image = base64.b64encode(buffer.tobytes()).decode('utf-8')
+
+    return {
+        'has_detections': has_detections,
+        'detections': detections,
+        'detection_image': detection_image
+    }
+
+
+class JobManager:
+    """
+    Runs video detections on a local process pool and tracks them in a job store
+
+    Each worker process loads its own model once; progress is sent back through
+    a multiprocessing queue and written to the store by a listener thread, which
+    also purges expired jobs every JOB_PURGE_INTERVAL seconds.
+
+    job_function(on_progress, input_path, output_path, conf, options) runs in a
+    worker process and returns the job result; it must be picklable (module level).
+    """
+
+    def __init__(self, store=None, workers=JOB_WORKERS, job_dir=JOB_DIR, model_path=MODEL_PATH, on_done=None,
+                 job_function=_run_video_job, result_ttl=JOB_RESULT_TTL, purge_interval=JOB_PURGE_INTERVAL):
+        self.store = store if store is not None else create_store()
+        self.on_done = on_done
+        self.job_function = job_function
+        self.result_ttl = result_ttl
+        self.purge_interval = purge_interval
+        self.job_dir = job_dir
+        os.makedirs(job_dir, exist_ok=True)
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+        context = multiprocessing.get_context('spawn')
+        self._progress = context.Queue()
+        self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                         initializer=_init_worker,
+                                         initargs=(model_path, self._progress))
+        self._listener = threading.Thread(target=self._listen_progress, daemon=True)
+        self._listener.start()
+
+    def submit(self, file, conf, options, session_id=None):
+        self.purge_expired()
+
+        job_id = uuid.uuid4().hex
+        input_path = os.path.join(self.job_dir, f'{job_id}_input.mp4')
+        output_path = os.path.join(self.job_dir, f'{job_id}_output.mp4')
+        # Rejected uploads (too long) never reach the pool
+        upload_hash = save_upload(file, input_path)
+        try:
+            check_video(input_path)
+        except UploadRejected:
+            remove(input_path)
+            raise
+
+        now = time.time()
+        self.store.create(job_id, status=QUEUED, progress=0.0, frames_done=0, total_frames=0,
+                          created=now, updated=now, output_path=output_path,
+                          result=None, error=None, session_id=session_id, upload_hash=upload_hash)
+
+        with self._pending_lock:
+            self._pending += 1
+        future = self._pool.submit(_run_job, self.job_function, job_id, input_path, output_path, conf, options)
+        future.add_done_callback(lambda f: self._finish(job_id, f))
+        return job_id
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def pending(self):
+        # Jobs submitted to this manager that are queued or running
+        with self._pending_lock:
+            return self._pending
+
+    def _finish(self, job_id, future):
+        with self._pending_lock:
+            self._pending -= 1
+        error = future.exception()
+        if error is None:
+            self.store.update(job_id, status=DONE, progress=1.0, result=future.result(),
+                              updated=time.time())
+            if self.on_done is not None:
+                try:
+                    self.on_done(self.store.get(job_id))
+                except Exception:
+                    logger.exception("Error in job completion hook for %s", job_id)
+        else:
+            self.store.update(job_id, status=FAILED, error=str(error), updated=time.time())
+            job = self.store.get(job_id)
+            if job is not None:
+                remove(job['output_path'])
+
+    def _listen_progress(self):
+        last_purge = time.time()
+        while True:
+            try:
+                message = self._progress.get(timeout=self.purge_interval)
+            except queue.Empty:
+                message = None
+            except (EOFError, OSError, ValueError):
+                return  # queue closed by shutdown
+
+            # Finished jobs expire even when no new jobs are submitted
+            if time.time() - last_purge >= self.purge_interval:
+                last_purge = time.time()
+                try:
+                    self.purge_expired()
+                except Exception:
+                    logger.exception("Failed to purge expired jobs")
+            if message is None:
+                continue
+
+            job_id, frames_done, total_frames = message
+            job = self.store.get(job_id)
+            if job is None or job['status'] in (DONE, FAILED):
+                # Late message for a job that already finished
+                continue
+            progress = frames_done / total_frames if total_frames else 0.0
+            self.store.update(job_id, status=RUNNING, frames_done=frames_done,
+                              total_frames=total_frames, progress=min(progress, 1.0),
+                              updated=time.time())
+
+    def purge_expired(self, ttl=None):
+        ttl = self.result_ttl if ttl is None else ttl
+        now = time.time()
+        for job_id in self.store.list_ids():
+            job = self.store.get(job_id)
+            if job is None or job['status'] not in (DONE, FAILED) or now - job['updated'] < ttl:
+                continue
+            remove(job['output_path'])
+            self.store.delete(job_id)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._progress.close()
@@ -0,0 +1,191 @@
+"""
+Lightweight Prometheus-style metrics
+
+Histograms, counters and gauges kept in process memory and rendered in the
+Prometheus text exposition format by `render()`. `StageTimer` times the
+stages of one request into the stage histogram and keeps the breakdown so
+it can be returned to the caller (`Server-Timing` header).
+
+With several gunicorn workers every worker has its own registry; each
+scrape of /metrics reports the worker that answered it.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; covers a fast JPEG encode up to a long video
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=STAGE_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{_labels(self.labelnames + ("le",), labels + (bound,))} {count}')
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames + ("le",), labels + ("+Inf",))} {series[-1]}')
+                lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {series[-2]}')
+                lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {series[-1]}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+class Gauge:
+    """Gauge set explicitly, or read from a callable at scrape time (None skips it)"""
+
+    def __init__(self, name, help, labelnames=(), function=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        with self._lock:
+            values = dict(self._values)
+        if self.function is not None:
+            value = self.function()
+            if value is not None:
+                values[()] = value
+        for labels, value in sorted(values.items()):
+            lines.append(f'{self.name}{_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'visionguard_request_seconds', 'Request duration by endpoint', ('endpoint',)))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'visionguard_stage_seconds', 'Time spent in each stage of a request', ('endpoint', 'stage')))
+FRAMES = REGISTRY.register(Counter(
+    'visionguard_frames_total', 'Frames processed', ('endpoint',)))
+FRAMES_PER_SECOND = REGISTRY.register(Gauge(
+    'visionguard_frames_per_second', 'Throughput of the last video processed', ('endpoint',)))
+WEBCAM_SOCKETS_REJECTED = REGISTRY.register(Counter(
+    'visionguard_webcam_sockets_rejected_total', 'WebSockets closed because WEBCAM_MAX_SOCKETS were open'))
+MODEL_LOAD_SECONDS = REGISTRY.register(Gauge(
+    'visionguard_model_load_seconds', 'Time to load the model weights'))
+MODEL_WARMUP_SECONDS = REGISTRY.register(Gauge(
+    'visionguard_model_warmup_seconds', 'Time of the warm-up inference'))
+
+
+def render():
+    return REGISTRY.render()
+
+
+class StageTimer:
+    """Times the stages of one request (or one video/frame) for `endpoint`"""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint or 'unknown'
+        self.started = time.perf_counter()
+        self.stages = {}  # stage -> accumulated seconds, in first-seen order
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        STAGE_SECONDS.observe(seconds, self.endpoint, name)
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def finish(self):
+        elapsed = time.perf_counter() - self.started
+        REQUEST_SECONDS.observe(elapsed, self.endpoint)
+        return elapsed
+
+    def server_timing(self):
+        """Breakdown as a Server-Timing header value (milliseconds)"""
+        with self._lock:
+            stages = list(self.stages.items())
+        parts = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in stages]
+        parts.append(f'total;dur={(time.perf_counter() - self.started) * 1000:.1f}')
+        return ', '.join(parts)
+
+
+class NullTimer:
+    """Stand-in for StageTimer when nothing is measured"""
+
+    @contextmanager
+    def stage(self, name):
+        yield
+
+    def add(self, name, seconds):
+        pass
+
+
+NULL_TIMER = NullTimer()
@@ -0,0 +1,214 @@
+"""
+Model loading for the different inference backends
+
+The service always talks to an ultralytics `YOLO` object, so every backend
+returns the same `Results` structure; only the weights file changes:
+
+- torch: the PyTorch checkpoint (`best_finetunned.pt`)
+- onnx: ONNX Runtime on an exported `.onnx` (optionally INT8-quantized)
+- openvino: OpenVINO on an exported `_openvino_model/` directory
+
+Exports are produced by `export_model.py` (or on first load with
+MODEL_AUTO_EXPORT=1).
+"""
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MODEL_BACKEND = os.getenv('MODEL_BACKEND', 'torch')  # torch | onnx | openvino
+MODEL_PATH = os.getenv('MODEL_PATH', 'best_finetunned.pt')
+MODEL_IMGSZ = int(os.getenv('MODEL_IMGSZ', 640))
+MODEL_INT8 = os.getenv('MODEL_INT8', '0') == '1'
+MODEL_AUTO_EXPORT = os.getenv('MODEL_AUTO_EXPORT', '0') == '1'
+INFER_THREADS = int(os.getenv('INFER_THREADS', 0))  # 0 keeps the library default
+
+BACKENDS = ('torch', 'onnx', 'openvino')
+
+
+def exported_path(model_path=MODEL_PATH, backend=MODEL_BACKEND, int8=MODEL_INT8):
+    """Path of the weights used by a backend (the names ultralytics' export uses)"""
+    stem = os.path.splitext(model_path)[0]
+    if backend == 'torch':
+        return model_path
+    if backend == 'onnx':
+        return f'{stem}_int8.onnx' if int8 else f'{stem}.onnx'
+    if backend == 'openvino':
+        return f'{stem}_int8_openvino_model' if int8 else f'{stem}_openvino_model'
+    raise ValueError(f"Unknown model backend: {backend}")
+
+
+def export_model(model_path=MODEL_PATH, backend=MODEL_BACKEND, imgsz=MODEL_IMGSZ, int8=MODEL_INT8,
+                 data=None, calibration=None):
+    """
+    Export the PyTorch checkpoint for a backend and return the exported path
+
+    Args:
+        data: Dataset yaml used by ultralytics to calibrate OpenVINO INT8
+        calibration: Video used to calibrate ONNX INT8 (static quantization);
+            without it the ONNX model is quantized dynamically
+    """
+    from ultralytics import YOLO
+
+    if backend == 'torch':
+        return model_path
+
+    if backend == 'onnx':
+        # Dynamic axes so batched calls (video pipeline, scheduler) work
+        onnx_path = YOLO(model_path).export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True)
+        if not int8:
+            return onnx_path
+        int8_path = exported_path(model_path, 'onnx', int8=True)
+        quantize_onnx(onnx_path, int8_path, imgsz, calibration)
+        return int8_path
+
+    if backend == 'openvino':
+        kwargs = {'format': 'openvino', 'imgsz': imgsz, 'dynamic': True, 'int8': int8}
+        if int8 and data:
+            kwargs['data'] = data
+        return YOLO(model_path).export(**kwargs)
+
+    raise ValueError(f"Unknown model backend: {backend}")
+
+
+def quantize_onnx(onnx_path, output_path, imgsz=MODEL_IMGSZ, calibration=None, calibration_frames=64):
+    """INT8 quantization with ONNX Runtime (static with calibration frames, dynamic otherwise)"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    if calibration is None:
+        quantize_dynamic(onnx_path, output_path, weight_type=QuantType.QUInt8)
+        return output_path
+
+    import cv2
+    import numpy as np
+    import onnxruntime
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, quantize_static
+
+    input_name = onnxruntime.InferenceSession(onnx_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+
+    class VideoCalibrationReader(CalibrationDataReader):
+        def __init__(self):
+            cap = cv2.VideoCapture(calibration)
+            total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or calibration_frames
+            step = max(1, total // calibration_frames)
+            self.frames = []
+            index = 0
+            while len(self.frames) < calibration_frames:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                if index % step == 0:
+                    # Same preprocessing as the model input: RGB, square, 0-1, NCHW
+                    resized = cv2.resize(frame, (imgsz, imgsz))[:, :, ::-1]
+                    self.frames.append(np.ascontiguousarray(resized.transpose(2, 0, 1)[None], dtype=np.float32) / 255)
+                index += 1
+            cap.release()
+            self.iterator = iter(self.frames)
+
+        def get_next(self):
+            frame = next(self.iterator, None)
+            return None if frame is None else {input_name: frame}
+
+    quantize_static(onnx_path, output_path, VideoCalibrationReader(),
+                    quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    return output_path
+
+
+class DetectionModel:
+    """
+    YOLO model on the configured backend
+
+    Called like a `YOLO` object (`model(frames, conf=...)`) and returns the
+    same `Results`; the input size is applied to every call.
+    """
+
+    def __init__(self, backend=MODEL_BACKEND, model_path=MODEL_PATH, imgsz=MODEL_IMGSZ,
+                 threads=INFER_THREADS, int8=MODEL_INT8):
+        from ultralytics import YOLO
+
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown model backend: {backend}")
+        self.backend = backend
+        self.imgsz = imgsz
+        self.threads = threads
+        self.path = exported_path(model_path, backend, int8)
+        if not os.path.exists(self.path):
+            if not MODEL_AUTO_EXPORT:
+                raise FileNotFoundError(
+                    f"{self.path} not found; run `python export_model.py --format {backend}"
+                    f"{' --int8' if int8 else ''}` or set MODEL_AUTO_EXPORT=1")
+            export_model(model_path, backend, imgsz, int8)
+
+        self.model = YOLO(self.path, task='detect')
+        if backend == 'torch':
+            self.model.to('cpu')  # Force CPU for Cloud Run
+        self._runtime_configured = False
+        self.set_threads(threads)
+
+    def __call__(self, source, **kwargs):
+        kwargs.setdefault('imgsz', self.imgsz)
+        results = self.model(source, **kwargs)
+        if not self._runtime_configured:
+            self._configure_runtime()
+        return results
+
+    def set_threads(self, threads):
+        """
+        Set the inference thread count (0 = library default)
+
+        ONNX Runtime and OpenVINO sessions are rebuilt, which also gives a
+        forked gunicorn worker its own thread pool instead of the master's.
+        """
+        self.threads = threads
+        if self.backend == 'torch':
+            if threads:
+                import torch
+                torch.set_num_threads(threads)
+            self._runtime_configured = True
+        elif getattr(self.model, 'predictor', None) is not None:
+            self._configure_runtime()
+        else:
+            # ultralytics creates the session on the first call
+            self._runtime_configured = False
+
+    def _configure_runtime(self):
+        # Swap the session ultralytics created with default options for one
+        # with the configured thread count
+        backend = getattr(getattr(self.model, 'predictor', None), 'model', None)
+        if self.backend == 'onnx' and hasattr(backend, 'session'):
+            import onnxruntime
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = self.threads
+            options.inter_op_num_threads = 1
+            backend.session = onnxruntime.InferenceSession(self.path, options, providers=['CPUExecutionProvider'])
+        elif self.backend == 'openvino' and hasattr(backend, 'ov_compiled_model'):
+            import glob
+            import openvino
+            core = openvino.Core()
+            config = {'PERFORMANCE_HINT': backend.ov_compiled_model.get_property('PERFORMANCE_HINT')}
+            if self.threads:
+                config['INFERENCE_NUM_THREADS'] = self.threads
+            xml_path = glob.glob(os.path.join(self.path, '*.xml'))[0]
+            backend.ov_compiled_model = core.compile_model(core.read_model(xml_path), 'CPU', config)
+        self._runtime_configured = True
+
+    def to(self, device):
+        if self.backend == 'torch':
+            self.model.to(device)
+        return self
+
+
+def load_model(**kwargs):
+    return DetectionModel(**kwargs)
+
+
+def model_version(backend=MODEL_BACKEND, model_path=MODEL_PATH, int8=MODEL_INT8):
+    """Identifier of the weights in use (MODEL_VERSION or backend + file size/mtime)"""
+    version = os.getenv('MODEL_VERSION')
+    if version:
+        return version
+    path = exported_path(model_path, backend, int8)
+    stat = os.stat(path)
+    return f'{backend}-{os.path.basename(path.rstrip(os.sep))}-{stat.st_size}-{int(stat.st_mtime)}'
@@ -0,0 +1,126 @@
+"""
+Cheap motion pre-filter in front of the model
+
+Frames are reduced to a small blurred grayscale thumbnail and compared
+either with the last inferred frame (frame differencing) or with a MOG2
+background model. Frames whose changed-pixel fraction is below the
+threshold skip inference and reuse the last detections.
+"""
+import os
+import threading
+
+import cv2
+import numpy as np
+
+from metrics import REGISTRY, Counter
+
+MOTION_METHOD = os.getenv('MOTION_METHOD', 'diff')  # diff | mog2
+# Minimum fraction of changed pixels (0-1) for a webcam frame to be inferred; 0 disables the gate
+WEBCAM_MOTION_THRESHOLD = float(os.getenv('WEBCAM_MOTION_THRESHOLD', 0))
+# Infer at least every N frames even in a static scene, so detections don't go stale
+MOTION_MAX_SKIP = int(os.getenv('MOTION_MAX_SKIP', 30))
+
+# Width of the grayscale thumbnail used for motion detection
+MOTION_WIDTH = 160
+# Per-pixel intensity change that counts as motion
+MOTION_PIXEL_DELTA = 25
+
+METHODS = ('diff', 'mog2')
+
+MOTION_FRAMES = REGISTRY.register(Counter(
+    'visionguard_motion_frames_total', 'Frames seen by the motion gate', ('stream', 'decision')))
+
+
+def motion_thumbnail(frame):
+    """Downscaled, blurred grayscale copy of a BGR frame used for motion checks"""
+    height, width = frame.shape[:2]
+    size = (MOTION_WIDTH, max(1, int(height * MOTION_WIDTH / width)))
+    gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    gray = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+    return cv2.GaussianBlur(gray, (5, 5), 0)
+
+
+def motion_score(previous, current):
+    """Fraction of thumbnail pixels that changed between two motion thumbnails"""
+    diff = cv2.absdiff(previous, current)
+    return float(np.count_nonzero(diff > MOTION_PIXEL_DELTA)) / diff.size
+
+
+class MotionGate:
+    """
+    Per-stream decision of which frames go to the model
+
+    Args:
+        threshold: Minimum fraction of changed pixels (0-1); 0 infers every frame
+        method: 'diff' compares with the last inferred frame, 'mog2' uses a
+            background subtractor (more robust to noise and lighting drift)
+        max_skip: Infer at least every max_skip frames; 0 never forces
+        stream: Label of the stream in the motion counters of /metrics
+
+    `last` is free for the caller to keep the detections of the last
+    inferred frame.
+    """
+
+    def __init__(self, threshold, method=MOTION_METHOD, max_skip=MOTION_MAX_SKIP, stream='default'):
+        if method not in METHODS:
+            raise ValueError(f"Unknown motion method: {method}")
+        self.threshold = threshold
+        self.method = method
+        self.max_skip = max_skip
+        self.stream = stream
+        self.last = None
+        self.score = None
+        self.inferred = 0
+        self.skipped = 0
+        self._reference = None
+        self._since_inferred = 0
+        self._subtractor = None
+        self._lock = threading.Lock()
+
+    def should_infer(self, frame):
+        """Whether the frame must go through the model (also updates the counters)"""
+        with self._lock:
+            infer = self._decide(frame)
+            if infer:
+                self.inferred += 1
+                self._since_inferred = 0
+            else:
+                self.skipped += 1
+                self._since_inferred += 1
+        MOTION_FRAMES.inc(1, self.stream, 'inferred' if infer else 'skipped')
+        return infer
+
+    def _decide(self, frame):
+        if self.threshold <= 0:
+            return True
+        thumbnail = motion_thumbnail(frame)
+
+        if self.method == 'mog2':
+            if self._subtractor is None:
+                self._subtractor = cv2.createBackgroundSubtractorMOG2(history=200, detectShadows=False)
+                self._subtractor.apply(thumbnail)
+                return True
+            mask = self._subtractor.apply(thumbnail)
+            self.score = float(np.count_nonzero(mask)) / mask.size
+        else:
+            if self._reference is None:
+                self._reference = thumbnail
+                return True
+            self.score = motion_score(self._reference, thumbnail)
+
+        if self.score >= self.threshold or (self.max_skip and self._since_inferred + 1 >= self.max_skip):
+            # Differencing compares against the last inferred frame, so slow
+            # changes still add up until they cross the threshold
+            self._reference = thumbnail
+            return True
+        return False
+
+    def stats(self):
+        with self._lock:
+            total = self.inferred + self.skipped
+            return {
+                'inferred': self.inferred,
+                'skipped': self.skipped,
+                'skip_rate': round(self.skipped / total, 4) if total else 0.0,
+                'last_score': self.score,
+            }
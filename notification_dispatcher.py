@@ -0,0 +1,190 @@
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from metrics import STAGE_SECONDS
+
+# Notification dispatcher configuration
+NOTIFY_QUEUE_SIZE = int(os.getenv('NOTIFY_QUEUE_SIZE', 1000))
+NOTIFY_WORKERS = int(os.getenv('NOTIFY_WORKERS', 2))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv('NOTIFY_MAX_ATTEMPTS', 4))
+NOTIFY_BACKOFF_SECONDS = float(os.getenv('NOTIFY_BACKOFF_SECONDS', 1.0))
+NOTIFY_BATCH_WINDOW = float(os.getenv('NOTIFY_BATCH_WINDOW', 2.0))
+NOTIFY_BATCH_MAX = int(os.getenv('NOTIFY_BATCH_MAX', 20))
+NOTIFY_HISTORY = int(os.getenv('NOTIFY_HISTORY', 10000))
+
+QUEUED = 'queued'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+
+
+class EmailTransport:
+    """Sends batched alerts over a single reused, authenticated SMTP connection"""
+
+    def __init__(self, connection=None):
+        from alertEmailNotification import ConexaoSMTP
+        self.connection = connection or ConexaoSMTP()
+
+    def send(self, recipient, alerts):
+        from alertEmailNotification import montar_mensagem
+        self.connection.enviar(montar_mensagem(recipient, alerts))
+
+    def close(self):
+        self.connection.fechar()
+
+
+class SMSTransport:
+    """Sends batched alerts as one SMS through a single Twilio client"""
+
+    def __init__(self, client=None):
+        from alertSMSNotification import obter_cliente
+        self.client = client or obter_cliente()
+
+    def send(self, recipient, alerts):
+        from alertSMSNotification import enviar_sms
+        modes = ", ".join(sorted({mode for mode, _ in alerts if mode})) or "-"
+        if len(alerts) == 1:
+            body = "Alerta: Objeto cortante detectado! Origem: " + modes
+        else:
+            body = f"Alerta: {len(alerts)} detecções de objeto cortante! Origem: {modes}"
+        enviar_sms(recipient, body, cliente=self.client)
+
+    def close(self):
+        pass
+
+
+class NotificationDispatcher:
+    """
+    Background delivery of email/SMS alerts
+
+    `submit` only enqueues the alert and returns a delivery id. A collector
+    thread groups alerts for the same (channel, recipient) arriving within
+    batch_window seconds into one message; worker threads send the batches
+    through the channel's transport, retrying with exponential backoff.
+
+    Transports are any object with `send(recipient, alerts)` where alerts is a
+    list of (detection_mode, image_base64); pass stubs to test without SMTP or
+    Twilio.
+    """
+
+    def __init__(self, transports=None, workers=NOTIFY_WORKERS, queue_size=NOTIFY_QUEUE_SIZE,
+                 max_attempts=NOTIFY_MAX_ATTEMPTS, backoff=NOTIFY_BACKOFF_SECONDS,
+                 batch_window=NOTIFY_BATCH_WINDOW, batch_max=NOTIFY_BATCH_MAX):
+        self._transports = dict(transports or {})
+        self._transport_factories = {'email': EmailTransport, 'sms': SMSTransport}
+        self._transports_lock = threading.Lock()
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.batch_window = batch_window
+        self.batch_max = batch_max
+
+        self._incoming = queue.Queue(maxsize=queue_size)
+        self._batches = queue.Queue()
+        self._deliveries = OrderedDict()
+        self._deliveries_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+        self._threads = [threading.Thread(target=self._collect, daemon=True)]
+        self._threads += [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, channel, recipient, detection_mode, image_base64=None):
+        """Queue an alert and return its delivery id; raises queue.Full when saturated"""
+        if channel not in self._transports and channel not in self._transport_factories:
+            raise ValueError(f"Unknown notification channel: {channel}")
+
+        delivery_id = uuid.uuid4().hex
+        self._set_status(delivery_id, status=QUEUED, channel=channel, attempts=0,
+                         batch_size=None, error=None, created=time.time())
+        try:
+            self._incoming.put_nowait((delivery_id, channel, recipient, detection_mode, image_base64))
+        except queue.Full:
+            with self._deliveries_lock:
+                self._deliveries.pop(delivery_id, None)
+            raise
+        return delivery_id
+
+    def status(self, delivery_id):
+        with self._deliveries_lock:
+            delivery = self._deliveries.get(delivery_id)
+            return dict(delivery, delivery_id=delivery_id) if delivery is not None else None
+
+    def queue_depth(self):
+        return self._incoming.qsize() + self._batches.qsize()
+
+    def close(self):
+        self._stopped.set()
+        with self._transports_lock:
+            for transport in self._transports.values():
+                transport.close()
+
+    def _set_status(self, delivery_id, **fields):
+        with self._deliveries_lock:
+            delivery = self._deliveries.setdefault(delivery_id, {})
+            delivery.update(fields)
+            self._deliveries.move_to_end(delivery_id)
+            while len(self._deliveries) > NOTIFY_HISTORY:
+                self._deliveries.popitem(last=False)
+
+    def _transport(self, channel):
+        with self._transports_lock:
+            if channel not in self._transports:
+                self._transports[channel] = self._transport_factories[channel]()
+            return self._transports[channel]
+
+    def _collect(self):
+        # (channel, recipient) -> {'deadline': t, 'items': [...]}
+        pending = {}
+        while not self._stopped.is_set():
+            timeout = 0.5
+            if pending:
+                timeout = max(0.0, min(batch['deadline'] for batch in pending.values()) - time.time())
+            try:
+                item = self._incoming.get(timeout=timeout)
+                _, channel, recipient, _, _ = item
+                batch = pending.setdefault((channel, recipient),
+                                           {'deadline': time.time() + self.batch_window, 'items': []})
+                batch['items'].append(item)
+            except queue.Empty:
+                pass
+
+            now = time.time()
+            for key in [k for k, b in pending.items() if b['deadline'] <= now or len(b['items']) >= self.batch_max]:
+                self._batches.put((key, pending.pop(key)['items']))
+
+    def _work(self):
+        while not self._stopped.is_set():
+            try:
+                (channel, recipient), items = self._batches.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            delivery_ids = [item[0] for item in items]
+            alerts = [(item[3], item[4]) for item in items]
+            error = None
+            for attempt in range(1, self.max_attempts + 1):
+                for delivery_id in delivery_ids:
+                    self._set_status(delivery_id, status=SENDING, attempts=attempt, batch_size=len(items))
+                try:
+                    start = time.perf_counter()
+                    self._transport(channel).send(recipient, alerts)
+                    STAGE_SECONDS.observe(time.perf_counter() - start, 'notification_dispatcher', f'send_{channel}')
+                    error = None
+                    break
+                except Exception as e:
+                    error = e
+                    if attempt < self.max_attempts:
+                        # Exponential backoff with jitter
+                        time.sleep(self.backoff * (2 ** (attempt - 1)) * (0.5 + random.random()))
+
+            for delivery_id in delivery_ids:
+                if error is None:
+                    self._set_status(delivery_id, status=SENT, error=None, sent=time.time())
+                else:
+                    self._set_status(delivery_id, status=FAILED, error=str(error))
@@ -0,0 +1,77 @@
+"""
+Single-pass OpenCV renderer for detections
+
+Draws boxes and labels straight onto a BGR array with Hershey fonts (built
+into OpenCV, nothing to load per call) and encodes with cv2.imencode. It
+replaces the `results.plot()` + PIL `Desenhar` + PIL JPEG chain when a client
+asks for `render=fast`.
+"""
+import cv2
+
+BOX_COLOR = (0, 0, 255)  # BGR red
+TEXT_COLOR = (255, 255, 255)
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+FONT_SCALE = 0.5
+FONT_THICKNESS = 1
+JPEG_QUALITY = 90
+
+# Label sizes only depend on the text, so they are measured once
+_text_sizes = {}
+
+
+def _text_size(label):
+    size = _text_sizes.get(label)
+    if size is None:
+        (width, height), baseline = cv2.getTextSize(label, FONT, FONT_SCALE, FONT_THICKNESS)
+        size = (width, height + baseline)
+        if len(_text_sizes) < 4096:
+            _text_sizes[label] = size
+    return size
+
+
+def to_bgr(image):
+    """Convert an RGB/RGBA/grayscale array (as produced by PIL) to BGR"""
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_RGBA2BGR)
+    return cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+
+
+def draw_detections(image, detections, color=BOX_COLOR, thickness=2):
+    """
+    Draw detections in place on a BGR image and return it
+
+    Args:
+        image: BGR numpy array
+        detections: dicts with 'box' (xyxy), 'confidence' and optionally 'id'
+    """
+    for detection in detections:
+        x1, y1, x2, y2 = (int(v) for v in detection['box'])
+        cv2.rectangle(image, (x1, y1), (x2, y2), color, thickness)
+
+        label = f"{detection['confidence']:.2f}"
+        if 'id' in detection:
+            label = f"ID: {detection['id']} {label}"
+        width, height = _text_size(label)
+        top = max(0, y1 - height - 2)
+        cv2.rectangle(image, (x1, top), (x1 + width + 4, top + height + 2), color, -1)
+        cv2.putText(image, label, (x1 + 2, top + height - 2), FONT, FONT_SCALE,
+                    TEXT_COLOR, FONT_THICKNESS, cv2.LINE_AA)
+    return image
+
+
+def draw_boxes(image, detections, color=BOX_COLOR, thickness=3):
+    """Draw only the rectangles of detections in place on a BGR image and return it"""
+    for detection in detections:
+        x1, y1, x2, y2 = (int(v) for v in detection['box'])
+        cv2.rectangle(image, (x1, y1), (x2, y2), color, thickness)
+    return image
+
+
+def encode_jpeg(image, quality=JPEG_QUALITY):
+    """Encode a BGR array as JPEG bytes"""
+    ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Could not encode image")
+    return buffer.tobytes()
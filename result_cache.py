@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Result cache configuration
+RESULT_CACHE_ENABLED = os.getenv('RESULT_CACHE', '1') == '1'
+RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', 3600))
+RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR')  # optional on-disk tier
+RESULT_CACHE_DISK_MAX_BYTES = int(os.getenv('RESULT_CACHE_DISK_MAX_BYTES', 512 * 1024 * 1024))
+
+
+def cache_key(data, confidence, model_version, variant=''):
+    """Key for an upload: hash of the bytes + threshold + model version + response variant"""
+    digest = hashlib.sha256(data).hexdigest()
+    return hashlib.sha256(f'{digest}:{confidence:.4f}:{model_version}:{variant}'.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Bounded LRU + TTL cache of detection results
+
+    Each entry holds the detections and, when the response has one, the
+    encoded annotated JPEG. The in-memory tier is capped by total size; the
+    optional disk tier is written through, so entries evicted from memory (or
+    lost on restart) can still be served, up to its own size cap. The disk
+    tier's sizes are kept in an index scanned once at startup, so a write
+    doesn't list the directory.
+    """
+
+    def __init__(self, max_bytes=RESULT_CACHE_MAX_BYTES, ttl=RESULT_CACHE_TTL,
+                 disk_dir=RESULT_CACHE_DIR, disk_max_bytes=RESULT_CACHE_DISK_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()  # key -> (created, detections, jpeg, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0}
+        self._disk = OrderedDict()  # key -> bytes on disk, oldest first
+        self._disk_bytes = 0
+        self._disk_lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._scan_disk()
+
+    def get(self, key):
+        """Return (detections, jpeg) or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry[0] <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self._counters['memory_hits'] += 1
+                    return entry[1], entry[2]
+                self._remove(key)
+                self._counters['expired'] += 1
+
+        entry = self._read_disk(key, now)
+        with self._lock:
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+            self._counters['disk_hits'] += 1
+            self._insert(key, *entry)
+            return entry[1], entry[2]
+
+    def put(self, key, detections, jpeg=None):
+        created = time.time()
+        with self._lock:
+            self._insert(key, created, detections, jpeg)
+        self._write_disk(key, created, detections, jpeg)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._counters['memory_hits'] + self._counters['disk_hits'] + self._counters['misses']
+            hits = lookups - self._counters['misses']
+            return dict(self._counters,
+                        entries=len(self._entries),
+                        bytes=self._bytes,
+                        max_bytes=self.max_bytes,
+                        hit_rate=round(hits / lookups, 4) if lookups else 0.0,
+                        disk=bool(self.disk_dir))
+
+    def _insert(self, key, created, detections, jpeg):
+        size = len(jpeg or b'') + len(json.dumps(detections))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (created, detections, jpeg, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._counters['evictions'] += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry[3]
+
+    # On-disk tier: <key>.json (+ <key>.jpg), expiry from the file mtime
+
+    def _paths(self, key):
+        return os.path.join(self.disk_dir, key + '.json'), os.path.join(self.disk_dir, key + '.jpg')
+
+    def _read_disk(self, key, now):
+        if not self.disk_dir:
+            return None
+        json_path, jpg_path = self._paths(key)
+        try:
+            created = os.path.getmtime(json_path)
+            if now - created > self.ttl:
+                self._delete_disk(key)
+                return None
+            with open(json_path) as f:
+                detections = json.load(f)
+            jpeg = None
+            if os.path.exists(jpg_path):
+                with open(jpg_path, 'rb') as f:
+                    jpeg = f.read()
+            return created, detections, jpeg
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key, created, detections, jpeg):
+        if not self.disk_dir:
+            return
+        json_path, jpg_path = self._paths(key)
+        try:
+            size = 0
+            if jpeg is not None:
+                with open(jpg_path, 'wb') as f:
+                    f.write(jpeg)
+                size += len(jpeg)
+            # Write the index file last so readers never see a half-written entry
+            temp_path = json_path + '.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump(detections, f)
+                size += f.tell()
+            os.replace(temp_path, json_path)
+            os.utime(json_path, (created, created))
+        except OSError:
+            return
+
+        with self._disk_lock:
+            self._disk_bytes += size - self._disk.pop(key, 0)
+            self._disk[key] = size
+            # Drop the oldest entries (both files) once the tier goes over its size cap
+            victims = []
+            total = self._disk_bytes
+            for old_key, old_size in self._disk.items():
+                if total <= self.disk_max_bytes or old_key == key:
+                    break
+                victims.append(old_key)
+                total -= old_size
+        for old_key in victims:
+            self._delete_disk(old_key)
+
+    def _delete_disk(self, key):
+        with self._disk_lock:
+            self._disk_bytes -= self._disk.pop(key, 0)
+        for path in self._paths(key):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def _scan_disk(self):
+        # Sizes and ages of the entries left by a previous run, oldest first
+        entries = {}
+        for entry in os.scandir(self.disk_dir):
+            if entry.is_file():
+                stat = entry.stat()
+                key = entry.name.split('.', 1)[0]
+                mtime, size = entries.get(key, (stat.st_mtime, 0))
+                entries[key] = (min(mtime, stat.st_mtime), size + stat.st_size)
+        for key, (_, size) in sorted(entries.items(), key=lambda item: item[1][0]):
+            self._disk[key] = size
+            self._disk_bytes += size
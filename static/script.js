@@ -1,7 +1,14 @@
 // Add these variables at the top
 let webcamStream = null;
 let isWebcamActive = false;
+// WebSocket channel for webcam detection (falls back to HTTP when unavailable)
+let webcamSocket = null;
+let framesInFlight = 0;
+let nextFrameId = 0;
+const MAX_FRAMES_IN_FLIGHT = 2;
 const Objetos = new Set();
+// Identifica esta aba para o rastreador do servidor (IDs estáveis entre quadros)
+const sessionId = (window.crypto && crypto.randomUUID) ? crypto.randomUUID() : String(Date.now()) + Math.random().toString(16).slice(2);
 
 function showConfidenceSliderAndUploadCard() {
     const mode = document.getElementById('detectionMode').value;
@@ -47,15 +54,15 @@ function showConfidenceSliderAndUploadCard() {
     });
 }
 
-function triggerAlert(hasDetections, image_base64, detection_mode) {
+function triggerAlert(hasDetections, alerts) {
     
     if (hasDetections) {
         document.getElementById('detectedObjectsAlert').classList.remove('d-none');
         document.getElementById('noDetectionsAlert').classList.add('d-none');
 
-        const notificationType = document.querySelector('input[name="notificationType"]:checked')?.value;
-        if (notificationType !== 'none' && notificationType !== undefined) {
-            sendAlert(image_base64, detection_mode);
+        // As notificações são disparadas pelo servidor; aqui só mostramos o aviso
+        if (alerts && alerts.length > 0) {
+            document.getElementById("notificationSentAlert").classList.remove("d-none");
         }
     } else {
         document.getElementById('noDetectionsAlert').classList.remove('d-none');
@@ -64,33 +71,22 @@ function triggerAlert(hasDetections, image_base64, detection_mode) {
     
 }
 
-async function sendAlert(image_base64, detection_mode) {
-
+// Registra no servidor para onde enviar os alertas desta sessão
+async function subscribeAlerts() {
     const notificationType = document.querySelector('input[name="notificationType"]:checked')?.value;
-    const smsNumber = "+55" + document.getElementById('smsNumber').value;
-    const emailAddress = document.getElementById('emailAddress').value;
-
     const data = {
-        detection_mode: detection_mode,
+        session_id: sessionId,
         notification_type: notificationType,
-        sms_number: smsNumber,
-        email_address: emailAddress,
-        image_base64: image_base64
+        sms_number: "+55" + document.getElementById('smsNumber').value,
+        email_address: document.getElementById('emailAddress').value
     };
 
     try {
-        const response = await fetch('/api/send_notification', {
+        await fetch('/api/alerts/subscribe', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify(data)
         });
-
-        if (!response.ok) throw new Error('Network response was not ok');
-
-        // Lógica para processar a resposta, se necessário
-        const result = await response.json();
-        document.getElementById("notificationSentAlert").classList.remove("d-none");
-        
     } catch (error) {
         console.error('Error:', error);
     }
@@ -153,9 +149,12 @@ async function detectObjects() {
         return;
     }
 
+    await subscribeAlerts();
+
     const formData = new FormData();
     formData.append('file', file);
     formData.append('confidence', document.getElementById('confidenceRange').value);
+    formData.append('session_id', sessionId);
 
     try {
         const response = await fetch('/api/detect', {
@@ -172,28 +171,8 @@ async function detectObjects() {
 
         const blob = await response.blob();
 
-        let image_base64 = null;
-        let detection_mode = "Imagem"
-
-        if (file.type.startsWith('image/')) {
-            image_base64 = await new Promise((resolve, reject) => {
-                const reader = new FileReader();
-                reader.onloadend = () => resolve(reader.result.split(',')[1]);
-                reader.onerror = reject;
-                reader.readAsDataURL(blob);
-            });
-        }
-
-        if (file.type.startsWith('video/')) {
-            const imageDetection = JSON.parse(response.headers.get('X-Detection-Image'));
-            if (imageDetection) {
-                image_base64 = imageDetection.image;
-            }
-            detection_mode = "Vídeo"
-        }
-
         // Update alert visibility based on detections
-        triggerAlert(detectionData.has_detections, image_base64, detection_mode);
+        triggerAlert(detectionData.has_detections, detectionData.alerts);
 
         const processedImage = document.getElementById('processedImage');
         const processedVideo = document.getElementById('processedVideo');
@@ -249,6 +228,8 @@ async function startWebcam() {
             } 
         });
         
+        await subscribeAlerts();
+
         video.srcObject = stream;
         webcamStream = stream;
         isWebcamActive = true;
@@ -256,8 +237,12 @@ async function startWebcam() {
         startButton.style.display = 'none';
         stopButton.style.display = 'inline-block';
         
-        // Start detection loop
-        detectWebcam();
+        // Start detection loop (WebSocket when available, HTTP otherwise)
+        if ('WebSocket' in window) {
+            startWebcamSocket();
+        } else {
+            detectWebcam();
+        }
         
     } catch (error) {
         console.error('Error accessing webcam:', error);
@@ -266,6 +251,12 @@ async function startWebcam() {
 }
 
 function stopWebcam() {
+    if (webcamSocket) {
+        webcamSocket.close();
+        webcamSocket = null;
+    }
+    clearOverlay();
+
     if (webcamStream) {
         webcamStream.getTracks().forEach(track => track.stop());
         webcamStream = null;
@@ -317,6 +308,7 @@ async function detectWebcam() {
         const formData = new FormData();
         formData.append('file', blob, 'webcam.jpg');
         formData.append('confidence', document.getElementById('confidenceRange').value);
+        formData.append('session_id', sessionId);
         
         const response = await fetch('/api/detect_webcam', {
             method: 'POST',
@@ -337,14 +329,8 @@ async function detectWebcam() {
             
             const blob = await response.blob();
 
-            if (newDetections) {
-                const image_base64 = await new Promise((resolve, reject) => {
-                    const reader = new FileReader();
-                    reader.onloadend = () => resolve(reader.result.split(',')[1]);
-                    reader.onerror = reject;
-                    reader.readAsDataURL(blob);
-                });
-                triggerAlert(detectionData.has_detections, image_base64, "Webcam");
+            if (newDetections || (detectionData.alerts && detectionData.alerts.length > 0)) {
+                triggerAlert(detectionData.has_detections, detectionData.alerts);
             }
 
             const imgUrl = URL.createObjectURL(blob);
@@ -392,3 +378,169 @@ async function detectWebcam() {
     }
 }
 
+
+function webcamSettings() {
+    return JSON.stringify({
+        confidence: parseFloat(document.getElementById('confidenceRange').value),
+        session_id: sessionId
+    });
+}
+
+function startWebcamSocket() {
+    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+    const socket = new WebSocket(`${protocol}//${window.location.host}/ws/webcam`);
+    socket.binaryType = 'arraybuffer';
+    framesInFlight = 0;
+
+    socket.onopen = () => {
+        socket.send(webcamSettings());
+        sendWebcamFrame();
+    };
+
+    socket.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+        // Frames older than the answered one were either answered or dropped by the server
+        if (data.frame_id !== undefined) {
+            framesInFlight = Math.max(0, nextFrameId - 1 - data.frame_id);
+        }
+        handleSocketDetections(data);
+        requestAnimationFrame(sendWebcamFrame);
+    };
+
+    socket.onclose = () => {
+        // Fall back to the HTTP endpoint if the socket drops while the camera is on
+        if (webcamSocket === socket && isWebcamActive) {
+            webcamSocket = null;
+            detectWebcam();
+        }
+    };
+
+    document.getElementById('confidenceRange').onchange = () => {
+        if (webcamSocket && webcamSocket.readyState === WebSocket.OPEN) {
+            webcamSocket.send(webcamSettings());
+        }
+    };
+
+    webcamSocket = socket;
+}
+
+async function sendWebcamFrame() {
+    const socket = webcamSocket;
+    if (!isWebcamActive || !socket || socket.readyState !== WebSocket.OPEN) return;
+
+    // Backpressure: never queue more than MAX_FRAMES_IN_FLIGHT frames
+    if (framesInFlight >= MAX_FRAMES_IN_FLIGHT) return;
+
+    const video = document.getElementById('webcamVideo');
+    if (video.readyState !== video.HAVE_ENOUGH_DATA) {
+        requestAnimationFrame(sendWebcamFrame);
+        return;
+    }
+
+    const canvas = document.getElementById('webcamCanvas');
+    const ctx = canvas.getContext('2d');
+    canvas.width = video.videoWidth;
+    canvas.height = video.videoHeight;
+    ctx.drawImage(video, 0, 0);
+
+    framesInFlight++;
+    const frameId = nextFrameId++;
+    const blob = await new Promise((resolve) => canvas.toBlob(resolve, 'image/jpeg', 0.7));
+    if (!blob || socket.readyState !== WebSocket.OPEN) return;
+
+    // 4-byte big-endian frame id followed by the JPEG bytes
+    const jpeg = new Uint8Array(await blob.arrayBuffer());
+    const message = new Uint8Array(4 + jpeg.length);
+    new DataView(message.buffer).setUint32(0, frameId);
+    message.set(jpeg, 4);
+    socket.send(message.buffer);
+
+    // Keep the pipeline full while under the in-flight limit
+    requestAnimationFrame(sendWebcamFrame);
+}
+
+function drawDetections(ctx, detections) {
+    ctx.lineWidth = 3;
+    ctx.font = '16px Roboto, sans-serif';
+    detections.forEach(detection => {
+        const [x1, y1, x2, y2] = detection.box;
+        const label = `ID: ${detection.id} ${(detection.confidence * 100).toFixed(0)}%`;
+        ctx.strokeStyle = '#dc3545';
+        ctx.strokeRect(x1, y1, x2 - x1, y2 - y1);
+        const textWidth = ctx.measureText(label).width;
+        ctx.fillStyle = '#dc3545';
+        ctx.fillRect(x1, Math.max(0, y1 - 20), textWidth + 8, 20);
+        ctx.fillStyle = '#fff';
+        ctx.fillText(label, x1 + 4, Math.max(15, y1 - 5));
+    });
+}
+
+function clearOverlay() {
+    const overlay = document.getElementById('webcamOverlay');
+    if (overlay) {
+        overlay.getContext('2d').clearRect(0, 0, overlay.width, overlay.height);
+    }
+}
+
+function handleSocketDetections(data) {
+    if (data.error) {
+        console.error('Error during webcam detection:', data.error);
+        return;
+    }
+
+    // Boxes are drawn client-side on a canvas laid over the video
+    const overlay = document.getElementById('webcamOverlay');
+    overlay.width = data.width;
+    overlay.height = data.height;
+    const ctx = overlay.getContext('2d');
+    ctx.clearRect(0, 0, overlay.width, overlay.height);
+    drawDetections(ctx, data.detections);
+
+    let newDetections = false;
+    data.detections.forEach(detection => {
+        if (!Objetos.has(detection.id)) {
+            Objetos.add(detection.id);
+            newDetections = true;
+        }
+    });
+    if (data.alerts && data.alerts.length > 0) {
+        triggerAlert(data.has_detections, data.alerts);
+    }
+    if (!newDetections) return;
+
+    // Snapshot of the current frame with the boxes for the gallery and the alert
+    const video = document.getElementById('webcamVideo');
+    const snapshot = document.createElement('canvas');
+    snapshot.width = data.width;
+    snapshot.height = data.height;
+    const snapshotCtx = snapshot.getContext('2d');
+    snapshotCtx.drawImage(video, 0, 0, data.width, data.height);
+    drawDetections(snapshotCtx, data.detections);
+
+    const dataUrl = snapshot.toDataURL('image/jpeg', 0.9);
+    triggerAlert(data.has_detections, data.alerts);
+
+    const gallery = document.getElementById('detectionGallery');
+    const container = document.createElement('div');
+    const detectedImg = document.createElement('img');
+    const timestamp = document.createElement('div');
+    detectedImg.src = dataUrl;
+    timestamp.className = 'detection-timestamp';
+    timestamp.textContent = new Date().toLocaleTimeString();
+    container.appendChild(detectedImg);
+    container.appendChild(timestamp);
+    gallery.insertBefore(container, gallery.firstChild);
+
+    // Keep only last 10 detections
+    if (gallery.children.length > 10) {
+        gallery.removeChild(gallery.lastChild);
+    }
+}
+
+// Mantém a inscrição de alertas do servidor em dia com as opções de notificação
+document.querySelectorAll('input[name="notificationType"]').forEach(option => {
+    option.addEventListener('change', subscribeAlerts);
+});
+['smsNumber', 'emailAddress'].forEach(id => {
+    document.getElementById(id).addEventListener('change', subscribeAlerts);
+});
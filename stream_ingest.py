@@ -0,0 +1,433 @@
+"""
+Headless multi-camera ingestion
+
+Each source (RTSP/HTTP URL, device index or a local video file standing in
+for a camera) is decoded on its own thread into a single-frame slot: a new
+frame replaces the one not yet inferred, so a slow model never builds up a
+backlog. One scheduler thread shares the model across all streams. Every
+stream has an FPS budget, and the most overdue streams go first in a batched
+model call, so a busy camera cannot starve the others.
+
+Detections are written as JSON lines (one per inferred frame with boxes),
+with track IDs per stream. Per-stream stats (decoded, inferred, dropped
+frames, lag) are printed periodically and, with --port, served on /streams
+next to the Prometheus /metrics. Run from the repository root:
+
+    python stream_ingest.py --source entrada=rtsp://10.0.0.5/stream1 \
+        --source patio=output2_finetunned.mp4 --fps 5 --port 9100
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+
+from metrics import REGISTRY, Counter, Gauge, Histogram, render
+from model_backend import load_model
+from Rastrear import ProcessarWEBCAM, Rastreador
+from tiling import predict_tiled, tile_config
+
+STREAM_FPS = float(os.getenv('STREAM_FPS', 5))  # inference budget per stream; 0 = as fast as possible
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', 8))
+STREAM_RECONNECT_MAX = float(os.getenv('STREAM_RECONNECT_MAX', 30))  # seconds between reconnect attempts
+
+logger = logging.getLogger(__name__)
+
+STREAM_FRAMES = REGISTRY.register(Counter(
+    'visionguard_stream_frames_total', 'Frames of the ingested streams', ('stream', 'decision')))
+STREAM_LAG_SECONDS = REGISTRY.register(Histogram(
+    'visionguard_stream_lag_seconds', 'Time from decode to detections', ('stream',)))
+STREAM_UP = REGISTRY.register(Gauge(
+    'visionguard_stream_up', 'Whether the stream is delivering frames', ('stream',)))
+
+
+class FrameSlot:
+    """Latest decoded frame of one stream; overwriting an unread frame counts as a drop"""
+
+    def __init__(self, notify):
+        self._lock = threading.Lock()
+        self._notify = notify
+        self.frame = None  # (sequence, frame, decoded_at)
+        self.sequence = 0
+        self.dropped = 0
+
+    def put(self, frame):
+        with self._lock:
+            if self.frame is not None:
+                self.dropped += 1
+            self.sequence += 1
+            self.frame = (self.sequence, frame, time.monotonic())
+        self._notify()
+
+    def take(self):
+        with self._lock:
+            item, self.frame = self.frame, None
+            return item
+
+    def ready(self):
+        with self._lock:
+            return self.frame is not None
+
+
+class CaptureStream(threading.Thread):
+    """
+    Decode one source into its FrameSlot
+
+    Local files are paced at their own FPS (and optionally looped) so they
+    behave like a live camera; network sources reconnect with exponential
+    backoff up to STREAM_RECONNECT_MAX seconds.
+    """
+
+    def __init__(self, name, source, fps=STREAM_FPS, conf=0.25, loop=False, tiling=None, notify=lambda: None):
+        super().__init__(name=f'capture-{name}', daemon=True)
+        self.stream_name = name
+        self.source = int(source) if str(source).isdigit() else source
+        self.is_file = isinstance(self.source, str) and os.path.exists(self.source)
+        self.fps = fps
+        self.conf = conf
+        self.tiling = tiling  # tiling.TileConfig of this camera (tiles/ROIs), None = whole frame
+        self.loop = loop
+        self.slot = FrameSlot(notify)
+        self.status = 'connecting'
+        self.decoded = 0
+        self.reconnects = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        backoff = 1.0
+        while not self._stopped.is_set():
+            cap = cv2.VideoCapture(self.source)
+            if not cap.isOpened():
+                cap.release()
+                if self.is_file:
+                    self._set_status('failed')
+                    return
+                self._set_status('reconnecting')
+                self._stopped.wait(backoff)
+                backoff = min(backoff * 2, STREAM_RECONNECT_MAX)
+                self.reconnects += 1
+                continue
+
+            backoff = 1.0
+            self._set_status('live')
+            try:
+                self._read(cap)
+            finally:
+                cap.release()
+
+            if self.is_file and not self.loop:
+                break
+            if not self.is_file and not self._stopped.is_set():
+                self._set_status('reconnecting')
+                self.reconnects += 1
+        self._set_status('ended')
+
+    def _read(self, cap):
+        interval = 1.0 / (cap.get(cv2.CAP_PROP_FPS) or 30) if self.is_file else 0.0
+        next_frame = time.monotonic()
+        while not self._stopped.is_set():
+            ret, frame = cap.read()
+            if not ret:
+                return
+            self.decoded += 1
+            self.slot.put(frame)
+            if interval:
+                # A file decodes much faster than real time: play it at its own rate
+                next_frame += interval
+                delay = next_frame - time.monotonic()
+                if delay > 0:
+                    self._stopped.wait(delay)
+                else:
+                    next_frame = time.monotonic()
+
+    def _set_status(self, status):
+        self.status = status
+        STREAM_UP.set(1 if status == 'live' else 0, self.stream_name)
+
+    def stop(self):
+        self._stopped.set()
+
+
+class _StreamState:
+    def __init__(self, capture):
+        self.capture = capture
+        self.interval = 1.0 / capture.fps if capture.fps > 0 else 0.0
+        self.next_due = 0.0
+        self.last_served = 0.0
+        self.last_sequence = 0
+        self.inferred = 0
+        self.budget_misses = 0
+        self.failures = 0
+        self.last_error = None
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self.started = time.monotonic()
+        self.tracker = Rastreador()
+
+
+class StreamScheduler:
+    """
+    Share one model across many CaptureStreams
+
+    A stream is due when it has a new frame and its FPS budget allows another
+    inference. Due streams are served earliest deadline first (ties: least
+    recently served), up to batch_size frames per model call. Frames that
+    arrive while a stream waits for its turn replace each other in the slot
+    and count as dropped.
+
+    Args:
+        model: Detection model (called with a list of frames)
+        on_result: callable(stream_name, result_dict) for every inferred frame
+        batch_size: Maximum frames from different streams per model call
+    """
+
+    def __init__(self, model, on_result, batch_size=STREAM_BATCH_SIZE):
+        self.model = model
+        self.on_result = on_result
+        self.batch_size = max(1, batch_size)
+        self.streams = {}
+        self._wakeup = threading.Condition()
+        self._stopped = False
+
+    def notify(self):
+        with self._wakeup:
+            self._wakeup.notify()
+
+    def add(self, capture):
+        self.streams[capture.stream_name] = _StreamState(capture)
+
+    def stop(self):
+        with self._wakeup:
+            self._stopped = True
+            self._wakeup.notify()
+
+    def _due(self, now):
+        due, wait = [], None
+        for state in self.streams.values():
+            if not state.capture.slot.ready():
+                continue
+            if state.next_due <= now:
+                due.append(state)
+            else:
+                wait = state.next_due - now if wait is None else min(wait, state.next_due - now)
+        due.sort(key=lambda state: (state.next_due, state.last_served))
+        return due[:self.batch_size], wait
+
+    def run(self):
+        while True:
+            with self._wakeup:
+                while True:
+                    if self._stopped:
+                        return
+                    batch, wait = self._due(time.monotonic())
+                    if batch:
+                        break
+                    if wait is None and not any(s.capture.is_alive() for s in self.streams.values()):
+                        return
+                    self._wakeup.wait(wait if wait is not None else 0.5)
+
+            try:
+                self._infer(batch)
+            except Exception as e:
+                # One failed model call must not stop the scheduler for every stream
+                logger.exception("Inference failed for streams %s", [s.capture.stream_name for s in batch])
+                for state in batch:
+                    state.failures += 1
+                    state.last_error = str(e)
+                    STREAM_FRAMES.inc(1, state.capture.stream_name, 'failed')
+
+    def _infer(self, batch):
+        taken = []
+        now = time.monotonic()
+        for state in batch:
+            item = state.capture.slot.take()
+            if item is None:
+                continue
+            if state.interval and state.next_due and now - state.next_due > state.interval:
+                state.budget_misses += 1
+            # A stream served late is due again right away, behind the ones waiting longer
+            state.next_due = max((state.next_due or now) + state.interval, now)
+            state.last_served = now
+            taken.append((state, item))
+        if not taken:
+            return
+
+        min_conf = min(state.capture.conf for state, _ in taken)
+        # Streams with tiles/ROIs share the same batched call as the others
+        results = predict_tiled(self.model, [frame for _, (_, frame, _) in taken], min_conf,
+                                [state.capture.tiling for state, _ in taken])
+        done = time.monotonic()
+
+        for (state, (sequence, frame, decoded_at)), result in zip(taken, results):
+            name = state.capture.stream_name
+            skipped = sequence - state.last_sequence - 1
+            state.last_sequence = sequence
+            if skipped > 0:
+                STREAM_FRAMES.inc(skipped, name, 'dropped')
+            STREAM_FRAMES.inc(1, name, 'inferred')
+
+            lag = done - decoded_at
+            state.inferred += 1
+            state.lag_total += lag
+            state.lag_max = max(state.lag_max, lag)
+            STREAM_LAG_SECONDS.observe(lag, name)
+
+            # Results of the shared call are filtered back to each stream's threshold
+            _, detections, _ = ProcessarWEBCAM(result.boxes, state.capture.conf, frame, state.tracker)
+            self.on_result(name, {
+                'stream': name,
+                'frame': sequence,
+                'time': time.time(),
+                'lag_ms': round(lag * 1000, 1),
+                'detections': detections,
+            })
+
+    def stats(self):
+        now = time.monotonic()
+        stats = {}
+        for name, state in self.streams.items():
+            capture = state.capture
+            elapsed = max(now - state.started, 1e-6)
+            stats[name] = {
+                'status': capture.status,
+                'fps_budget': capture.fps,
+                'decoded': capture.decoded,
+                'inferred': state.inferred,
+                'dropped': capture.slot.dropped,
+                'inferred_fps': round(state.inferred / elapsed, 2),
+                'budget_misses': state.budget_misses,
+                'failures': state.failures,
+                'last_error': state.last_error,
+                'avg_lag_ms': round(state.lag_total / state.inferred * 1000, 1) if state.inferred else 0.0,
+                'max_lag_ms': round(state.lag_max * 1000, 1),
+                'reconnects': capture.reconnects,
+            }
+        return stats
+
+
+def serve_stats(scheduler, port):
+    """/metrics (Prometheus text) and /streams (JSON stats) on a daemon thread"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                body, content_type = render().encode(), 'text/plain; version=0.0.4'
+            elif self.path == '/streams':
+                body, content_type = json.dumps(scheduler.stats()).encode(), 'application/json'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def parse_sources(args):
+    """[(name, source, fps, conf, tiling)] from --source name=url and the optional --config JSON"""
+    default_tiling = tile_config({'tiles': args.tiles} if args.tiles else None)
+    sources = []
+    if args.config:
+        with open(args.config) as f:
+            for entry in json.load(f):
+                sources.append((entry['name'], entry['source'],
+                                float(entry.get('fps', args.fps)), float(entry.get('conf', args.conf)),
+                                tile_config(entry, base=default_tiling)))
+    for spec in args.source or []:
+        name, sep, source = spec.partition('=')
+        if not sep:
+            name, source = f'stream{len(sources)}', spec
+        sources.append((name, source, args.fps, args.conf, default_tiling))
+    return sources
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run detection on many camera streams with one model')
+    parser.add_argument('--source', action='append',
+                        help='Stream as name=url (RTSP/HTTP URL, device index or video file); repeatable')
+    parser.add_argument('--config',
+                        help='JSON list of {"name", "source", "fps", "conf"} streams, optionally with '
+                             'tiling keys ("tiles", "tile_size", "rois", ...)')
+    parser.add_argument('--fps', type=float, default=STREAM_FPS,
+                        help=f'Inference budget per stream, 0 = unlimited (default: {STREAM_FPS})')
+    parser.add_argument('--conf', type=float, default=0.25,
+                        help='Confidence threshold (default: 0.25)')
+    parser.add_argument('--tiles', choices=['off', 'on', 'auto'],
+                        help='Tiled inference for every stream (default: TILE_MODE)')
+    parser.add_argument('--batch-size', type=int, default=STREAM_BATCH_SIZE,
+                        help=f'Maximum frames per model call (default: {STREAM_BATCH_SIZE})')
+    parser.add_argument('--loop', action='store_true',
+                        help='Restart video files when they end')
+    parser.add_argument('--output',
+                        help='Append detections as JSON lines to this file instead of stdout')
+    parser.add_argument('--all-frames', action='store_true',
+                        help='Also write inferred frames without detections')
+    parser.add_argument('--stats-interval', type=float, default=10,
+                        help='Seconds between stats lines on stderr, 0 disables (default: 10)')
+    parser.add_argument('--port', type=int, default=0,
+                        help='Serve /metrics and /streams on this port (default: off)')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    sources = parse_sources(args)
+    if not sources:
+        parser.error('at least one --source or --config stream is required')
+
+    print("Loading model...", file=sys.stderr)
+    model = load_model()
+
+    output = open(args.output, 'a') if args.output else sys.stdout
+    output_lock = threading.Lock()
+
+    def on_result(name, result):
+        if not result['detections'] and not args.all_frames:
+            return
+        with output_lock:
+            output.write(json.dumps(result) + '\n')
+            output.flush()
+
+    scheduler = StreamScheduler(model, on_result, batch_size=args.batch_size)
+    for name, source, fps, conf, tiling in sources:
+        capture = CaptureStream(name, source, fps=fps, conf=conf, loop=args.loop, tiling=tiling,
+                                notify=scheduler.notify)
+        scheduler.add(capture)
+        capture.start()
+    if args.port:
+        serve_stats(scheduler, args.port)
+
+    worker = threading.Thread(target=scheduler.run, daemon=True)
+    worker.start()
+    print(f"Watching {len(sources)} stream(s), Ctrl+C to stop", file=sys.stderr)
+
+    try:
+        while worker.is_alive():
+            worker.join(args.stats_interval or None)
+            if args.stats_interval and worker.is_alive():
+                print(json.dumps({'stats': scheduler.stats()}), file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scheduler.stop()
+        for state in scheduler.streams.values():
+            state.capture.stop()
+        worker.join()
+        print(json.dumps({'stats': scheduler.stats()}), file=sys.stderr)
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
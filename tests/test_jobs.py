@@ -0,0 +1,136 @@
+import io
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jobs import DONE, FAILED, RUNNING, JobManager, MemoryJobStore, SQLiteJobStore  # noqa: E402
+
+
+# Job functions run in the spawned worker processes, so they live at module level
+def finish_when_released(on_progress, input_path, output_path, conf, options):
+    on_progress(1, 2)
+    deadline = time.time() + 30
+    while not os.path.exists(options['release']) and time.time() < deadline:
+        time.sleep(0.01)
+    with open(output_path, 'wb') as f:
+        f.write(b'annotated')
+    return {'has_detections': True, 'conf': conf}
+
+
+def fail(on_progress, input_path, output_path, conf, options):
+    raise RuntimeError('decoder exploded')
+
+
+def wait_for(manager, job_id, condition, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = manager.get(job_id)
+        if condition(job):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f'Job never reached the expected state: {manager.get(job_id)}')
+
+
+@pytest.fixture
+def make_manager(tmp_path):
+    managers = []
+
+    def make(job_function, **kwargs):
+        manager = JobManager(store=MemoryJobStore(), workers=1, job_dir=str(tmp_path / 'jobs'),
+                             model_path=None, job_function=job_function, **kwargs)
+        managers.append(manager)
+        return manager
+
+    yield make
+    for manager in managers:
+        manager.shutdown()
+
+
+def test_job_reports_progress_and_finishes(make_manager, tmp_path):
+    done = []
+    manager = make_manager(finish_when_released)
+    manager.on_done = done.append
+    release = tmp_path / 'release'
+
+    job_id = manager.submit(io.BytesIO(b'not really a video'), 0.4, {'release': str(release)}, session_id='s1')
+
+    job = wait_for(manager, job_id, lambda job: job['status'] == RUNNING)
+    assert job['frames_done'] == 1 and job['total_frames'] == 2
+    assert job['progress'] == pytest.approx(0.5)
+    assert manager.pending() == 1
+
+    release.touch()
+    job = wait_for(manager, job_id, lambda job: job['status'] == DONE)
+    assert job['progress'] == 1.0
+    assert job['result'] == {'has_detections': True, 'conf': 0.4}
+    assert job['session_id'] == 's1'
+    with open(job['output_path'], 'rb') as f:
+        assert f.read() == b'annotated'
+    # The uploaded input belongs to the manager and is removed by the worker
+    assert not os.path.exists(os.path.join(manager.job_dir, f'{job_id}_input.mp4'))
+    assert manager.pending() == 0
+    assert [d['id'] for d in done] == [job_id]
+
+
+def test_failed_job_records_the_error(make_manager):
+    manager = make_manager(fail)
+
+    job_id = manager.submit(io.BytesIO(b'video'), 0.25, {})
+
+    job = wait_for(manager, job_id, lambda job: job['status'] == FAILED)
+    assert 'decoder exploded' in job['error']
+    assert not os.path.exists(job['output_path'])
+
+
+def test_expired_jobs_are_purged_without_new_submissions(make_manager, tmp_path):
+    manager = make_manager(finish_when_released, result_ttl=0, purge_interval=0.1)
+    release = tmp_path / 'release'
+    release.touch()
+
+    job_id = manager.submit(io.BytesIO(b'video'), 0.25, {'release': str(release)})
+    output_path = os.path.join(manager.job_dir, f'{job_id}_output.mp4')
+
+    deadline = time.time() + 30
+    while manager.get(job_id) is not None and time.time() < deadline:
+        time.sleep(0.05)
+    assert manager.get(job_id) is None
+    assert not os.path.exists(output_path)
+
+
+def test_purge_keeps_running_and_recent_jobs(tmp_path):
+    store = MemoryJobStore()
+    manager = JobManager.__new__(JobManager)
+    manager.store = store
+    manager.result_ttl = 3600
+    now = time.time()
+    for job_id, status, updated in [('running', RUNNING, now - 7200), ('recent', DONE, now),
+                                    ('old', DONE, now - 7200), ('old_failed', FAILED, now - 7200)]:
+        output_path = tmp_path / f'{job_id}.mp4'
+        output_path.write_bytes(b'x')
+        store.create(job_id, status=status, updated=updated, output_path=str(output_path))
+
+    manager.purge_expired()
+
+    assert sorted(store.list_ids()) == ['recent', 'running']
+    assert not (tmp_path / 'old.mp4').exists()
+    assert (tmp_path / 'recent.mp4').exists()
+
+
+@pytest.mark.parametrize('make_store', [MemoryJobStore, lambda path: SQLiteJobStore(path)],
+                         ids=['memory', 'sqlite'])
+def test_store_round_trip(make_store, tmp_path):
+    store = make_store() if make_store is MemoryJobStore else make_store(str(tmp_path / 'jobs.db'))
+
+    store.create('a', status='queued', progress=0.0, result=None)
+    store.update('a', status=DONE, progress=1.0, result={'detections': [1, 2]})
+    store.update('missing', status=DONE)
+
+    assert store.get('a') == {'id': 'a', 'status': DONE, 'progress': 1.0, 'result': {'detections': [1, 2]}}
+    assert store.get('missing') is None
+    assert store.list_ids() == ['a']
+    store.delete('a')
+    assert store.get('a') is None and store.list_ids() == []
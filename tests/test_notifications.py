@@ -0,0 +1,201 @@
+import os
+import smtplib
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import alertEmailNotification  # noqa: E402
+from alertEmailNotification import ConexaoSMTP  # noqa: E402
+from notification_dispatcher import (FAILED, SENT, EmailTransport, NotificationDispatcher,  # noqa: E402
+                                     SMSTransport)
+
+
+class RecordingTransport:
+    """Stub transport: records batches and fails the first `failures` sends"""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.sent = []
+        self.attempts = []
+        self.lock = threading.Lock()
+
+    def send(self, recipient, alerts):
+        with self.lock:
+            self.attempts.append(time.perf_counter())
+            if len(self.attempts) <= self.failures:
+                raise ConnectionError('server unavailable')
+            self.sent.append((recipient, list(alerts)))
+
+    def close(self):
+        pass
+
+
+class FakeSMTP:
+    """Stands in for smtplib.SMTP; every instance is one opened connection"""
+
+    instances = []
+
+    def __init__(self, host, port, timeout=None):
+        self.host = host
+        self.port = port
+        self.calls = []
+        self.messages = []
+        self.drop_next = False
+        FakeSMTP.instances.append(self)
+
+    def starttls(self):
+        self.calls.append('starttls')
+
+    def login(self, user, password):
+        self.calls.append(('login', user, password))
+
+    def noop(self):
+        return (250, b'OK')
+
+    def send_message(self, message):
+        if self.drop_next:
+            self.drop_next = False
+            raise smtplib.SMTPServerDisconnected('connection closed')
+        self.messages.append(message)
+
+    def quit(self):
+        self.calls.append('quit')
+
+
+def wait_for_status(dispatcher, delivery_ids, statuses, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        found = [dispatcher.status(delivery_id) for delivery_id in delivery_ids]
+        if all(d is not None and d['status'] in statuses for d in found):
+            return found
+        time.sleep(0.01)
+    raise AssertionError(f'Deliveries never finished: {found}')
+
+
+@pytest.fixture
+def make_dispatcher():
+    dispatchers = []
+
+    def make(transports, **kwargs):
+        options = dict(workers=1, backoff=0.01, batch_window=0.2)
+        options.update(kwargs)
+        dispatcher = NotificationDispatcher(transports=transports, **options)
+        dispatchers.append(dispatcher)
+        return dispatcher
+
+    yield make
+    for dispatcher in dispatchers:
+        dispatcher.close()
+
+
+@pytest.fixture
+def fake_smtp(monkeypatch):
+    FakeSMTP.instances = []
+    monkeypatch.setattr(alertEmailNotification.smtplib, 'SMTP', FakeSMTP)
+    return FakeSMTP
+
+
+def test_alerts_for_one_recipient_are_batched(make_dispatcher):
+    transport = RecordingTransport()
+    dispatcher = make_dispatcher({'email': transport})
+
+    first = [dispatcher.submit('email', 'a@example.com', 'Webcam', f'image{i}') for i in range(3)]
+    other = dispatcher.submit('email', 'b@example.com', 'Vídeo')
+
+    statuses = wait_for_status(dispatcher, first + [other], {SENT, FAILED})
+    assert {d['status'] for d in statuses} == {SENT}
+    assert [d['batch_size'] for d in statuses] == [3, 3, 3, 1]
+    assert sorted(transport.sent) == [
+        ('a@example.com', [('Webcam', 'image0'), ('Webcam', 'image1'), ('Webcam', 'image2')]),
+        ('b@example.com', [('Vídeo', None)]),
+    ]
+
+
+def test_batch_is_sent_when_full_without_waiting_for_the_window(make_dispatcher):
+    transport = RecordingTransport()
+    dispatcher = make_dispatcher({'sms': transport}, batch_window=30, batch_max=2)
+
+    delivery_ids = [dispatcher.submit('sms', '+5511999999999', 'Imagem') for _ in range(2)]
+
+    wait_for_status(dispatcher, delivery_ids, {SENT}, timeout=5)
+    assert len(transport.sent) == 1
+
+
+def test_failed_sends_are_retried_with_backoff(make_dispatcher):
+    transport = RecordingTransport(failures=2)
+    dispatcher = make_dispatcher({'email': transport}, backoff=0.05, batch_window=0.01)
+
+    delivery_id = dispatcher.submit('email', 'a@example.com', 'Webcam')
+
+    [delivery] = wait_for_status(dispatcher, [delivery_id], {SENT, FAILED})
+    assert delivery['status'] == SENT
+    assert delivery['attempts'] == 3
+    assert len(transport.sent) == 1
+    # Exponential backoff with +-50% jitter: >= 0.5 * 0.05 then >= 0.5 * 0.1 seconds
+    gaps = [later - earlier for earlier, later in zip(transport.attempts, transport.attempts[1:])]
+    assert gaps[0] >= 0.025 and gaps[1] >= 0.05
+
+
+def test_delivery_fails_after_max_attempts(make_dispatcher):
+    transport = RecordingTransport(failures=10)
+    dispatcher = make_dispatcher({'email': transport}, max_attempts=3, batch_window=0.01)
+
+    delivery_id = dispatcher.submit('email', 'a@example.com', 'Webcam')
+
+    [delivery] = wait_for_status(dispatcher, [delivery_id], {SENT, FAILED})
+    assert delivery['status'] == FAILED
+    assert delivery['attempts'] == 3
+    assert 'server unavailable' in delivery['error']
+    assert transport.sent == []
+
+
+def test_unknown_channel_is_rejected(make_dispatcher):
+    dispatcher = make_dispatcher({'email': RecordingTransport()})
+    with pytest.raises(ValueError):
+        dispatcher.submit('pager', 'someone', 'Webcam')
+
+
+def test_email_batches_reuse_one_smtp_connection(make_dispatcher, fake_smtp):
+    connection = ConexaoSMTP(servidor='smtp.example.com', porta=587, usuario='user', senha='secret', usar_tls=True)
+    dispatcher = make_dispatcher({'email': EmailTransport(connection)}, batch_window=0.01)
+
+    for recipient in ('a@example.com', 'b@example.com', 'a@example.com'):
+        delivery_id = dispatcher.submit('email', recipient, 'Webcam')
+        wait_for_status(dispatcher, [delivery_id], {SENT})
+
+    [smtp] = fake_smtp.instances
+    assert smtp.calls == ['starttls', ('login', 'user', 'secret')]
+    assert [message['To'] for message in smtp.messages] == ['a@example.com', 'b@example.com', 'a@example.com']
+
+
+def test_smtp_connection_reconnects_once_when_dropped(fake_smtp):
+    connection = ConexaoSMTP(servidor='smtp.example.com', usuario='', usar_tls=False)
+    message = alertEmailNotification.montar_mensagem('a@example.com', [('Webcam', None)])
+
+    connection.enviar(message)
+    fake_smtp.instances[0].drop_next = True
+    connection.enviar(message)
+    connection.fechar()
+
+    first, second = fake_smtp.instances
+    assert len(first.messages) == 1 and first.calls == ['quit']
+    assert len(second.messages) == 1 and second.calls == ['quit']
+
+
+def test_sms_batches_are_one_message_through_one_client():
+    created = []
+    client = SimpleNamespace(messages=SimpleNamespace(
+        create=lambda **fields: created.append(fields) or SimpleNamespace(sid=f'SM{len(created)}')))
+    transport = SMSTransport(client)
+
+    transport.send('+5511999999999', [('Webcam', None)])
+    transport.send('+5511999999999', [('Webcam', None), ('Imagem', None), ('Webcam', None)])
+
+    assert [fields['to'] for fields in created] == ['+5511999999999'] * 2
+    assert created[0]['body'] == 'Alerta: Objeto cortante detectado! Origem: Webcam'
+    assert created[1]['body'] == 'Alerta: 3 detecções de objeto cortante! Origem: Imagem, Webcam'
@@ -0,0 +1,236 @@
+"""
+Tiled / region-of-interest inference for high-resolution frames
+
+YOLO resizes every input to its training size (640), so a small knife on a
+1080p or 4K frame shrinks to a few pixels. In tiled mode the frame is split
+into overlapping model-sized tiles (or only the configured ROIs are cut
+out). The crops of all frames go to the model in batches, and the boxes are
+shifted back to frame coordinates and merged with a class-aware NMS across
+tiles (box_ops.nms). Optionally, the whole frame is also inferred so that
+objects larger than a tile are still found.
+
+`predict_tiled` returns ultralytics `Results` like a plain model call, so
+every consumer (plot(), boxes_to_numpy, the tracker) works unchanged.
+`TiledModel` wraps a model for the video paths that call `model(frames, ...)`.
+"""
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from box_ops import boxes_to_numpy, concat, nms, select
+
+TILE_MODE = os.getenv('TILE_MODE', 'off')  # off | on | auto (only frames larger than TILE_AUTO_FACTOR tiles)
+TILE_SIZE = int(os.getenv('TILE_SIZE', 640))
+TILE_OVERLAP = float(os.getenv('TILE_OVERLAP', 0.2))  # fraction of the tile shared with its neighbour
+TILE_IOU = float(os.getenv('TILE_IOU', 0.5))  # NMS threshold when merging boxes across tiles
+TILE_FULL_FRAME = os.getenv('TILE_FULL_FRAME', '1') == '1'  # also infer the whole (downscaled) frame
+TILE_ROIS = os.getenv('TILE_ROIS', '')  # "x1,y1,x2,y2;..." in pixels, or 0-1 fractions of the frame
+TILE_BATCH_SIZE = int(os.getenv('TILE_BATCH_SIZE', 16))
+TILE_AUTO_FACTOR = 1.5
+
+MODES = ('off', 'on', 'auto')
+
+TileConfig = namedtuple('TileConfig', ['mode', 'size', 'overlap', 'iou', 'rois', 'full_frame'])
+
+
+def parse_rois(spec):
+    """'x1,y1,x2,y2;...' -> tuple of 4-tuples (pixels, or 0-1 fractions of the frame)"""
+    if not spec:
+        return ()
+    if not isinstance(spec, str):
+        return tuple(tuple(float(v) for v in roi) for roi in spec)
+    rois = []
+    for part in spec.split(';'):
+        if part.strip():
+            values = tuple(float(v) for v in part.split(','))
+            if len(values) != 4:
+                raise ValueError(f"ROI needs x1,y1,x2,y2: {part}")
+            rois.append(values)
+    return tuple(rois)
+
+
+DEFAULT_TILING = TileConfig(TILE_MODE, TILE_SIZE, TILE_OVERLAP, TILE_IOU, parse_rois(TILE_ROIS), TILE_FULL_FRAME)
+
+
+def tile_config(values=None, base=DEFAULT_TILING):
+    """
+    Tiling options of one request/stream over the defaults
+
+    values is any mapping (request.values, WebSocket settings, a camera entry)
+    with the optional keys tiles (off/on/auto), tile_size, tile_overlap,
+    tile_iou, tile_full_frame and rois. Raises ValueError for invalid values.
+    """
+    values = values or {}
+    mode = values.get('tiles', base.mode)
+    if mode in (True, '1', 'true'):
+        mode = 'on'
+    elif mode in (False, None, '0', 'false'):
+        mode = 'off'
+    if mode not in MODES:
+        raise ValueError(f"Unknown tile mode: {mode}")
+    full_frame = values.get('tile_full_frame', base.full_frame)
+    if isinstance(full_frame, str):
+        full_frame = full_frame in ('1', 'true')
+    rois = parse_rois(values['rois']) if 'rois' in values else base.rois
+    if rois and mode == 'off':
+        mode = 'on'  # asking for ROIs implies cutting them out
+    config = TileConfig(mode, int(values.get('tile_size', base.size)), float(values.get('tile_overlap', base.overlap)),
+                        float(values.get('tile_iou', base.iou)), rois, bool(full_frame))
+    validate(config)
+    return config
+
+
+def validate(config):
+    """Raise ValueError when a TileConfig can't be used"""
+    if config.size < 32:
+        raise ValueError(f"tile_size must be at least 32 pixels: {config.size}")
+    if not 0 <= config.overlap < 1:
+        raise ValueError(f"tile_overlap must be in [0, 1): {config.overlap}")
+    if not 0 < config.iou <= 1:
+        raise ValueError(f"tile_iou must be in (0, 1]: {config.iou}")
+    for roi in config.rois:
+        if min(roi) < 0 or roi[2] <= roi[0] or roi[3] <= roi[1]:
+            raise ValueError(f"ROI needs 0 <= x1 < x2 and 0 <= y1 < y2: {roi}")
+
+
+def tiling_key(config):
+    """Short description of the tiling options for cache keys ('' when off)"""
+    if config is None or config.mode == 'off':
+        return ''
+    return f'tiles={config.mode},{config.size},{config.overlap},{config.iou},{config.full_frame},{config.rois}'
+
+
+def _starts(length, size, step):
+    if length <= size:
+        return [0]
+    starts = list(range(0, length - size, step))
+    return starts + [length - size]  # last tile flush with the edge
+
+
+def tile_windows(width, height, size=TILE_SIZE, overlap=TILE_OVERLAP, region=None):
+    """Overlapping size x size windows (x1, y1, x2, y2) covering region (default: the frame)"""
+    x0, y0, x1, y1 = region if region is not None else (0, 0, width, height)
+    step = max(1, int(size * (1 - overlap)))
+    return [(x0 + x, y0 + y, min(x1, x0 + x + size), min(y1, y0 + y + size))
+            for y in _starts(y1 - y0, size, step) for x in _starts(x1 - x0, size, step)]
+
+
+def frame_windows(shape, config):
+    """
+    Crops of a frame to infer, or None to infer the frame as is
+
+    The whole frame is listed as (0, 0, width, height) when full_frame is on.
+    """
+    if config is None or config.mode == 'off':
+        return None
+    height, width = shape[:2]
+    if config.rois:
+        windows = []
+        for roi in config.rois:
+            if max(roi) <= 1:
+                roi = (roi[0] * width, roi[1] * height, roi[2] * width, roi[3] * height)
+            x1, y1 = max(0, int(roi[0])), max(0, int(roi[1]))
+            x2, y2 = min(width, int(roi[2])), min(height, int(roi[3]))
+            if x2 > x1 and y2 > y1:
+                # Large ROIs are tiled too
+                windows += tile_windows(width, height, config.size, config.overlap, (x1, y1, x2, y2))
+        return windows
+    if config.mode == 'auto' and max(width, height) <= config.size * TILE_AUTO_FACTOR:
+        return None
+    windows = tile_windows(width, height, config.size, config.overlap)
+    if config.full_frame and len(windows) > 1:
+        windows.append((0, 0, width, height))
+    return windows
+
+
+def _to_results(image, detections, names):
+    import torch
+    from ultralytics.engine.results import Results
+
+    data = np.concatenate([detections.xyxy, detections.conf[:, None],
+                           detections.cls[:, None].astype(np.float32)], axis=1)
+    return Results(image, path='', names=names, boxes=torch.from_numpy(data))
+
+
+def predict_tiled(model, images, conf, configs, **kwargs):
+    """
+    Run the model over the tiles of several frames in shared batches
+
+    Args:
+        model: Detection model (called with a list of images)
+        images: List of frames
+        conf: Confidence threshold
+        configs: One TileConfig for all frames, or one per frame (None = no tiling)
+
+    Returns:
+        One Results per frame; frames without tiling get the model's own result
+    """
+    if configs is None or isinstance(configs, TileConfig):
+        configs = [configs] * len(images)
+    kwargs.setdefault('verbose', False)
+
+    crops, owners = [], []  # one entry per model input: (frame index, window or None)
+    tiled = False
+    for i, (image, config) in enumerate(zip(images, configs)):
+        windows = frame_windows(image.shape, config)
+        tiled = tiled or windows is not None
+        if windows is None:
+            crops.append(image)
+            owners.append((i, None))
+        else:
+            for x1, y1, x2, y2 in windows:
+                crops.append(image[y1:y2, x1:x2])
+                owners.append((i, (x1, y1)))
+    if not tiled:
+        return model(images, conf=conf, **kwargs)
+
+    raw = []
+    for start in range(0, len(crops), TILE_BATCH_SIZE):
+        raw.extend(model(crops[start:start + TILE_BATCH_SIZE], conf=conf, **kwargs))
+
+    names = raw[0].names if raw else {}
+    plain = {}
+    parts = [[] for _ in images]
+    for (i, offset), result in zip(owners, raw):
+        if offset is None:
+            plain[i] = result
+            continue
+        detections = boxes_to_numpy(result.boxes)
+        if len(detections.conf):
+            shift = np.array([offset[0], offset[1], offset[0], offset[1]], dtype=np.float32)
+            parts[i].append(detections._replace(xyxy=detections.xyxy + shift))
+
+    results = []
+    for i, image in enumerate(images):
+        if i in plain:
+            results.append(plain[i])
+            continue
+        merged = concat(parts[i])
+        if len(merged.conf):
+            merged = select(merged, nms(merged.xyxy, merged.conf, configs[i].iou, classes=merged.cls))
+        results.append(_to_results(image, merged, names))
+    return results
+
+
+class TiledModel:
+    """Model wrapper that runs every call through predict_tiled with one TileConfig"""
+
+    def __init__(self, model, config):
+        self.model = model
+        self.config = config
+
+    def __call__(self, source, conf=0.25, **kwargs):
+        if isinstance(source, list):
+            return predict_tiled(self.model, source, conf, self.config, **kwargs)
+        return predict_tiled(self.model, [source], conf, self.config, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+def with_tiling(model, config):
+    """The model itself when tiling is off, else a TiledModel"""
+    if config is None or config.mode == 'off':
+        return model
+    return TiledModel(model, config)
@@ -0,0 +1,197 @@
+"""
+Memory-bounded upload handling
+
+- MAX_UPLOAD_MB caps the request body (Flask MAX_CONTENT_LENGTH, 413 above it)
+- form uploads up to UPLOAD_SPOOL_MB are kept in a BytesIO (frame_io takes
+  its bytes with getvalue()); larger or unsized ones are spooled to
+  UPLOAD_DIR (point it at a disk volume: on Cloud Run /tmp is RAM), instead
+  of werkzeug's fixed 500 KB in-memory threshold on /tmp
+- videos longer than MAX_VIDEO_SECONDS are rejected before any inference
+- `temp_path` always removes its temp file
+- raw video bodies (Content-Type: video/*) can be decoded with PyAV while
+  they are still arriving (`StreamCapture`), without a temp file at all
+"""
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import cv2
+from flask import Request
+
+MAX_UPLOAD_MB = float(os.getenv('MAX_UPLOAD_MB', 200))
+UPLOAD_SPOOL_MB = float(os.getenv('UPLOAD_SPOOL_MB', 8))
+UPLOAD_DIR = os.getenv('UPLOAD_DIR') or None  # None = the system temp dir
+MAX_VIDEO_SECONDS = float(os.getenv('MAX_VIDEO_SECONDS', 600))  # 0 disables the duration limit
+
+MAX_UPLOAD_BYTES = int(MAX_UPLOAD_MB * 1024 * 1024)
+UPLOAD_SPOOL_BYTES = int(UPLOAD_SPOOL_MB * 1024 * 1024)
+COPY_CHUNK = 1024 * 1024
+
+
+class UploadRejected(ValueError):
+    """Upload over the size or duration limits (answered with 413)"""
+
+
+class SpooledRequest(Request):
+    """Flask request whose file parts stay in memory up to UPLOAD_SPOOL_MB and are spooled to UPLOAD_DIR beyond"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= UPLOAD_SPOOL_BYTES:
+            return io.BytesIO()
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES, dir=UPLOAD_DIR)
+
+
+def remove(path):
+    """Delete a temp file if it is still there"""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+@contextmanager
+def temp_path(suffix='.mp4'):
+    """Path of a new temp file in UPLOAD_DIR, removed on exit"""
+    with tempfile.NamedTemporaryFile(suffix=suffix, dir=UPLOAD_DIR, delete=False) as temp:
+        path = temp.name
+    try:
+        yield path
+    finally:
+        remove(path)
+
+
+def save_upload(file, path):
+    """
+    Copy an uploaded FileStorage to path in chunks (never the whole upload in memory)
+
+    Returns the SHA-256 hex digest of the content (alert dedup key).
+    """
+    stream = getattr(file, 'stream', file)
+    stream.seek(0)
+    digest = hashlib.sha256()
+    with open(path, 'wb') as out:
+        while True:
+            chunk = stream.read(COPY_CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+    return digest.hexdigest()
+
+
+def video_duration(path):
+    """Duration in seconds from the container metadata (None when unknown)"""
+    cap = cv2.VideoCapture(path)
+    try:
+        if not cap.isOpened():
+            return None
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        return frames / fps if fps > 0 and frames > 0 else None
+    finally:
+        cap.release()
+
+
+def check_video(path, max_seconds=MAX_VIDEO_SECONDS):
+    """Raise UploadRejected when the video is longer than max_seconds"""
+    if not max_seconds:
+        return
+    duration = video_duration(path)
+    if duration is not None and duration > max_seconds:
+        raise UploadRejected(f"Video is {duration:.0f}s long; the limit is {max_seconds:.0f}s")
+
+
+def is_raw_video(request):
+    """Whether the request body is the video itself (Content-Type: video/*) rather than a form"""
+    return (request.mimetype or '').startswith('video/')
+
+
+class LimitedStream:
+    """
+    Read-only view of the request body that stops at max_bytes (UploadRejected above it)
+
+    `sha256` hashes the bytes read so far (alert dedup key).
+    """
+
+    def __init__(self, stream, max_bytes=MAX_UPLOAD_BYTES):
+        self.stream = stream
+        self.max_bytes = max_bytes
+        self.received = 0
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.stream.read(size if size is not None and size >= 0 else COPY_CHUNK)
+        self.received += len(data)
+        self.sha256.update(data)
+        if self.max_bytes and self.received > self.max_bytes:
+            raise UploadRejected(f"Upload is larger than {self.max_bytes // (1024 * 1024)} MB")
+        return data
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+
+class StreamCapture:
+    """
+    cv2.VideoCapture look-alike decoding a non-seekable stream with PyAV
+
+    Frames are returned as soon as the container and the first packets have
+    arrived, so decoding and inference overlap with the upload. Needs a
+    format that can be read front to back (MPEG-TS, WebM/MKV, fragmented or
+    "faststart" MP4). Stops (read() -> False, `truncated` set) after
+    max_seconds of video.
+    """
+
+    def __init__(self, stream, max_seconds=MAX_VIDEO_SECONDS):
+        import av
+
+        self.max_seconds = max_seconds
+        self.truncated = False
+        self._container = av.open(stream, mode='r')
+        self._video = self._container.streams.video[0]
+        self._video.thread_type = 'AUTO'
+        self._frames = self._container.decode(self._video)
+        self._lock = threading.Lock()
+        rate = self._video.average_rate or self._video.guessed_rate
+        self._fps = float(rate) if rate else 30.0
+        self._count = 0
+
+    def isOpened(self):
+        return self._container is not None
+
+    def read(self):
+        with self._lock:
+            if self._container is None:
+                return False, None
+            try:
+                frame = next(self._frames)
+            except StopIteration:
+                return False, None
+            self._count += 1
+            if self.max_seconds and self._count / self._fps > self.max_seconds:
+                self.truncated = True
+                return False, None
+            return True, frame.to_ndarray(format='bgr24')
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self._video.codec_context.width)
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self._video.codec_context.height)
+        if prop == cv2.CAP_PROP_FPS:
+            return self._fps
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(self._video.frames or 0)
+        return 0.0
+
+    def release(self):
+        with self._lock:
+            if self._container is not None:
+                self._container.close()
+                self._container = None
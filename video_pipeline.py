@@ -0,0 +1,422 @@
+import os
+import heapq
+import queue
+import threading
+import time
+
+import cv2
+
+from box_ops import boxes_to_numpy, empty_detections, to_dicts
+from render import draw_detections, encode_jpeg
+from metrics import NULL_TIMER
+from motion import MOTION_METHOD, MotionGate
+from Rastrear import INTERVALO_QUADROS_CHAVE, PropagadorCaixas
+from tiling import with_tiling
+
+# Video pipeline defaults (can be overridden per request in /api/detect)
+VIDEO_BATCH_SIZE = int(os.getenv('VIDEO_BATCH_SIZE', 8))
+VIDEO_FRAME_STRIDE = int(os.getenv('VIDEO_FRAME_STRIDE', 1))
+VIDEO_MOTION_THRESHOLD = float(os.getenv('VIDEO_MOTION_THRESHOLD', 0))
+VIDEO_QUEUE_SIZE = int(os.getenv('VIDEO_QUEUE_SIZE', 32))
+VIDEO_MAX_PENDING = int(os.getenv('VIDEO_MAX_PENDING', 64))
+# Run YOLO every Nth frame and move the boxes with optical flow in between (0/1 disables)
+VIDEO_KEYFRAME_INTERVAL = INTERVALO_QUADROS_CHAVE
+
+# Detection-only timeline (output=json for videos)
+TIMELINE_THUMBNAILS = int(os.getenv('TIMELINE_THUMBNAILS', 4))
+TIMELINE_THUMBNAIL_WIDTH = int(os.getenv('TIMELINE_THUMBNAIL_WIDTH', 320))
+TIMELINE_SEGMENT_GAP = float(os.getenv('TIMELINE_SEGMENT_GAP', 1.0))  # seconds without detections that end a segment
+
+_END = object()
+
+
+class FrameReader(threading.Thread):
+    """
+    Decode frames from a cv2.VideoCapture on a background thread
+
+    Frames are pushed into a bounded queue so decoding overlaps with inference
+    without holding the whole video in memory.
+    """
+
+    def __init__(self, cap, max_queue=VIDEO_QUEUE_SIZE):
+        super().__init__(daemon=True)
+        self.cap = cap
+        self.frames = queue.Queue(maxsize=max_queue)
+        self.error = None
+        self.decode_seconds = 0.0  # time spent in cap.read(), for the stage breakdown
+        self._stopped = threading.Event()
+
+    def run(self):
+        try:
+            index = 0
+            while not self._stopped.is_set():
+                start = time.perf_counter()
+                ret, frame = self.cap.read()
+                self.decode_seconds += time.perf_counter() - start
+                if not ret:
+                    break
+                if not self._put((index, frame)):
+                    break
+                index += 1
+        except Exception as e:
+            self.error = e
+        finally:
+            self._put(_END)
+
+    def _put(self, item):
+        while not self._stopped.is_set():
+            try:
+                self.frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def stop(self):
+        self._stopped.set()
+
+    def __iter__(self):
+        while True:
+            item = self.frames.get()
+            if item is _END:
+                if self.error is not None:
+                    raise self.error
+                return
+            yield item
+
+
+def iter_video_detections(cap, model, conf, batch_size=VIDEO_BATCH_SIZE,
+                          frame_stride=VIDEO_FRAME_STRIDE,
+                          motion_threshold=VIDEO_MOTION_THRESHOLD, motion_method=MOTION_METHOD,
+                          timer=NULL_TIMER):
+    """
+    Run YOLO over a video in batches, skipping frames by stride and/or motion
+
+    Args:
+        cap: Opened cv2.VideoCapture
+        model: YOLO model (called with a list of frames)
+        conf: Confidence threshold for detections
+        batch_size: Number of frames sent to the model per call
+        frame_stride: Run detection only on every Nth frame
+        motion_threshold: Minimum fraction of changed pixels (0-1) since the
+            last inferred frame for a frame to be inferred; 0 disables it
+        motion_method: 'diff' (frame differencing) or 'mog2' (background subtraction)
+        timer: metrics.StageTimer receiving the decode/motion/infer times
+
+    Yields:
+        (index, frame, result, inferred) for every frame, in order. Skipped
+        frames carry the result of the last inferred frame (None before the
+        first inference).
+    """
+    batch_size = max(1, int(batch_size))
+    frame_stride = max(1, int(frame_stride))
+
+    reader = FrameReader(cap)
+    reader.start()
+
+    pending = []  # (index, frame, inferred) waiting for the next model call
+    last_result = None
+    gate = MotionGate(motion_threshold, motion_method, max_skip=0, stream='video') if motion_threshold > 0 else None
+
+    def flush():
+        nonlocal last_result
+        batch = [frame for _, frame, inferred in pending if inferred]
+        with timer.stage('infer'):
+            results = model(batch, conf=conf, verbose=False) if batch else []
+        position = 0
+        for index, frame, inferred in pending:
+            if inferred:
+                last_result = results[position]
+                position += 1
+            yield index, frame, last_result, inferred
+        pending.clear()
+
+    try:
+        for index, frame in reader:
+            inferred = index % frame_stride == 0
+            if inferred and gate is not None:
+                with timer.stage('motion'):
+                    inferred = gate.should_infer(frame)
+
+            pending.append((index, frame, inferred))
+
+            to_infer = sum(1 for _, _, flag in pending if flag)
+            if to_infer >= batch_size or len(pending) >= VIDEO_MAX_PENDING:
+                yield from flush()
+
+        yield from flush()
+    finally:
+        reader.stop()
+        reader.join()
+        # Decoding overlaps with the other stages (reader thread)
+        timer.add('decode', reader.decode_seconds)
+
+
+def iter_propagated_detections(cap, model, conf, keyframe_interval, batch_size=VIDEO_BATCH_SIZE,
+                               timer=NULL_TIMER):
+    """
+    Run YOLO on keyframes only and propagate the boxes with optical flow
+
+    Every keyframe_interval-th frame is a keyframe; keyframes are still sent
+    to the model in batches, then the frames are walked in order so each
+    in-between frame moves the boxes of the previous one (Rastrear.PropagadorCaixas).
+
+    Yields:
+        (index, frame, detections, keyframe) for every frame, in order, with
+        detections as a box_ops.Detections tuple
+    """
+    keyframe_interval = max(1, int(keyframe_interval))
+    batch_size = max(1, int(batch_size))
+
+    reader = FrameReader(cap)
+    reader.start()
+
+    pending = []  # (index, frame, keyframe) waiting for the next model call
+    propagator = PropagadorCaixas(keyframe_interval)
+
+    def flush():
+        batch = [frame for _, frame, keyframe in pending if keyframe]
+        with timer.stage('infer'):
+            results = model(batch, conf=conf, verbose=False) if batch else []
+        position = 0
+        for index, frame, keyframe in pending:
+            with timer.stage('propagate'):
+                if keyframe:
+                    detections = boxes_to_numpy(results[position].boxes)
+                    propagator.quadro_chave(frame, detections)
+                    position += 1
+                else:
+                    detections = propagator.propagar(frame)
+            yield index, frame, detections, keyframe
+        pending.clear()
+
+    try:
+        for index, frame in reader:
+            pending.append((index, frame, index % keyframe_interval == 0))
+            keyframes = sum(1 for _, _, flag in pending if flag)
+            if keyframes >= batch_size or len(pending) >= VIDEO_MAX_PENDING:
+                yield from flush()
+
+        yield from flush()
+    finally:
+        reader.stop()
+        reader.join()
+        timer.add('decode', reader.decode_seconds)
+
+
+def iter_annotated_frames(cap, model, conf, timer=NULL_TIMER, keyframe_interval=VIDEO_KEYFRAME_INTERVAL,
+                          tiling=None, **options):
+    """
+    Annotated frames of a video, by motion/stride skipping or keyframe propagation
+
+    With keyframe_interval > 1 the boxes between keyframes come from optical
+    flow (the stride and motion options are ignored); otherwise skipped
+    frames reuse the last result as in iter_video_detections. With a tiling
+    config (tiling.TileConfig) every inferred frame goes through tiled inference.
+
+    Yields:
+        (index, annotated_frame, detections, inferred) for every frame, in order
+    """
+    model = with_tiling(model, tiling)
+    if keyframe_interval and keyframe_interval > 1:
+        batch_size = options.get('batch_size', VIDEO_BATCH_SIZE)
+        for index, frame, detections, keyframe in iter_propagated_detections(
+                cap, model, conf, keyframe_interval, batch_size, timer):
+            with timer.stage('annotate'):
+                annotated_frame = draw_detections(frame, to_dicts(detections))
+            yield index, annotated_frame, detections, keyframe
+        return
+
+    for index, frame, result, inferred in iter_video_detections(cap, model, conf, timer=timer, **options):
+        with timer.stage('annotate'):
+            annotated_frame = annotate(frame, result, inferred)
+        detections = boxes_to_numpy(result.boxes) if result is not None else empty_detections()
+        yield index, annotated_frame, detections, inferred
+
+
+def annotate(frame, result, inferred):
+    """Draw detections on a frame, reusing the last result on skipped frames"""
+    if result is None:
+        return frame
+    if inferred:
+        return result.plot()
+    if len(result.boxes) == 0:
+        return frame
+    return result.plot(img=frame)
+
+
+def render_video(input_path, output_path, model, conf, on_progress=None, timer=NULL_TIMER, **options):
+    """
+    Annotate a whole video file and collect its detections
+
+    Args:
+        input_path: Path to the input video
+        output_path: Path where the annotated mp4 is written
+        model: YOLO model
+        conf: Confidence threshold for detections
+        on_progress: Optional callable(frames_done, total_frames)
+        timer: metrics.StageTimer receiving the per-stage times
+        **options: batch_size, frame_stride, motion_threshold, motion_method,
+            keyframe_interval and tiling
+
+    Returns:
+        (has_detections, detections, first_detection_frame)
+    """
+    cap = cv2.VideoCapture(input_path)
+    if not cap.isOpened():
+        raise ValueError("Could not open video file")
+
+    out = None
+    try:
+        # Get video properties
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = int(cap.get(cv2.CAP_PROP_FPS))
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+        # Create video writer
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+
+        has_detections = False
+        detections = []
+        first_detection_frame = None
+        frames_done = 0
+
+        # Frames are decoded on a reader thread and sent to the model in batches;
+        # skipped frames reuse the boxes of the last inferred frame (or, with a
+        # keyframe interval, the boxes moved by optical flow)
+        for _, annotated_frame, frame_detections, _ in iter_annotated_frames(
+                cap, model, conf, timer=timer, **options):
+            # Check for detections
+            if len(frame_detections.conf) > 0:
+                has_detections = True
+                detections.extend(to_dicts(frame_detections, with_box=False))
+
+                # Save first frame with detections
+                if first_detection_frame is None:
+                    first_detection_frame = annotated_frame.copy()
+
+            # Write frame
+            with timer.stage('write'):
+                out.write(annotated_frame)
+
+            frames_done += 1
+            if on_progress is not None and frames_done % 30 == 0:
+                on_progress(frames_done, total_frames)
+
+        if on_progress is not None:
+            on_progress(frames_done, max(total_frames, frames_done))
+
+        return has_detections, detections, first_detection_frame
+    finally:
+        # Release resources
+        cap.release()
+        if out is not None:
+            out.release()
+
+
+def video_timeline(input_path, model, conf, max_thumbnails=TIMELINE_THUMBNAILS,
+                   thumbnail_width=TIMELINE_THUMBNAIL_WIDTH, segment_gap=TIMELINE_SEGMENT_GAP,
+                   timer=NULL_TIMER, **options):
+    """
+    Detections of a video without plotting or re-encoding it
+
+    Only inferred frames are reported (with a stride or motion threshold the
+    skipped frames add nothing). Consecutive detections, with gaps shorter
+    than segment_gap seconds, form a segment; the best frame of the
+    highest-confidence segments is kept as a small annotated JPEG thumbnail.
+
+    Args:
+        input_path: Path to the input video
+        model: YOLO model
+        conf: Confidence threshold for detections
+        max_thumbnails: Number of keyframe thumbnails returned
+        thumbnail_width: Width of the thumbnails in pixels
+        segment_gap: Seconds without detections that close a segment
+        timer: metrics.StageTimer receiving the per-stage times
+        **options: batch_size, frame_stride, motion_threshold, motion_method
+            and tiling; a keyframe_interval acts as a frame stride (propagated
+            boxes add nothing to the timeline)
+
+    Returns:
+        dict with the video properties, 'timeline' (frame, timestamp,
+        detections), 'segments' and 'thumbnails' (JPEG bytes)
+    """
+    model = with_tiling(model, options.pop('tiling', None))
+    keyframe_interval = options.pop('keyframe_interval', 0)
+    if keyframe_interval and keyframe_interval > 1:
+        options['frame_stride'] = max(keyframe_interval, options.get('frame_stride', 1))
+
+    cap = cv2.VideoCapture(input_path)
+    if not cap.isOpened():
+        raise ValueError("Could not open video file")
+
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        scale = min(1.0, thumbnail_width / width) if width else 1.0
+
+        timeline = []
+        segments = []
+        best = []  # min-heap of (confidence, frame index, thumbnail) for the top segments
+        segment = None
+        frames = 0
+
+        def close_segment():
+            segments.append({key: segment[key] for key in ('start', 'end', 'max_confidence', 'frame')})
+            entry = (segment['max_confidence'], segment['frame'], segment['thumbnail'])
+            if len(best) < max_thumbnails:
+                heapq.heappush(best, entry)
+            elif max_thumbnails and entry[:2] > best[0][:2]:
+                heapq.heapreplace(best, entry)
+
+        for index, frame, result, inferred in iter_video_detections(cap, model, conf, timer=timer, **options):
+            frames += 1
+            if not inferred:
+                continue
+            detections = to_dicts(boxes_to_numpy(result.boxes))
+            if not detections:
+                continue
+
+            timestamp = round(index / fps, 3)
+            timeline.append({'frame': index, 'timestamp': timestamp, 'detections': detections})
+            confidence = max(d['confidence'] for d in detections)
+
+            if segment is not None and timestamp - segment['end'] > segment_gap:
+                close_segment()
+                segment = None
+            if segment is None:
+                segment = {'start': timestamp, 'end': timestamp, 'max_confidence': 0.0, 'frame': index}
+            segment['end'] = timestamp
+
+            if confidence > segment['max_confidence']:
+                # New best frame of the segment: keep a small annotated copy
+                with timer.stage('thumbnail'):
+                    thumbnail = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+                    scaled = [dict(d, box=[v * scale for v in d['box']]) for d in detections]
+                    segment.update(max_confidence=confidence, frame=index,
+                                   thumbnail=draw_detections(thumbnail, scaled, thickness=1))
+
+        if segment is not None:
+            close_segment()
+
+        with timer.stage('encode'):
+            thumbnails = [{'frame': index, 'timestamp': round(index / fps, 3),
+                           'confidence': confidence, 'image': encode_jpeg(image, quality=80)}
+                          for confidence, index, image in sorted(best, key=lambda entry: entry[1])]
+
+        return {
+            'fps': fps,
+            'width': width,
+            'height': height,
+            'frames': frames,
+            'has_detections': bool(timeline),
+            'max_confidence': max((s['max_confidence'] for s in segments), default=0.0),
+            'timeline': timeline,
+            'segments': segments,
+            'thumbnails': thumbnails,
+        }
+    finally:
+        cap.release()
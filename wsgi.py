@@ -0,0 +1,31 @@
+"""
+Production entry point: `gunicorn -c gunicorn.conf.py wsgi:app`
+
+PRELOAD_MODEL selects how the model is loaded:
+
+- 1 (default): with preload_app the master imports this module, loads and
+  warms the model once and then forks the workers, which share the weights
+  copy-on-write
+- background: cold-start mode. The master only imports the web stack (no
+  torch/ultralytics), so workers answer /healthz within a fraction of a
+  second; each worker then loads its own model on a background thread
+  (gunicorn.conf.py post_fork) and /readyz turns 200 when it is warm
+- 0: the model is loaded by the first request that needs it
+"""
+import gc
+import os
+
+from flask_app import app, warm_up_model
+
+if os.getenv('PRELOAD_MODEL', '1') == '1':
+    import torch
+
+    # Keep the master single-threaded so the forked workers don't inherit a
+    # half-initialized OpenMP pool; each worker sets its own thread count
+    torch.set_num_threads(1)
+    warm_up_model()
+
+    # Move everything allocated so far out of the GC's reach so collections in
+    # the workers don't touch (and copy) the shared pages
+    gc.collect()
+    gc.freeze()